@@ -1,8 +1,31 @@
+import atexit
+import json
 import logging
+import logging.handlers
 import os
+import queue
 from datetime import datetime
 import config.settings
 
+# Handlers run in a QueueListener thread, the decision threads only put records into a queue.
+_listeners = []
+
+def _start_listener(logger: logging.Logger, *handlers: logging.Handler,
+                    queue_handler: type = logging.handlers.QueueHandler) -> logging.handlers.QueueListener:
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(queue_handler(log_queue))
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    _listeners.append(listener)
+    return listener
+
+def stop_logging():
+    """Flush and stop the listener threads, registered with atexit."""
+    while _listeners:
+        _listeners.pop().stop()
+
+atexit.register(stop_logging)
+
 # Define a global logger
 def setup_logger(log_file="app.log", level=logging.INFO):
     """Setup and return a logger instance."""
@@ -22,14 +45,59 @@ def setup_logger(log_file="app.log", level=logging.INFO):
     file_handler.setFormatter(formatter)
     console_handler.setFormatter(formatter)
 
-    # Add handlers to the logger
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    # Add handlers to the logger, through a queue so file and console I/O happen off the calling thread
+    _start_listener(logger, file_handler, console_handler)
 
     logger.info('###Logger initialized.###')
     return logger
 
 
+class _RecordQueueHandler(logging.handlers.QueueHandler):
+    """Enqueue the record untouched, the dict payload is serialized by the listener."""
+    def prepare(self, record):
+        return record
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(record.msg, separators=(',', ':'))
+
+
+decision_logger = logging.getLogger('bili_tetris.decisions')
+decision_logger.propagate = False
+_decision_listener = None
+
+def log_decision(record: dict):
+    """
+    Write one structured decision record as a JSON line to LOG_DECISION_DIR, only when LOG_DECISIONS is on.
+    The record must not be modified afterwards, it is serialized later in the listener thread.
+    """
+    global _decision_listener
+    if not config.settings.LOG_DECISIONS:
+        return
+    if _decision_listener is None:
+        os.makedirs(config.settings.LOG_DECISION_DIR, exist_ok=True)
+        path = os.path.join(config.settings.LOG_DECISION_DIR, f"decisions.{datetime.now().strftime('%Y-%m-%d_%H-%M')}.jsonl")
+        file_handler = logging.FileHandler(path, encoding='utf-8')
+        file_handler.setFormatter(_JsonFormatter())
+        decision_logger.setLevel(logging.INFO)
+        _decision_listener = _start_listener(decision_logger, file_handler, queue_handler=_RecordQueueHandler)
+    decision_logger.info(record)
+
+def close_decision_log():
+    """Flush and close the decision file, the next record opens a new one."""
+    global _decision_listener
+    if _decision_listener is None:
+        return
+    _decision_listener.stop()
+    _listeners.remove(_decision_listener)
+    for handler in _decision_listener.handlers:
+        handler.close()
+    for handler in list(decision_logger.handlers):
+        decision_logger.removeHandler(handler)
+    _decision_listener = None
+
+
 # Initialize the global logger
 current_date = datetime.now().strftime("%Y-%m-%d")
 LOG_FILE_PATH = os.path.join(os.path.dirname(__file__), "logs", f"app.{datetime.now().strftime('%Y-%m-%d_%H-%M')}.log")
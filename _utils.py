@@ -8,10 +8,14 @@ Description:
 
 import config.settings
 from _logger import logger
+import threading
 from enum import Enum
 from typing import List, Tuple, Dict, Union, Optional
-import pygetwindow as gw
 import numpy as np
+try:
+    import pygetwindow as gw
+except (ImportError, NotImplementedError): # pygetwindow does not support Linux, replay capture still works there
+    gw = None
 
 class SingletonMeta(type):
     _instances = {}
@@ -20,6 +24,36 @@ class SingletonMeta(type):
             instance = super().__call__(*args, **kwargs)
             cls._instances[cls] = instance
         return cls._instances[cls]
+
+
+_context = threading.local()
+
+def bind_context(key) -> None:
+    """
+    Bind the calling thread to a game context, e.g. one window of the orchestrator. None is the default context.
+    """
+    _context.key = key
+
+def current_context():
+    return getattr(_context, 'key', None)
+
+class ContextSingletonMeta(type):
+    """
+    One instance per class and game context of the calling thread (bind_context).
+    Threads that never bind share the default instance, like SingletonMeta.
+    """
+    _instances = {}
+    _lock = threading.Lock()
+    def __call__(cls, *args, **kwargs):
+        key = (cls, current_context())
+        instance = cls._instances.get(key)
+        if instance is None:
+            with cls._lock:
+                instance = cls._instances.get(key)
+                if instance is None:
+                    instance = super().__call__(*args, **kwargs)
+                    cls._instances[key] = instance
+        return instance
     
 
 class classonlymethod(classmethod):
@@ -33,20 +67,41 @@ class classonlymethod(classmethod):
     
 class WindowUtils:
     @classonlymethod
-    def find_tetris_window(cls) -> gw.Window:
+    def find_tetris_windows(cls) -> List['gw.Window']:
         """
-        Find the Tetris window based on the title.
+        Every window with the Tetris title, one per running game client.
         """
+        if gw is None:
+            raise RuntimeError("pygetwindow is not available on this platform.")
         windows = gw.getWindowsWithTitle(config.settings.CV_WINDOW_TITLE)
         if not windows:
             raise RuntimeError(f"Window '{config.settings.CV_WINDOW_TITLE}' not found.")
-        return windows[0]  # Win32window type, get the first one, since if try to find a window solely by name may reture multiple windows.
+        return windows
+
+    @classonlymethod
+    def find_tetris_window(cls) -> 'gw.Window':
+        """
+        Find the Tetris window based on the title.
+        """
+        return cls.find_tetris_windows()[0]  # Win32window type, get the first one, since if try to find a window solely by name may reture multiple windows.
+
+    @classonlymethod
+    def find_window_by_handle(cls, hwnd: int) -> 'gw.Window':
+        """
+        The window of a handle, for another process that was given window._hWnd.
+        """
+        if gw is None:
+            raise RuntimeError("pygetwindow is not available on this platform.")
+        return gw.Window(hwnd)
 
     @classonlymethod
-    def bring_to_front(cls, window: gw.Window) -> None:
+    def bring_to_front(cls, window: 'gw.Window') -> None:
         """
         Bring the Tetris window to the front.
         """
+        if gw is None:
+            logger.error("pygetwindow is not available. Cannot set focus to window.")
+            return
         if not isinstance(window, gw.Window):
             raise TypeError("Expected a pygetwindow.Window instance.")
         try:
@@ -55,7 +110,35 @@ class WindowUtils:
         except ImportError:
             logger.error("win32gui module is not available. Cannot set focus to window.")
             return
+
+    @classonlymethod
+    def get_window_dpi(cls, window) -> int:
+        """
+        DPI of the monitor the window is on, 96 when it cannot be queried (not Windows, replayed frames).
+        """
+        hwnd = getattr(window, '_hWnd', None)
+        if hwnd is None:
+            return 96
+        try:
+            import ctypes
+            dpi = ctypes.windll.user32.GetDpiForWindow(hwnd)
+            return dpi if dpi > 0 else 96
+        except (AttributeError, OSError):
+            return 96
         
+def pack_board(board: np.ndarray) -> bytes:
+    '''
+    Occupancy of a board as bits, row major: 25 bytes for 20x10 instead of a text dump.
+    '''
+    return np.packbits(board != 0, axis=None).tobytes()
+
+def unpack_board(data: bytes, shape: Tuple[int, int] = (20, 10)) -> np.ndarray:
+    '''
+    Inverse of pack_board, cells are 0 or 1.
+    '''
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8), count=shape[0] * shape[1])
+    return bits.reshape(shape).astype(np.int8)
+
 class TetrisBlockType(Enum):
     I = "I"
     O = "O"
@@ -205,10 +288,10 @@ class Tetrominoes:
     
     
     
-    Tetris_Col_H: Optional[ dict[ TetrisBlockType, Union[np.ndarray,list[list]] ] ]= {}    
+    Tetris_Col_H: Optional[ dict[ TetrisBlockType, Union[np.ndarray,list[list]] ] ]= None
     # for each block type, have ndarray, first dimension is spin, second dimension is 4 columns height that been filled.
 
-    # this variable will build statically at each time this script first imported.
+    # this variable is built with the other tables by build_tables() on first use (or by the startup prewarm), not on import.
     # typically it looks like this
     '''
         {<TetrisBlockType.T: 'T'>: [[3, 3, 3, 0],
@@ -229,17 +312,47 @@ class Tetrominoes:
         <TetrisBlockType.S: 'S'>: [[0, 2, 3, 0], [3, 3, 2, 0]]}
     '''
 
+    # per block type and spin: read-only 4x4 int array, and (first, last) filled column of the 4x4 grid
+    _matrices: Optional[Dict[TetrisBlockType, List[np.ndarray]]] = None
+    _col_bounds: Optional[Dict[TetrisBlockType, List[Tuple[int, int]]]] = None
 
+    @classonlymethod
+    def build_tables(cls):
+        if cls._matrices is not None:
+            return
+        col_h, matrices, bounds = {}, {}, {}
+        for block_type, rotations in cls.shapes.items():
+            col_h[block_type], matrices[block_type], bounds[block_type] = [], [], []
+            for shape in rotations:
+                shape_np = np.array(shape)
+                shape_np.setflags(write=False) # shared by every search
+                col_heights = [0] * 4
+                for col_idx in range(4):
+                    for row_idx in range(4):
+                        if shape_np[row_idx][col_idx]:
+                            col_heights[col_idx] = row_idx + 1
+                used_cols = np.nonzero(shape_np.any(axis=0))[0]
+                col_h[block_type].append(col_heights)
+                matrices[block_type].append(shape_np)
+                bounds[block_type].append((int(used_cols[0]), int(used_cols[-1])))
+        cls.Tetris_Col_H, cls._col_bounds = col_h, bounds
+        cls._matrices = matrices # last, other threads check it
+        logger.info('Tetris_Col_H calculated.')
 
-    for block_type, rotations in shapes.items():
-        Tetris_Col_H[block_type] = []
-        for shape in rotations:
-            shape_np = np.array(shape)
-            col_heights = [0] * 4
-            for col_idx in range(4):
-                for row_idx in range(4):
-                    if shape_np[row_idx][col_idx]:
-                        col_heights[col_idx] = row_idx + 1
-            Tetris_Col_H[block_type].append(col_heights)
+    @classonlymethod
+    def matrix(cls, block_type: TetrisBlockType, spin: int) -> np.ndarray:
+        """
+        np.array(shapes[block_type][spin]), built once and read-only.
+        """
+        if cls._matrices is None:
+            cls.build_tables()
+        return cls._matrices[block_type][spin]
 
-    logger.info('Tetris_Col_H calculated.')
\ No newline at end of file
+    @classonlymethod
+    def col_bounds(cls, block_type: TetrisBlockType, spin: int) -> Tuple[int, int]:
+        """
+        First and last column of the 4x4 grid the shape fills.
+        """
+        if cls._matrices is None:
+            cls.build_tables()
+        return cls._col_bounds[block_type][spin]
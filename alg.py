@@ -9,15 +9,85 @@ Description:
 
 import config.settings
 from _logger import logger
-import cv2
 import numpy as np
-from typing import List, Tuple, Optional, Any
+import time
+from collections import Counter, deque
+from typing import List, Tuple, Optional, Any, Set
 import _utils
+import inputplan
+import metrics
+import profiling
 
-class GameState(metaclass=_utils.SingletonMeta):
+class BoardState:
     """
-    singleton
+    Immutable value of one position for search: the board packed as bits (_utils.pack_board), current and next block,
+    the opponent stack height and optionally the pieces left in the 7-bag (GameState.bag_remaining).
+    Hashable, copy() is the object itself, so any number of positions can be searched side by side.
     """
+    __slots__ = ('board', 'current_block', 'next_block', 'shape', 'opponent_height', 'bag') # __init__ order
+
+    def __init__(self, board: bytes, current_block: Optional[_utils.TetrisBlockType],
+                 next_block: Optional[_utils.TetrisBlockType] = None, shape: Tuple[int, int] = (20, 10),
+                 opponent_height: int = 0, bag: Optional[frozenset] = None):
+        for name, value in (('board', bytes(board)), ('shape', tuple(shape)), ('current_block', current_block),
+                            ('next_block', next_block), ('opponent_height', int(opponent_height)),
+                            ('bag', None if bag is None else frozenset(bag))):
+            object.__setattr__(self, name, value)
+
+    @classmethod
+    def from_board(cls, board: np.ndarray, current_block, next_block=None, opponent_height: int = 0,
+                   bag: Optional[Set[_utils.TetrisBlockType]] = None) -> 'BoardState':
+        return cls(_utils.pack_board(board), current_block, next_block, board.shape, opponent_height, bag)
+
+    def board_array(self) -> np.ndarray:
+        """
+        Unpacked board, a new int8 array of 0 and 1 on every call.
+        """
+        return _utils.unpack_board(self.board, self.shape)
+
+    def replace(self, **changes) -> 'BoardState':
+        fields = {name: getattr(self, name) for name in self.__slots__}
+        fields.update(changes)
+        return BoardState(**fields)
+
+    def _key(self) -> tuple:
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('BoardState is immutable, use replace()')
+
+    def __delattr__(self, name):
+        raise AttributeError('BoardState is immutable')
+
+    def __eq__(self, other):
+        return isinstance(other, BoardState) and self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __reduce__(self):
+        return BoardState, self._key()
+
+    def copy(self) -> 'BoardState':
+        return self
+
+    __copy__ = copy
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __repr__(self):
+        return (f"BoardState(board={self.board.hex()}, current_block={self.current_block}, "
+                f"next_block={self.next_block}, opponent_height={self.opponent_height})")
+
+class GameState(metaclass=_utils.ContextSingletonMeta):
+    """
+    singleton per game context (_utils.bind_context, one per window when orchestrated),
+    holds what perception (cv.py) keeps updating in place. Search works on snapshot().
+    """
+    BAG_SIZE = 7
+    PIECE_HISTORY_LEN = 70
+
     def __init__(self, rows=20, cols=10):
         logger.info('Singleton instance of GameState created!!!!!')
         # Game Board represented as a 2D numpy array, filled area (FA) and blank area (BA)
@@ -27,6 +97,19 @@ class GameState(metaclass=_utils.SingletonMeta):
         self.current_block: Optional[_utils.TetrisBlockType] = None
         # Next block (NB): the upcoming block preview from the N zone
         self.next_block: Optional[_utils.TetrisBlockType] = None
+        # Opponent board (OB) in versus matches, same layout as game_board, None when there is no opponent
+        self.opponent_board: Optional[np.ndarray] = None
+        # Predicted board (PB) after the last decision, the next frame only needs to confirm it with a few cells
+        self.predicted_board: Optional[np.ndarray] = None
+        self._board_before_prediction: Optional[np.ndarray] = None
+        self.predicted_lines = 0 # lines the predicted placement clears
+        # outcome counters of the prediction check
+        self.perception_events = {'verified': 0, 'misdrop': 0, 'garbage': 0}
+        # Piece queue: current_block is promoted from next_block on each drop, perception only confirms it
+        self.queue_tracked = False
+        self.piece_history = deque(maxlen=self.PIECE_HISTORY_LEN) # dropped pieces, oldest first
+        self.piece_counts = Counter()
+        self.queue_mismatches = 0
         self.up_to_date = False
 
     def update_board(self, board_data: np.ndarray):
@@ -48,6 +131,149 @@ class GameState(metaclass=_utils.SingletonMeta):
         logger.debug(f"Updating next block in GameState Class: {block}")
         self.next_block = block
 
+    def update_opponent_board(self, board_data: Optional[np.ndarray]):
+        """
+        Update the opponent board, None when the opponent zone is not visible.
+        """
+        if board_data is not None and board_data.shape != self.game_board.shape:
+            raise ValueError("Opponent board data shape mismatch.")
+        self.opponent_board = None if board_data is None else board_data.copy()
+
+    def opponent_stack_height(self) -> int:
+        """
+        Number of rows from the bottom to the highest filled cell of the opponent, 0 if unknown.
+        """
+        if self.opponent_board is None:
+            return 0
+        filled_rows = np.nonzero(self.opponent_board.any(axis=1))[0]
+        if filled_rows.size == 0:
+            return 0
+        return self.opponent_board.shape[0] - int(filled_rows[0])
+
+    def snapshot(self, with_bag: bool = False) -> BoardState:
+        """
+        The searchable part of the state as a BoardState, bag only when with_bag (it scans the piece history).
+        """
+        bag = self.bag_remaining() if with_bag else None
+        return BoardState.from_board(self.game_board, self.current_block, self.next_block,
+                                     self.opponent_stack_height(), bag)
+
+    def predict_placement(self, spin: int, row: int, col: int):
+        """
+        Store the board expected after the current block is dropped with the decided move.
+        Only incoming garbage or a misdrop can make the next frame differ from it.
+        """
+        from game import GameConcept  # 避免循环引用问题
+
+        block_matrix = _utils.Tetrominoes.matrix(self.current_block, spin)
+        placed = GameConcept.place_block(self.game_board, block_matrix, col, row)
+        cleared, lines = GameConcept.clear_lines(placed)
+        self.predicted_lines = lines # counted in LINES_CLEARED when the next frame confirms the placement
+        self._board_before_prediction = self.game_board.copy()
+        self.predicted_board = cleared.astype(self.game_board.dtype)
+        self.predicted_board[:2] = 0 # perception never reports the first two rows
+
+    def verification_cells(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Cells telling the predicted board apart from a misdrop or garbage: every cell changed by the move
+        (the placed block and rows moved by a clear), the top cell of each column and the cell above it,
+        and the bottom two rows where garbage comes in.
+
+        Return: (row indices, column indices), rows 0 and 1 excluded.
+        """
+        predicted = self.predicted_board
+        rows, cols = predicted.shape
+        mask = predicted != self._board_before_prediction
+        filled = predicted != 0
+        tops = np.where(filled.any(axis=0), filled.argmax(axis=0), rows)
+        col_idx = np.arange(cols)
+        has_top = tops < rows
+        mask[tops[has_top], col_idx[has_top]] = True
+        has_above = tops >= 1
+        mask[tops[has_above] - 1, col_idx[has_above]] = True
+        mask[-2:] = True
+        mask[:2] = False
+        return np.nonzero(mask)
+
+    def classify_misprediction(self, observed: np.ndarray) -> str:
+        """
+        Return: 'garbage' if the observed board is the prediction pushed up by some rows, 'misdrop' otherwise.
+        """
+        predicted = self.predicted_board != 0
+        observed = observed != 0
+        rows = predicted.shape[0]
+        for lines in range(1, rows - 2):
+            if np.array_equal(observed[2:rows - lines], predicted[2 + lines:]):
+                return 'garbage'
+        return 'misdrop'
+
+    def advance_queue(self):
+        """
+        Call after the current block is dropped, the next block spawns as the new current block.
+        next_block is unknown until the N zone is read again.
+        """
+        if self.current_block is not None:
+            self.piece_history.append(self.current_block)
+            self.piece_counts[self.current_block] += 1
+        self.current_block = self.next_block
+        self.next_block = None
+        self.queue_tracked = self.current_block is not None
+
+    def confirm_current_block(self, block: Optional[_utils.TetrisBlockType]):
+        """
+        Perception saw block at the spawn area, None if it could not tell (late capture).
+        The tracked piece is kept when nothing was seen, and replaced (counted as mismatch) when a different one was seen.
+        """
+        if block is None or block == self.current_block:
+            return
+        if self.queue_tracked:
+            self.queue_mismatches += 1
+            logger.warning(f'Piece queue expected {self.current_block}, but {block} spawned.')
+        self.update_current_block(block)
+        self.queue_tracked = True
+
+    def bag_remaining(self) -> Set[_utils.TetrisBlockType]:
+        """
+        Pieces that may still come from the current 7-bag after next_block, judged by the drop history.
+        The bag boundary is not observed, so every alignment without a repeated piece inside a bag is considered,
+        and the union over them is returned. All pieces if the history does not fit a 7-bag at all.
+        """
+        history = list(self.piece_history)
+        if self.current_block is not None:
+            history.append(self.current_block)
+        if self.next_block is not None:
+            history.append(self.next_block)
+        all_types = set(_utils.TetrisBlockType)
+        remaining = set()
+        consistent = False
+        for offset in range(self.BAG_SIZE):
+            tail, rest = history[:offset], history[offset:]
+            bags = [tail] + [rest[i:i + self.BAG_SIZE] for i in range(0, len(rest), self.BAG_SIZE)]
+            if any(len(set(bag)) != len(bag) for bag in bags):
+                continue
+            consistent = True
+            if len(history) < offset:
+                current_bag = history # still in the bag started before the history
+            else:
+                current_bag = rest[len(rest) - len(rest) % self.BAG_SIZE:] # empty when a bag just completed
+            remaining |= all_types - set(current_bag)
+        return remaining if consistent else all_types
+
+    def resolve_prediction(self, event: str):
+        """
+        Count the outcome ('verified', 'misdrop' or 'garbage') and drop the prediction, it is only valid for one frame.
+        The predicted lines were cleared unless the block was misdropped (garbage only pushed the board up).
+        """
+        from game import GameConcept  # 避免循环引用问题
+
+        self.perception_events[event] += 1
+        metrics.CACHE_REQUESTS.inc(cache='board_prediction', result='hit' if event == 'verified' else 'miss')
+        clear_type = GameConcept.clear_type(self.predicted_lines)
+        if event != 'misdrop' and clear_type is not None:
+            metrics.LINES_CLEARED.inc(self.predicted_lines, type=clear_type)
+        self.predicted_board = None
+        self._board_before_prediction = None
+
     def reset(self):
         """
         Resets the game state to initial values.
@@ -55,6 +281,15 @@ class GameState(metaclass=_utils.SingletonMeta):
         self.game_board.fill(0)
         self.current_block = None
         self.next_block = None
+        self.opponent_board = None
+        self.predicted_board = None
+        self._board_before_prediction = None
+        self.predicted_lines = 0
+        self.perception_events = {'verified': 0, 'misdrop': 0, 'garbage': 0}
+        self.queue_tracked = False
+        self.piece_history.clear()
+        self.piece_counts.clear()
+        self.queue_mismatches = 0
         self.up_to_date = False
 
     def __repr__(self):
@@ -62,7 +297,9 @@ class GameState(metaclass=_utils.SingletonMeta):
                 f"current_block={self.current_block}, next_block={self.next_block})")
     
 class SearchAlgorithm:
+    last_score = 0.0 # score of the move returned by the last search
     @_utils.classonlymethod
+    @profiling.traced('alg._evaluate', sample=config.settings.PROF_EVALUATE_SAMPLE)
     def _evaluate(cls, board: np.ndarray, current_attack: float = 0.0) -> int:
 
         rows, cols = board.shape
@@ -119,57 +356,111 @@ class SearchAlgorithm:
         return int(score)
     
     @_utils.classonlymethod
-    def _get_attack_result(cls, board: np.ndarray, block_matrix: np.ndarray, row_idx: int, col_idx: int) -> Tuple[np.ndarray, float]:
+    def _get_attack_result(cls, board: np.ndarray, block_matrix: np.ndarray, row_idx: int, col_idx: int,
+                           attack_weight: float = 1.0) -> Tuple[np.ndarray, float]:
         """
         放置 block_matrix 到指定位置后，执行行消除，并返回 (新棋盘, 攻击得分)
+        attack_weight 随对手堆叠高度增加，对手越高，此时多行消除的价值越大
         """
         from game import GameConcept  # 避免循环引用问题
 
         new_board = GameConcept.place_block(board, block_matrix, col_idx, row_idx)
         cleared_board, cleared_lines = GameConcept.clear_lines(new_board)
-        attack_score = GameConcept.clear_lines_attack_score(cleared_lines)
+        attack_score = GameConcept.clear_lines_attack_score(cleared_lines) * attack_weight
 
         return cleared_board, attack_score
+
+    @_utils.classonlymethod
+    def _attack_weight(cls, state: BoardState) -> float:
+        rows = state.shape[0]
+        return 1.0 + config.settings.ALG_OPPONENT_ATTACK_FACTOR * state.opponent_height / rows
     
     @_utils.classonlymethod
-    def search(cls) -> Tuple[int, int, int]:
+    def search(cls, deadline: Optional[float] = None, state: Optional[BoardState] = None) -> Optional[Tuple[int, int, int]]:
+        """
+        Depth-1 over all legal moves, then depth-2 with the next block from the best depth-1 moves down.
+        Equal scores prefer the move with the shorter key sequence (inputplan), then legal_moves order.
+        :param deadline: time.perf_counter() value, depth-2 stops there and the best fully searched move wins.
+        :param state: position to search, GameState().snapshot() when None.
+
+        Return: (spin, row, col), None when no move is legal (see search_scored).
+        """
+        if state is None:
+            state = GameState().snapshot()
+        move, cls.last_score = cls.search_scored(state, deadline)
+        return move
+
+    @_utils.classonlymethod
+    @profiling.traced('alg.search')
+    def search_scored(cls, state: BoardState, deadline: Optional[float] = None) -> Tuple[Optional[Tuple[int, int, int]], float]:
+        """
+        search() without shared state, safe to call from several threads at once.
+
+        Return: ((spin, row, col), score of the move), (None, -inf) when there is no legal move,
+                or with a next block, when every move leaves it no legal move (the stack reached the spawn).
+        """
         from game import GameConcept
 
-        state = GameState()
-        board_before_decision = state.game_board
+        board_before_decision = state.board_array()
         cur_block = state.current_block
         next_block = state.next_block
 
         assert cur_block is not None, "Current block must be set"
+        attack_weight = cls._attack_weight(state)
         legal_moves = GameConcept.possible_moves(board_before_decision, cur_block)
 
-        best_score = -float('inf')
-        best_move = None
-
+        # depth-1 score
+        candidates = []
         for spin_idx, row_idx, col_idx in legal_moves:
-            block_matrix = np.array(_utils.Tetrominoes.shapes[cur_block][spin_idx])
-            board_after, attack_score = cls._get_attack_result(board_before_decision, block_matrix, row_idx, col_idx)
-
-            # depth-1 score
+            block_matrix = _utils.Tetrominoes.matrix(cur_block, spin_idx)
+            board_after, attack_score = cls._get_attack_result(board_before_decision, block_matrix, row_idx, col_idx, attack_weight)
             score = cls._evaluate(board=board_after,current_attack=attack_score)
+            key_time = inputplan.InputCompiler.expected_time(cur_block, spin_idx, col_idx)
+            candidates.append((score, (spin_idx, row_idx, col_idx), board_after, key_time))
+
+        if not candidates:
+            return None, -float('inf')
 
-            # depth-2 search if next block available
-            if next_block is not None:
-                next_moves = GameConcept.possible_moves(board_after, next_block)
-                second_best = -float('inf')
-                for next_spin, next_row, next_col in next_moves:
-                    next_block_matrix = np.array(_utils.Tetrominoes.shapes[next_block][next_spin])
-                    board_after2, attack_score2 = cls._get_attack_result(board_after, next_block_matrix, next_row, next_col)
-                    s = cls._evaluate(board=board_after2,current_attack=attack_score2)
-                    if s > second_best:
-                        second_best = s
-                score += second_best
-
-            if score > best_score:
+        if next_block is None:
+            metrics.SEARCH_NODES.inc(len(candidates))
+            best_index = min(range(len(candidates)), key=lambda i: (-candidates[i][0], candidates[i][3], i))
+            return candidates[best_index][1], candidates[best_index][0]
+
+        # depth-2 search, most promising first so a deadline only cuts the unlikely moves.
+        # ties are broken by key time, then legal_moves order.
+        # a move that leaves the next block no legal move scores -inf and is never chosen.
+        order = sorted(range(len(candidates)), key=lambda i: -candidates[i][0])
+        best_score = -float('inf')
+        best_index = None
+        best_tie = (float('inf'), float('inf'))
+        nodes = len(candidates)
+        for searched, index in enumerate(order):
+            if deadline is not None and best_index is not None and time.perf_counter() > deadline:
+                logger.debug(f'search deadline, depth-2 done for {searched} of {len(order)} moves')
+                break
+            score, _, board_after, key_time = candidates[index]
+            next_moves = GameConcept.possible_moves(board_after, next_block)
+            nodes += len(next_moves)
+            second_best = -float('inf')
+            for next_spin, next_row, next_col in next_moves:
+                next_block_matrix = _utils.Tetrominoes.matrix(next_block, next_spin)
+                board_after2, attack_score2 = cls._get_attack_result(board_after, next_block_matrix, next_row, next_col, attack_weight)
+                s = cls._evaluate(board=board_after2,current_attack=attack_score2)
+                if s > second_best:
+                    second_best = s
+            if not next_moves:
+                continue
+            score += second_best
+
+            if score > best_score or (score == best_score and (key_time, index) < best_tie):
                 best_score = score
-                best_move = (spin_idx, row_idx, col_idx)
+                best_index = index
+                best_tie = (key_time, index)
 
-        return best_move
+        metrics.SEARCH_NODES.inc(nodes)
+        if best_index is None:
+            return None, best_score
+        return candidates[best_index][1], best_score
 
 
 
@@ -10,76 +10,170 @@ import multiprocessing # for UI
 import threading
 import time
 
-from controlpanel import ControlPanel
-
-def thread_play(playevent:threading.Event, closeevent:threading.Event):
+import config.settings
+from _logger import logger
+
+def thread_play(playevent:threading.Event, closeevent:threading.Event, telemetry_channel=None,
+                source_factory=None, backend=None, play_telemetry=None):
+    '''
+    :param source_factory: returns (FrameSource, capture process or None) for each play session, default the game window.
+    :param backend: InputBackend of the pipeline, default KeyboardController.backend().
+    '''
     logger.info('thread_play constructed.')
+    import telemetry
+    if play_telemetry is None:
+        play_telemetry = telemetry.Telemetry(telemetry_channel)
+    # imported once, usually already done by startup.prewarm
+    import cv
+    import alg
+    import _utils
+    import pipeline
+    import startup
+
+    session = None # capture and ScreenshotProcessor of the game window, kept across play sessions
     while True:
+        play_telemetry.publish(autoplay=False)
         if playevent.wait(0.5):
-            import cv
-            import alg
-            import keyboardctrl
-            import _utils
-            import controlpanel
-            import game
-            import time
-            import numpy as np
-
-            sp = cv.ScreenshotProcessor()
             alg.GameState().reset()
-            try:
-                w = _utils.WindowUtils.find_tetris_window()
-                _utils.WindowUtils.bring_to_front(w)
-            except:
-                logger.warning('Find window failed, stop playing.')
-                playevent.clear()
-                continue
-
-            while True:
-                if not playevent.is_set():
-                    break
+            if source_factory is None and config.settings.ORCH_MAX_WINDOWS > 1:
+                import orchestrator
+                try:
+                    sources, capture_processes = orchestrator.desktop_sources()
+                except Exception as e:
+                    logger.warning(f'Find window failed, stop playing: {e}')
+                    playevent.clear()
+                    continue
+                if not orchestrator.Orchestrator(sources, playevent, closeevent, telemetry=play_telemetry).run():
+                    logger.warning('Pipeline stage failed, stop playing.')
+                    playevent.clear()
+                for capture_process in capture_processes:
+                    capture_process.stop()
                 if closeevent.is_set():
                     logger.info('Exiting player thread.')
-                    return   
-                
-                # 当正确找到窗口时候，一直循环检测画面，直到出现可游戏画面时候继续往后做决策。
-                if not sp.capture():
-                    time.sleep(1)
-                    continue
-                if not sp.get_P_zone_new_state():
-                    continue
-                if not sp.get_N_zone_new_state():
+                    return
+                continue
+            capture_process = None
+            if source_factory is not None:
+                source, capture_process = source_factory()
+                sp = cv.ScreenshotProcessor(source=source)
+            else:
+                try:
+                    w = _utils.WindowUtils.find_tetris_window()
+                    _utils.WindowUtils.bring_to_front(w)
+                except:
+                    logger.warning('Find window failed, stop playing.')
+                    playevent.clear()
                     continue
-
-                alg.GameState().up_to_date = True
-                spin, row, col = alg.SearchAlgorithm.search()
-                destination = col-3 # since the Tetrominoes start from col3 (start from 0)
-                logger.info(f'Current: {alg.GameState().current_block.value}, '
-                            f'Next: {alg.GameState().next_block.value},'
-                            f'Decision spin: {spin},'
-                            f'Decision dest: {destination}')
-                formatted_board = np.array2string(alg.GameState().game_board, separator=', ')
-                logger.info("GAME_BOARD:\n%s", formatted_board)
-                if destination < 0:
-                    keyboardctrl.KeyboardController.multi_rotate(spin)
-                    keyboardctrl.KeyboardController.multi_left(abs(destination))
+                if session is None or not session.matches(w):
+                    if session is not None:
+                        session.close() # the game client was restarted
+                    session = startup.take_session(w) or startup.PlaySession(w)
+                session.begin()
+                sp = session.processor
+            # 截图、解析、搜索、按键各在一个线程中运行，直到 playevent 清除或 closeevent 置位
+            completed = False
+            try:
+                completed = pipeline.Pipeline(sp, playevent, closeevent, backend=backend, telemetry=play_telemetry).run()
+            finally:
+                if source_factory is not None:
+                    sp.close()
+                    if capture_process is not None:
+                        capture_process.stop()
+                elif completed:
+                    session.end() # no capture while autoplay is off
                 else:
-                    keyboardctrl.KeyboardController.multi_rotate(spin)
-                    keyboardctrl.KeyboardController.multi_right(destination)
-                keyboardctrl.KeyboardController.press_drop()
-
-                time.sleep(0.1)# for each decision, we want next capture be accurate, wait for the game update
+                    # the failed stage may have left the capture or the processor broken, the next session starts afresh
+                    session.close()
+                    session = None
+            if not completed:
+                logger.warning('Pipeline stage failed, stop playing.')
+                playevent.clear()
 
             if closeevent.is_set():
-                logger.info('Exiting player thread.')
-                return   
+                break
 
     # while True:
         #if playevent.wait(0.5):
         elif closeevent.is_set():
-            logger.info('Exiting player thread.')
-            return
-
+            break
+    if session is not None:
+        session.close()
+    logger.info('Exiting player thread.')
+
+
+
+def run_bench(args) -> int:
+    '''
+    python app.py --bench [frames ...] [--pieces N] [--seconds S] [--fps F]
+    Play recorded frames (images, directories or videos, default BENCH_E2E_FRAMES) through thread_play with a
+    RecordingBackend, without hotkeys and control panel, until N pieces were dropped or S seconds passed.
+    Print decisions/s and the latency percentiles of each stage.
+    The frames do not react to the keys. Only a recording of real play shows each piece as it was placed;
+    the default two screenshots only give the first decision a matching frame, after that the loop
+    re-decides the same still frame (misdrops), which measures the stages but not a real game.
+    '''
+    import tempfile
+    import framesource
+    import inputbackend
+    import keyboardctrl
+    import telemetry
+
+    options = {'--pieces': config.settings.BENCH_E2E_PIECES, '--seconds': config.settings.BENCH_E2E_SECONDS,
+               '--fps': config.settings.BENCH_E2E_FPS}
+    paths = []
+    args = [arg for arg in args if arg != '--bench']
+    while args:
+        arg = args.pop(0)
+        if arg in options:
+            if not args:
+                print(run_bench.__doc__)
+                return 2
+            options[arg] = float(args.pop(0))
+        else:
+            paths.append(arg)
+    paths = paths or config.settings.BENCH_E2E_FRAMES
+    pieces, seconds = int(options['--pieces']), options['--seconds']
+
+    backend = inputbackend.RecordingBackend()
+    bench_telemetry = telemetry.Telemetry()
+    bench_play, bench_close = threading.Event(), threading.Event()
+    drop_key = keyboardctrl.KeyboardController.ACTION_KEYS['drop']
+
+    def replay_source():
+        return framesource.ReplayFrameSource(paths, fps=options['--fps']), None
+
+    player = threading.Thread(target=thread_play, args=(bench_play, bench_close),
+                              kwargs={'source_factory': replay_source, 'backend': backend,
+                                      'play_telemetry': bench_telemetry})
+    saved_profile_dir = config.settings.CV_PROFILE_DIR
+    profile_dir = tempfile.TemporaryDirectory() # keep the window profiles of the recorded frames out of the repo
+    config.settings.CV_PROFILE_DIR = profile_dir.name
+    try:
+        player.start()
+        bench_play.set()
+        begin = time.perf_counter()
+        while time.perf_counter() - begin < seconds and backend.keys().count(drop_key) < pieces and bench_play.is_set():
+            time.sleep(0.05)
+        elapsed = time.perf_counter() - begin
+        dropped = backend.keys().count(drop_key)
+    finally:
+        bench_play.clear()
+        bench_close.set()
+        player.join()
+        config.settings.CV_PROFILE_DIR = saved_profile_dir
+        profile_dir.cleanup()
+
+    print(f'{dropped} pieces in {elapsed:.2f} s, {dropped / elapsed:.2f} decisions/s')
+    for stage in telemetry.STAGES:
+        latency = bench_telemetry.latency.percentiles(stage)
+        if latency is None:
+            print(f'{stage:10s} no samples')
+        else:
+            print(f'{stage:10s} p50 {latency[0] * 1000:8.2f} ms  p99 {latency[1] * 1000:8.2f} ms')
+    if paths == config.settings.BENCH_E2E_FRAMES:
+        print('note: BENCH_E2E_FRAMES are still screenshots, only the first decision sees its own frame; '
+              'replay a recording of real play for game-like numbers')
+    return 0 if dropped else 1
 
 
 def start_play():
@@ -96,39 +190,65 @@ def exit_routine():
     ui_close_event.set()
     close_event.set()
 
+def toggle_profile():
+    import profiling
+    profiling.ProfileCapture.toggle()
+
+def export_trace():
+    import profiling
+    profiling.export_chrome_trace()
 
-def start_control_panel(close_event):
-    control_panel = ControlPanel(close_event)
+
+def start_control_panel(close_event, telemetry_channel=None):
+    from controlpanel import ControlPanel # tkinter only in the panel process
+    control_panel = ControlPanel(close_event, telemetry_channel)
     control_panel.start()
 
 
 if __name__ == '__main__':
+    import sys
     import config.settings
     from _logger import logger
     import _utils
 
+    if '--bench' in sys.argv[1:]:
+        sys.exit(run_bench(sys.argv[1:]))
+
 
     import keyboardctrl
   
     logger.info('App Starting...')
+    applied = config.settings.load_machine_profile() # calibrated key timing of this machine
+    if applied:
+        logger.info(f'machine profile loaded: {applied}')
+    if config.settings.STARTUP_PREWARM:
+        import startup
+        startup.prewarm() # imports, piece tables, search caches and the game window, before the hotkey
+    if config.settings.METRICS_ENABLED:
+        import metrics
+        metrics.start_server()
     play_event = threading.Event()
     close_event = threading.Event()
 
     ui_close_event = multiprocessing.Event()
     ui_close_event.clear()
+    telemetry_channel = multiprocessing.Queue(maxsize=16) # 运行指标快照，决策线程 → 控制面板进程
 
-    p = threading.Thread(target=thread_play,args=(play_event,close_event,))
+    p = threading.Thread(target=thread_play,args=(play_event,close_event,telemetry_channel,))
     p.start()
 
 
 
-    control_panel_process = multiprocessing.Process(target=start_control_panel, args=(ui_close_event,))
+    control_panel_process = multiprocessing.Process(target=start_control_panel, args=(ui_close_event,telemetry_channel,))
     control_panel_process.start()
 
-    keyboardctrl.KeyboardController.assign_hotkey(start_play, stop_play, exit_routine)
+    keyboardctrl.KeyboardController.assign_hotkey(start_play, stop_play, exit_routine, toggle_profile, export_trace)
 
 
     p.join()
     control_panel_process.join()
     keyboardctrl.KeyboardController.cancel_hotkey()
+    import profiling
+    profiling.ProfileCapture.stop()
+    profiling.export_chrome_trace()
     logger.info('App Exiting...')
\ No newline at end of file
@@ -0,0 +1,313 @@
+"""
+File: benchmark.py
+Author: KuRRe8
+Created: 2026-10-19
+Description:
+    热点路径的基准测试，输出每秒调用数和延迟的 p50/p99：
+        game.is_collide, game.possible_moves, game.place_block+clear_lines, alg._evaluate, alg.search
+        cv.get_P_zone_new_state, cv.get_N_zone_new_state (assets/ 中能解析的截图，同时输出解析成功的比例)
+    棋盘语料固定：alg.py 中 test_alg_setUp1~4 的四个局面，加上 BENCH_SEED 生成的 BENCH_RANDOM_BOARDS 个随机局面。
+    结果保存为 JSON，与基线比较，每秒调用数下降超过 BENCH_THRESHOLD 的项记为退化。
+        python benchmark.py                    运行全部基准，保存到 BENCH_OUTPUT_DIR，与 BENCH_BASELINE 比较(存在时)
+        python benchmark.py --save-baseline    运行并写入 BENCH_BASELINE
+        python benchmark.py <new.json> <baseline.json>    只比较两次保存的结果
+    有退化时退出码为 1。
+"""
+
+import config.settings
+from _logger import logger
+
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+import _utils
+import alg
+from game import GameConcept
+
+
+SCREENSHOTS = ('test1.png', 'test2.png', 'original_game_screenshot.png', 'competing_yellow.png')
+ASSETS = os.path.join(config.settings.BASE_DIR, 'assets')
+
+
+def fixed_states() -> List[alg.BoardState]:
+    '''
+    The positions of test_alg_setUp1~4.
+    '''
+    states = []
+    for setup in (alg.test_alg_setUp1, alg.test_alg_setUp2, alg.test_alg_setUp3, alg.test_alg_setUp4):
+        alg.GameState().reset()
+        setup()
+        states.append(alg.GameState().snapshot())
+    alg.GameState().reset()
+    return states
+
+
+def random_states(count: int, seed: int, rows: int = 20, cols: int = 10) -> List[alg.BoardState]:
+    '''
+    Stacks of random column heights (a random walk, 0 to 14 rows) with some holes, never a full row,
+    and random current and next blocks. The same seed gives the same positions.
+    '''
+    rng = np.random.default_rng(seed)
+    pieces = list(_utils.TetrisBlockType)
+    states = []
+    for _ in range(count):
+        heights = np.clip(np.cumsum(rng.integers(-2, 3, cols)) + rng.integers(0, 10), 0, 14)
+        board = (np.arange(rows)[:, None] >= rows - heights[None, :]).astype(np.int8)
+        board[rng.random((rows, cols)) < 0.08] = 0 # holes
+        for row in np.nonzero(board.all(axis=1))[0]:
+            board[row, rng.integers(cols)] = 0
+        states.append(alg.BoardState.from_board(board, pieces[rng.integers(len(pieces))],
+                                                pieces[rng.integers(len(pieces))]))
+    return states
+
+
+def corpus(count: Optional[int] = None, seed: Optional[int] = None) -> List[alg.BoardState]:
+    if count is None:
+        count = config.settings.BENCH_RANDOM_BOARDS
+    if seed is None:
+        seed = config.settings.BENCH_SEED
+    return fixed_states() + random_states(count, seed)
+
+
+def measure(func: Callable, cases: Sequence[tuple], min_time: float, min_rounds: int = 1) -> Dict[str, float]:
+    '''
+    Call func(*case) for every case, round after round until min_time passed, after a warm-up call.
+
+    Return: {'calls', 'ops_per_sec', 'mean_us', 'p50_us', 'p99_us'}
+    '''
+    func(*cases[0]) # lazy imports and tables
+    samples = []
+    rounds = 0
+    begin = time.perf_counter()
+    while rounds < min_rounds or time.perf_counter() - begin < min_time:
+        for case in cases:
+            start = time.perf_counter_ns()
+            func(*case)
+            samples.append(time.perf_counter_ns() - start)
+        rounds += 1
+    return _summary(samples)
+
+
+def _summary(samples_ns: List[int]) -> Dict[str, float]:
+    samples = np.array(samples_ns) / 1000
+    p50, p99 = np.percentile(samples, [50, 99])
+    return {'calls': len(samples), 'ops_per_sec': float(1e6 / samples.mean()), 'mean_us': float(samples.mean()),
+            'p50_us': float(p50), 'p99_us': float(p99)}
+
+
+def _engine_cases(states: List[alg.BoardState]) -> Dict[str, List[tuple]]:
+    '''
+    Arguments of each engine benchmark, built from the legal moves of the corpus.
+    '''
+    cases = {'game.is_collide': [], 'game.possible_moves': [], 'game.place_block+clear_lines': [],
+             'alg._evaluate': [], 'alg.search': []}
+    for state in states:
+        board = state.board_array()
+        cases['game.possible_moves'].append((board, state.current_block))
+        cases['alg.search'].append((state,))
+        for spin, row, col in GameConcept.possible_moves(board, state.current_block):
+            block_matrix = _utils.Tetrominoes.matrix(state.current_block, spin)
+            cases['game.is_collide'].append((board, block_matrix, row, col))
+            cases['game.place_block+clear_lines'].append((board, block_matrix, col, row))
+            cleared, _ = GameConcept.clear_lines(GameConcept.place_block(board, block_matrix, col, row))
+            cases['alg._evaluate'].append((cleared,))
+    return cases
+
+
+def _place_and_clear(board, block_matrix, col, row):
+    return GameConcept.clear_lines(GameConcept.place_block(board, block_matrix, col, row))
+
+
+def _search(state):
+    return alg.SearchAlgorithm.search_scored(state)
+
+
+ENGINE_FUNCS = {
+    'game.is_collide': GameConcept.is_collide,
+    'game.possible_moves': GameConcept.possible_moves,
+    'game.place_block+clear_lines': _place_and_clear,
+    'alg._evaluate': alg.SearchAlgorithm._evaluate,
+    'alg.search': _search,
+}
+
+
+def bench_engine(states: List[alg.BoardState], min_time: float) -> Dict[str, Dict[str, float]]:
+    cases = _engine_cases(states)
+    return {name: measure(func, cases[name], min_time) for name, func in ENGINE_FUNCS.items()}
+
+
+def bench_perception(min_time: float, screenshots: Sequence[str] = SCREENSHOTS) -> Dict[str, Dict[str, float]]:
+    '''
+    Each call parses a freshly loaded frame from a clean GameState, so no per-frame cache or prediction helps.
+    Only the screenshots a zone parses on are timed, 'parsed' in its result is their share. Each screenshot size
+    has its own processor, as a window keeps its size, so the zone geometry is calibrated once per size.
+    '''
+    import cv
+    import framesource
+
+    saved = config.settings.CV_PROFILE_DIR
+    profile_dir = tempfile.TemporaryDirectory() # keep the window profiles of the screenshots out of the repo
+    config.settings.CV_PROFILE_DIR = profile_dir.name
+    processors = []
+
+    def processor(paths: List[str]):
+        sp = cv.ScreenshotProcessor(source=framesource.ReplayFrameSource(paths))
+        processors.append(sp)
+        return sp
+
+    def parsed_by(method: str) -> Dict[Tuple[int, int], List[str]]:
+        '''
+        Return: {frame shape: paths of the screenshots method parses}
+        '''
+        by_size = {}
+        for name in screenshots:
+            path = os.path.join(ASSETS, name)
+            alg.GameState().reset()
+            sp = processor([path])
+            if sp.capture() and getattr(sp, method)():
+                by_size.setdefault(sp.frame_bgr.shape[:2], []).append(path)
+            else:
+                logger.warning(f'benchmark: {method} fails on {name}, not timed')
+        return by_size
+
+    def zone(name: str, method: str, by_size: Dict[Tuple[int, int], List[str]]):
+        # one turn per frame, each processor cycles through the frames of its size
+        turns = itertools.cycle([sp for sp in map(processor, by_size.values()) for _ in sp.source.frames])
+
+        def call():
+            sp = next(turns)
+            alg.GameState().reset()
+            sp.capture()
+            start = time.perf_counter_ns()
+            ok = getattr(sp, method)()
+            elapsed = time.perf_counter_ns() - start
+            if not ok:
+                raise RuntimeError(f'{name} failed on a frame it parsed before')
+            return elapsed
+        return call
+
+    results = {}
+    try:
+        for name, method in (('cv.get_P_zone_new_state', 'get_P_zone_new_state'),
+                             ('cv.get_N_zone_new_state', 'get_N_zone_new_state')):
+            by_size = parsed_by(method)
+            frames = sum(len(paths) for paths in by_size.values())
+            if not frames:
+                raise RuntimeError(f'{name} parses none of {list(screenshots)}')
+            results[name] = _measure_timed(zone(name, method, by_size), frames, min_time)
+            results[name]['parsed'] = frames / len(screenshots)
+    finally:
+        for sp in processors:
+            sp.close()
+        alg.GameState().reset()
+        config.settings.CV_PROFILE_DIR = saved
+        profile_dir.cleanup()
+    return results
+
+
+def _measure_timed(call: Callable[[], int], per_round: int, min_time: float) -> Dict[str, float]:
+    '''
+    measure() for calls that time themselves (the setup of each call is not counted), call returns nanoseconds.
+    '''
+    for _ in range(per_round):
+        call()
+    samples = []
+    begin = time.perf_counter()
+    while not samples or time.perf_counter() - begin < min_time:
+        samples.extend(call() for _ in range(per_round))
+    return _summary(samples)
+
+
+def run(min_time: Optional[float] = None, perception: bool = True) -> Dict[str, object]:
+    '''
+    Return: {'meta': {...}, 'results': {benchmark: measure() result}}, the JSON document saved by save().
+    '''
+    if min_time is None:
+        min_time = config.settings.BENCH_MIN_TIME
+    states = corpus()
+    results = bench_engine(states, min_time)
+    if perception:
+        results.update(bench_perception(min_time))
+    meta = {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(),
+            'numpy': np.__version__, 'platform': platform.platform(), 'processor': platform.processor(),
+            'boards': len(states), 'seed': config.settings.BENCH_SEED, 'min_time': min_time}
+    return {'meta': meta, 'results': results}
+
+
+def save(report: Dict[str, object], path: Optional[str] = None) -> str:
+    if path is None:
+        os.makedirs(config.settings.BENCH_OUTPUT_DIR, exist_ok=True)
+        path = os.path.join(config.settings.BENCH_OUTPUT_DIR, f"bench.{time.strftime('%Y-%m-%d_%H-%M-%S')}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    return path
+
+
+def load(path: str) -> Dict[str, object]:
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare(report: Dict[str, object], baseline: Dict[str, object],
+            threshold: Optional[float] = None) -> List[Tuple[str, float, float, float]]:
+    '''
+    Benchmarks in both reports whose ops/s fell by more than threshold (relative, BENCH_THRESHOLD).
+
+    Return: [(name, baseline ops/s, ops/s, relative change)], change < 0 is slower.
+    '''
+    if threshold is None:
+        threshold = config.settings.BENCH_THRESHOLD
+    regressions = []
+    for name, result in report['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        change = result['ops_per_sec'] / base['ops_per_sec'] - 1
+        if change < -threshold:
+            regressions.append((name, base['ops_per_sec'], result['ops_per_sec'], change))
+    return regressions
+
+
+def print_report(report: Dict[str, object], baseline: Optional[Dict[str, object]] = None):
+    for name, result in report['results'].items():
+        line = (f"{name:32s} {result['ops_per_sec']:12.1f} ops/s  p50 {result['p50_us']:10.1f} us"
+                f"  p99 {result['p99_us']:10.1f} us")
+        if 'parsed' in result:
+            line += f"  {result['parsed'] * 100:3.0f}% parsed"
+        base = None if baseline is None else baseline['results'].get(name)
+        if base is not None:
+            line += f"  {(result['ops_per_sec'] / base['ops_per_sec'] - 1) * 100:+6.1f}%"
+        print(line)
+
+
+def main(argv: List[str]) -> int:
+    if len(argv) == 2 and not argv[0].startswith('--'):
+        report, baseline = load(argv[0]), load(argv[1])
+    elif not argv or argv == ['--save-baseline']:
+        report = run()
+        if argv:
+            print(f'baseline saved: {save(report, config.settings.BENCH_BASELINE)}')
+            print_report(report)
+            return 0
+        print(f'results saved: {save(report)}')
+        baseline = load(config.settings.BENCH_BASELINE) if os.path.exists(config.settings.BENCH_BASELINE) else None
+    else:
+        print(__doc__)
+        return 2
+    print_report(report, baseline)
+    if baseline is None:
+        return 0
+    regressions = compare(report, baseline)
+    for name, base, current, change in regressions:
+        print(f'REGRESSION {name}: {base:.1f} -> {current:.1f} ops/s ({change * 100:+.1f}%)')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
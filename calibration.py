@@ -0,0 +1,326 @@
+"""
+File: calibration.py
+Author: KuRRe8
+Created: 2026-10-19
+Description:
+    在真实对局中标定按键时序，结果写入 profiles/machine.json，app.py 启动时加载并覆盖 config.settings 的默认值。
+        python calibration.py das        按住方向键，逐帧记录下落方块的列，得到 KBD_DAS 和 KBD_ARR
+        python calibration.py interval   按不同间隔发送测试按键，从截图确认每个按键都生效(朝向、列、落点)，
+                                         二分查找旋转、平移、落下各自最小的可靠间隔 KBD_MININTERVAL_<kind>
+    运行前先进入对局，标定会在倒计时后控制当前方块。interval 标定每次试验消耗一个方块，
+    方块交替贴左右墙放下，堆满结束对局时标定中止，已完成种类的结果已经保存。
+"""
+
+import config.settings
+from _logger import logger
+
+import itertools
+import json
+import os
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+import alg
+import _utils
+
+
+def save_machine_profile(updates: Dict[str, object], path: Optional[str] = None):
+    '''
+    Merge updates into the machine profile and apply them to config.settings right away.
+    '''
+    if path is None:
+        path = config.settings.MACHINE_PROFILE_PATH
+    profile = {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            profile = json.load(f)
+    except (OSError, ValueError):
+        pass
+    profile.update(updates)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(profile, f, indent=2)
+    for name, value in updates.items():
+        setattr(config.settings, name, value)
+    logger.info(f'machine profile saved: {path} {updates}')
+
+
+def move_times(samples: List[Tuple[float, int]]) -> List[float]:
+    '''
+    :param samples: (seconds since key press, column of the falling block) per frame.
+
+    Return: time of each column change.
+    '''
+    times = []
+    previous = None
+    for seconds, col in samples:
+        if previous is not None and col != previous:
+            times.append(seconds)
+        previous = col
+    return times
+
+
+def das_from_samples(samples: List[Tuple[float, int]]) -> Tuple[float, float]:
+    '''
+    The first move follows the press, the second comes after DAS, the later ones every ARR.
+    All auto shift moves arrive in one frame when ARR is 0.
+
+    Return: (KBD_DAS, KBD_ARR)
+    '''
+    times = move_times(samples)
+    if len(times) < 2:
+        raise ValueError(f'need at least two moves to measure DAS, got {len(times)}')
+    das = times[1] - times[0]
+    arr = float(np.median(np.diff(times[1:]))) if len(times) >= 3 else 0.0
+    return das, arr
+
+
+def _falling_cells(processor, p_zone_img: np.ndarray, board: np.ndarray) -> np.ndarray:
+    '''
+    Cells lit in the frame but empty on the board: the falling block (the ghost is darker).
+    '''
+    geometry = processor.geometry
+    x, y = geometry.p_bbox[:2]
+    lit = p_zone_img[geometry.cell_ys - y, geometry.cell_xs - x].max(axis=-1) >= config.settings.CV_BLOCKS_GHOST_HSV_V_THRESHOLD
+    return lit & (board == 0)
+
+
+def _falling_block_col(processor, p_zone_img: np.ndarray, board: np.ndarray) -> Optional[int]:
+    cols = np.nonzero(_falling_cells(processor, p_zone_img, board).any(axis=0))[0]
+    return int(cols[0]) if cols.size else None
+
+
+def _trim(mask: np.ndarray) -> np.ndarray:
+    rows = np.nonzero(mask.any(axis=1))[0]
+    cols = np.nonzero(mask.any(axis=0))[0]
+    if not rows.size:
+        return mask[:0, :0]
+    return mask[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+
+
+def shape_matches(cells: np.ndarray, block: _utils.TetrisBlockType, spin: int) -> bool:
+    '''
+    The cells form the shape of block in this spin, wherever they are.
+    '''
+    shapes = _utils.Tetrominoes.shapes[block]
+    shape = np.array(shapes[spin % len(shapes)]) != 0
+    return np.array_equal(_trim(cells), _trim(shape))
+
+
+def reliable(trial: Callable[[float], Optional[bool]], interval: float, repeats: int) -> bool:
+    '''
+    The trial passes repeats times at this interval. A None verdict (nothing to judge, e.g. an I block
+    for rotation) is retried, at most 4 * repeats times: rotation cannot judge four of the seven blocks.
+    '''
+    passed = skipped = 0
+    while passed < repeats:
+        verdict = trial(interval)
+        if verdict is False:
+            return False
+        if verdict:
+            passed += 1
+        else:
+            skipped += 1
+            if skipped > 4 * repeats:
+                return False
+    return True
+
+
+def search_interval(trial: Callable[[float], Optional[bool]], low: float, high: float,
+                    iterations: int = 5, repeats: int = 3) -> float:
+    '''
+    Binary search the smallest reliable interval in [low, high], high is assumed reliable.
+    Return: the smallest interval that passed, high if none did.
+    '''
+    for _ in range(iterations):
+        middle = (low + high) / 2
+        if reliable(trial, middle, repeats):
+            high = middle
+        else:
+            low = middle
+        logger.info(f'interval search: [{low * 1000:.1f}, {high * 1000:.1f}] ms')
+    return high
+
+
+def _spawned_block(processor, timeout: float = 2.0, since_ns: int = 0,
+                   board: Optional[np.ndarray] = None) -> Tuple[np.ndarray, _utils.TetrisBlockType, np.ndarray]:
+    '''
+    Wait for the next block.
+    :param since_ns: time.time_ns() of the drop, earlier frames still show the dropped block at the spawn.
+    :param board: board before the drop, the next block only counts once the board changed (the dropped one landed).
+    Return: (board, block, its falling cells)
+    '''
+    deadline = time.monotonic() + timeout
+    while not (processor.capture() and processor.frame_timestamp_ns >= since_ns and processor.get_P_zone_new_state()
+               and (board is None or np.any(alg.GameState().game_board != board))):
+        if time.monotonic() > deadline:
+            raise RuntimeError('no block to calibrate with, start a game first')
+    state = alg.GameState()
+    board = state.game_board.copy()
+    x, y, w, h = processor.geometry.p_bbox
+    cells = _falling_cells(processor, processor.frame_bgr[y:y + h, x:x + w], board)
+    return board, state.current_block, cells
+
+
+def _cells_after(processor, board: np.ndarray, since_ns: int, settle: float,
+                 timeout: Optional[float] = None) -> np.ndarray:
+    '''
+    Falling cells in the first frame captured settle seconds after since_ns (time.time_ns()).
+    :param timeout: seconds to wait for that frame, default ten settle periods.
+    '''
+    if timeout is None:
+        timeout = 10 * settle
+    deadline = time.monotonic() + timeout
+    p_bbox = processor.geometry.p_bbox
+    min_seq = 1
+    while True:
+        latest = processor.source.grab(rects=[p_bbox], min_seq=min_seq)
+        if latest is None:
+            if time.monotonic() > deadline:
+                raise RuntimeError('no frame from the game window, calibration failed')
+            time.sleep(0.001)
+            continue
+        seq, timestamp_ns, (p_zone_img,) = latest
+        min_seq = seq + 1
+        if timestamp_ns >= since_ns + settle * 1e9:
+            return _falling_cells(processor, p_zone_img, board)
+
+
+def _leftmost(cells: np.ndarray) -> Optional[int]:
+    cols = np.nonzero(cells.any(axis=0))[0]
+    return int(cols[0]) if cols.size else None
+
+
+def interval_trial(processor, kind: str, interval: float, wall: str = 'left', settle: float = 0.15) -> Optional[bool]:
+    '''
+    One trial on a fresh block, two or more keys spaced by interval:
+        ROTATE  rotate twice, the block must show spin 2 (T, J and L only)
+        SHIFT   right three times, the block must be three columns right
+        DROP    right then drop, the block must land one column right
+    The block is then slid to wall and dropped.
+    Return: whether every key took effect, None when the block cannot tell (O, I, S and Z for rotation).
+    '''
+    import keyboardctrl
+    controller = keyboardctrl.KeyboardController
+    backend = controller.backend()
+    board, block, cells = _spawned_block(processor)
+    start_col = _leftmost(cells)
+    verdict = None
+    if kind == 'ROTATE':
+        # two turns bring I, S and Z back to spin 0, so losing both keys would pass; only 4-spin blocks can tell
+        if len(_utils.Tetrominoes.shapes[block]) == 4:
+            backend.send_sequence([('e', 0.0, 0.0), ('e', interval, 0.0)])
+            verdict = shape_matches(_cells_after(processor, board, time.time_ns(), settle), block, 2)
+    elif kind == 'SHIFT':
+        backend.send_sequence([('right', 0.0, 0.0), ('right', interval, 0.0), ('right', interval, 0.0)])
+        moved = _leftmost(_cells_after(processor, board, time.time_ns(), settle))
+        verdict = None if start_col is None or moved is None else moved == start_col + 3
+    elif kind == 'DROP':
+        sent_ns = time.time_ns()
+        backend.send_sequence([('right', 0.0, 0.0), ('space', interval, 0.0)])
+        try:
+            landed_board, _, _ = _spawned_block(processor, timeout=1.0, since_ns=sent_ns, board=board)
+        except RuntimeError:
+            controller.press_drop() # the drop was lost, the block is still falling
+            return False
+        added = (landed_board != 0) & (board == 0)
+        if start_col is None or added.sum() != 4: # a line was cleared, cannot tell
+            verdict = None
+        else:
+            verdict = _leftmost(added) == start_col + 1
+    else:
+        raise ValueError(f'unknown key kind {kind}')
+    controller.hold_shift(wall)
+    controller.press_drop()
+    return verdict
+
+
+def calibrate_intervals(processor, kinds: Tuple[str, ...] = ('ROTATE', 'SHIFT', 'DROP'),
+                        iterations: int = 5, repeats: int = 3) -> Dict[str, float]:
+    '''
+    Search and save KBD_MININTERVAL_<kind> for each kind, between 0 and the current KBD_MININTERVAL.
+    '''
+    results = {}
+    trials = itertools.count()
+    def trial(kind, interval):
+        # alternate walls so the stack grows slowly
+        return interval_trial(processor, kind, interval, wall=('left', 'right')[next(trials) % 2])
+
+    for kind in kinds:
+        interval = search_interval(lambda i: trial(kind, i),
+                                   0.0, config.settings.KBD_MININTERVAL, iterations, repeats)
+        interval = round(interval + config.settings.KBD_INTERVAL_MARGIN, 4)
+        results[f'KBD_MININTERVAL_{kind}'] = interval
+        save_machine_profile({f'KBD_MININTERVAL_{kind}': interval})
+    return results
+
+
+def calibrate_das(processor, direction: str = 'right', hold: float = 0.8) -> Tuple[float, float]:
+    '''
+    Hold a direction key on a freshly spawned block and watch its column frame by frame.
+    The source should be fast (capture process ring), its frame interval bounds the precision.
+    '''
+    import keyboardctrl
+
+    deadline = time.monotonic() + 2.0
+    while not (processor.capture() and processor.get_P_zone_new_state()):
+        if time.monotonic() > deadline:
+            raise RuntimeError('no block to calibrate with, start a game first')
+    board = alg.GameState().game_board.copy()
+    p_bbox = processor.geometry.p_bbox
+
+    samples = []
+    last_seq = 0
+    backend = keyboardctrl.KeyboardController.backend()
+    key = keyboardctrl.KeyboardController.ACTION_KEYS[direction]
+    pressed_ns = time.time_ns()
+    backend.press(key)
+    try:
+        while (time.time_ns() - pressed_ns) / 1e9 < hold:
+            latest = processor.source.grab(rects=[p_bbox], min_seq=last_seq + 1)
+            if latest is None:
+                time.sleep(0.001)
+                continue
+            last_seq, timestamp_ns, (p_zone_img,) = latest
+            col = _falling_block_col(processor, p_zone_img, board)
+            if col is not None:
+                samples.append(((timestamp_ns - pressed_ns) / 1e9, col))
+    finally:
+        backend.release(key)
+    return das_from_samples(samples)
+
+
+if __name__ == '__main__':
+    import sys
+    import cv
+    import framering
+    import framesource
+    import keyboardctrl
+    import _utils
+
+    if len(sys.argv) < 2 or sys.argv[1] not in ('das', 'interval'):
+        print(__doc__)
+        sys.exit(1)
+    config.settings.load_machine_profile() # the interval search starts from the calibrated values
+    window = _utils.WindowUtils.find_tetris_window()
+    capture_process = framering.CaptureProcess()
+    sp = cv.ScreenshotProcessor(source=framesource.RingFrameSource(capture_process.start(window)))
+    try:
+        print('3 秒后开始标定，请切换到游戏窗口...')
+        time.sleep(3)
+        if sys.argv[1] == 'interval':
+            for name, value in calibrate_intervals(sp).items():
+                print(f'{name} = {value:.4f}')
+            sys.exit(0)
+        results = []
+        for direction in ('right', 'left', 'right', 'left'):
+            results.append(calibrate_das(sp, direction))
+            keyboardctrl.KeyboardController.press_drop()
+            time.sleep(1.0) # next block
+        das = float(np.median([r[0] for r in results]))
+        arr = float(np.median([r[1] for r in results]))
+        save_machine_profile({'KBD_DAS': round(das, 4), 'KBD_ARR': round(arr, 4)})
+        print(f'KBD_DAS = {das:.4f}, KBD_ARR = {arr:.4f}')
+    finally:
+        sp.close()
+        capture_process.stop()
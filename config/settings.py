@@ -1,4 +1,5 @@
 import os
+import json
 
 # settings.py
 
@@ -21,16 +22,87 @@ DEBUG = 10
 NOTSET = 0
 '''
 LOGGER_LVL = 30
+LOG_BOARD_TEXT = False # 每次决策把棋盘格式化成文本写入日志(慢，只在调试时打开)
+LOG_DECISIONS = False # 每次决策写一行 JSON(压缩的棋盘、方块、落点、耗时)到 LOG_DECISION_DIR
+LOG_DECISION_DIR = os.path.join(BASE_DIR, 'logs')
+RECORD_GAMES = False # 每次决策追加一条定长二进制记录(gamerecord.py)，用于回放和回归检查
+RECORD_DIR = os.path.join(BASE_DIR, 'logs')
 
 # KBD
 KBD_MININTERVAL = 0.06 # unstable when less than 0.03
+# 按键种类各自的最小间隔，None 使用 KBD_MININTERVAL，用 python calibration.py interval 标定
+KBD_MININTERVAL_ROTATE = None
+KBD_MININTERVAL_SHIFT = None
+KBD_MININTERVAL_DROP = None
+KBD_INTERVAL_MARGIN = 0.005 # 标定得到的最小可靠间隔再加上这个余量
+KBD_BACKEND = 'keyboard' # 按键后端: keyboard(逐键发送) / batched(整段序列一次调用，间隔精确) / recording(只记录，不发送)
+KBD_DAS_ENABLED = True # 贴墙的落点按住方向键滑到墙边，而不是逐格点按
+KBD_DAS_EXACT = False # 非贴墙落点也按住方向键，按时序在目标列松开，依赖准确的DAS标定
+KBD_DAS = 0.15 # 游戏的自动移动延迟(delayed auto shift)，按下后第一次移动到第二次移动的时间，用 calibration.py 标定
+KBD_ARR = 0.03 # 自动移动开始后每格的间隔(auto repeat rate)
 KBD_LISTENER_FUNC_HOTKEY = 'alt+9'
 KBD_STOP_FUNC_HOTKEY = 'alt+0'
 KBD_EXIT_HOTKEY = 'alt+='
+KBD_PROFILE_HOTKEY = 'alt+8' # 开关 cProfile 和 tracemalloc，结果保存在 logs
+KBD_TRACE_HOTKEY = 'alt+7' # 把最近的性能打点导出为 Chrome trace JSON
+
+# ALG
+ALG_OPPONENT_ATTACK_FACTOR = 1.0 # 对手堆满时攻击得分的额外倍数，对手越高越倾向于多行消除
+ALG_GRAVITY_WINDOW = 20 # 下落速度和出块延迟取最近这么多次的测量
+ALG_SEARCH_BUDGET_MAX = 0.5 # 单次决策的时间预算上限(秒)，下落速度未知时使用
+ALG_SEARCH_BUDGET_MIN = 0.0 # 预算耗尽时仍然完成第一层搜索，第二层搜索按第一层得分从高到低截断
+ALG_BUDGET_SAFETY_MARGIN = 0.05 # 预算中为截图和调度预留的时间
+ALG_ACTUATION_KEYS = 6 # 还没有发送过按键计划时，估计按键耗时用的按键数
+
+# Pipeline
+PIPELINE_FRAME_QUEUE_SIZE = 1 # 截图到解析的队列长度，满了丢弃最旧的帧
+PIPELINE_DECISION_QUEUE_SIZE = 1 # 搜索到按键的队列长度，满了搜索阶段阻塞
+PIPELINE_STAGE_POLL = 0.1 # 各阶段等待队列的超时(秒)，超时后检查是否需要退出
+
+# Startup
+STARTUP_PREWARM = True # app.py 启动时在后台导入模块、预热搜索缓存、找到游戏窗口并加载标定文件
+STARTUP_WAIT = 5.0 # 按下开始热键时预热还没完成，最多等待的时间(秒)
+STARTUP_FRAME_TIMEOUT = 1.0 # 预热时等待第一帧的时间(秒)
+
+# Orchestrator
+ORCH_MAX_WINDOWS = 1 # 同时控制的游戏窗口数上限，大于 1 时 app.py 用 orchestrator.Orchestrator 驱动所有找到的窗口，窗口须平铺不重叠
+ORCH_SEARCH_WORKERS = 2 # 所有窗口共享的搜索线程数
+ORCH_FOCUS_SETTLE = 0.02 # 切换输入焦点到另一个窗口后等待的时间(秒)，窗口收到焦点后才接收按键
+
+# Benchmark
+BENCH_RANDOM_BOARDS = 50 # benchmark.py 语料中随机局面的数量
+BENCH_SEED = 2026 # 随机局面的种子，改变后与旧基线不可比
+BENCH_MIN_TIME = 0.5 # 每项基准至少运行的时间(秒)
+BENCH_THRESHOLD = 0.10 # 每秒调用数比基线下降超过这个比例记为退化
+BENCH_OUTPUT_DIR = os.path.join(BASE_DIR, 'logs')
+BENCH_BASELINE = os.path.join(BASE_DIR, 'bench_baseline.json')
+# python app.py --bench: 回放录制的画面跑完整的决策流水线(不发送按键)，达到方块数或时间后结束
+BENCH_E2E_FRAMES = [os.path.join(BASE_DIR, 'assets', 'test1.png'), os.path.join(BASE_DIR, 'assets', 'test2.png')] # 两张静止截图，只能测各阶段开销，真实对局的数据要回放录屏
+BENCH_E2E_FPS = 30 # 回放帧率，按时间选帧，与实时游戏一致
+BENCH_E2E_PIECES = 100
+BENCH_E2E_SECONDS = 30.0
+
+# Profiling
+PROF_SPANS_ENABLED = True # 记录性能打点(每次约 1 微秒)
+PROF_RING_SIZE = 100000 # 内存中保留最近多少个打点
+PROF_EVALUATE_SAMPLE = 100 # _evaluate 调用非常频繁，每这么多次记录一次
+PROF_OUTPUT_DIR = os.path.join(BASE_DIR, 'logs') # trace 和 profile 文件保存位置
+PROF_STOP_TIMEOUT = 2.0 # 停止分析时等待各线程交回 cProfile 结果的时间
+PROF_TRACEMALLOC_TOP = 20 # 停止分析时日志中列出的内存分配最多的代码行数
+
+# Metrics
+METRICS_ENABLED = False # 在本机提供 Prometheus 格式的 /metrics
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9108 # 被占用时依次尝试后面的端口，多个会话可以同时运行
+METRICS_PORT_TRIES = 16
 
 # Control Panel
 CP_ALPHA = 0.7
 CP_TOPMOST = True
+CP_REFRESH_INTERVAL_MS = 200 # 面板读取运行指标的间隔(毫秒)
+CP_TELEMETRY_INTERVAL = 0.5 # 决策线程发送运行指标快照的间隔(秒)
+CP_TELEMETRY_WINDOW = 10.0 # 每秒决策数的统计窗口(秒)
+CP_TELEMETRY_SAMPLES = 200 # 每个阶段保留最近多少次延迟用于计算 p50/p99
 
 # CV
 CV_WINDOW_TITLE = '欢乐俄罗斯方块'
@@ -38,6 +110,29 @@ CV_PZONE_BBOX_COLOR = [56, 50, 128] # 主要游玩区域的边框颜色是803238
 CV_PZONE_BACKGROUND_COLOR = [66, 59, 74] # 主要游玩区域的背景颜色是4A3B42，转化为的BGR
 CV_NZONE_COLOR = [65, 58, 73] # 下一个块的背景色493A41
 
+CV_PROFILE_DIR = os.path.join(BASE_DIR, 'profiles') # 标定文件，按窗口大小和DPI保存区域位置和方块颜色
+
+CV_CAPTURE_PROCESS = True # 在独立进程中截图，通过共享内存环形缓冲区传给决策线程
+CV_CAPTURE_INTERVAL = 0.005 # 截图进程的最小帧间隔
+CV_FRAME_RING_SLOTS = 4
+
+CV_SPAWN_POLL_INTERVAL = 0.005 # 出块检测只抓取出块区域和N区，可以高频轮询
+CV_SPAWN_TIMEOUT = 1.0 # 超时后退回到完整截图解析
+CV_SPAWN_NZONE_DIFF_THRESHOLD = 8 # N区缩略图平均像素差超过该值认为下一个块已经变化
+
+CV_OZONE_BACKGROUND_HSV_LOWER = [100, 120, 100] # 对手区域背景(深蓝紫色星空)的HSV范围，对手方块中心也在此范围内
+CV_OZONE_BACKGROUND_HSV_UPPER = [140, 255, 209] # 对手方块的霓虹边框更亮，或者不是蓝紫色
+CV_OZONE_SAMPLE_OFFSET = 0.15 # 对手区域的取样点在单元格左侧边框上，单元格宽度的比例
+CV_OZONE_RETRY_INTERVAL = 2.0 # 没有对手时(单人模式)，每隔这么多秒才重新搜索对手区域
+CV_OZONE_RETRY_MAX_INTERVAL = 30.0 # 每次搜索不到对手区域，重新搜索的间隔加倍，最多到这么多秒
+
+CV_SCREEN_IDLE_INTERVAL = 0.5 # 菜单、匹配、结算等非游戏画面的轮询间隔
+CV_SCREEN_COUNTDOWN_POLL_INTERVAL = 0.02 # 倒计时(棋盘为空且还没有出块)时高频轮询，开局后尽快做第一个决策
+CV_SCREEN_CALIBRATE_INTERVAL = 2.0 # 找不到P区边框时，每隔这么多秒才用颜色掩码重新搜索P区
+CV_SCREEN_GREY_SATURATION_MAX = 40 # HSV饱和度低于该值的非空单元格认为是灰色(游戏结束时方块变灰)
+CV_SCREEN_GAME_OVER_GREY_RATIO = 0.6 # 灰色单元格占非空单元格的比例超过该值认为游戏结束
+CV_SCREEN_ROUND_END_FRAMES = 3 # 游戏中连续这么多帧是结算或未知画面才认为本局结束并重置GameState，之前按倒计时的间隔轮询
+
 CV_BLOCKS_GHOST_HSV_V_THRESHOLD = 140 # 低于这个亮度的认为是空白，有效消除ghost block
 CV_BLOCK_I_COLOR = [148, 254, 25] # 19FE94
 CV_BLOCK_J_COLOR = [253, 135, 45] # 2D87FD
@@ -45,4 +140,25 @@ CV_BLOCK_L_COLOR = [68, 230, 155] # 9BE644
 CV_BLOCK_O_COLOR = [56, 56, 240] # F03838
 CV_BLOCK_S_COLOR = [246, 89, 195] # C359F6
 CV_BLOCK_T_COLOR = [48, 213, 254] # FED530
-CV_BLOCK_Z_COLOR = [67, 134, 249] # F98643
\ No newline at end of file
+CV_BLOCK_Z_COLOR = [67, 134, 249] # F98643
+CV_BLOCK_COLOR_TOLERANCE = 30 # 与配置颜色的BGR绝对差之和小于该值时，认为是同一种方块，并记录实际颜色
+CV_BLOCK_COLOR_LEARN_RATE = 0.2 # 记录的实际颜色是匹配到的颜色的滑动平均，每次向新颜色移动的比例
+CV_BLOCK_COLOR_SAVE_DELTA = 6 # 滑动平均与已记录颜色的BGR绝对差之和达到该值才更新记录并保存标定文件
+
+# Machine profile
+# 本机标定的结果(按键时序等)保存在这里，由入口(app.py、calibration.py)调用 load_machine_profile() 覆盖上面同名的默认值，
+# 导入本模块时不加载，测试和基准测试因此总是使用默认值
+MACHINE_PROFILE_PATH = os.path.join(CV_PROFILE_DIR, 'machine.json')
+
+def load_machine_profile(path: str = MACHINE_PROFILE_PATH) -> dict:
+    '''
+    Override the KBD_ settings with the calibrated values in path. Missing or broken files are ignored.
+    '''
+    try:
+        with open(path, encoding='utf-8') as f:
+            overrides = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    applied = {name: value for name, value in overrides.items() if name.startswith('KBD_') and name in globals()}
+    globals().update(applied)
+    return applied
@@ -5,16 +5,21 @@ Created: 2025-04-05
 Description:
     创建一个半透明的置顶信息面板，显示关键信息，如最高行数和决策数。
     窗口无边框、透明，并保持在最前面。
+    决策线程通过 telemetry 队列发送运行指标快照，面板用 root.after 定期读取，显示每秒决策数和各阶段延迟。
 """
 
 import config.settings
 
 import tkinter as tk
+import telemetry
 
 class ControlPanel:
-    def __init__(self, close_event=None):
+    STAGE_NAMES = {'capture': '截图', 'perceive': '解析', 'search': '搜索', 'actuate': '按键'}
+
+    def __init__(self, close_event=None, telemetry_channel=None):
         self.root = tk.Tk()
         self.close_event = close_event
+        self.telemetry_channel = telemetry_channel
 
 
         # 设置窗口为置顶
@@ -27,7 +32,7 @@ class ControlPanel:
         self.root.overrideredirect(True)
 
         # 设置窗口大小和位置
-        self.root.geometry('300x100+100+100')  # 宽度300，高度100，位置(100,100)
+        self.root.geometry('300x200+100+100')  # 宽度300，高度200，位置(100,100)
 
         # 添加标签用于显示信息
         self.label = tk.Label(self.root, text="开启自动: 否\n决策数: 0/s", font=("Arial", 14), bg='black', fg='white')
@@ -71,11 +76,25 @@ class ControlPanel:
         # 启动关闭检查，启动窗口的主循环
         if self.close_event is not None:
             self.root.after(100, self._check_close)
+        if self.telemetry_channel is not None:
+            self.root.after(config.settings.CP_REFRESH_INTERVAL_MS, self._poll_telemetry)
         self.root.mainloop()
 
-    def update(self, autoplay: bool, decision_rate: float):
+    def _poll_telemetry(self):
+        # 只取最新的快照，队列为空时保持原来的显示
+        snapshot = telemetry.latest_snapshot(self.telemetry_channel)
+        if snapshot is not None:
+            self.update(snapshot['autoplay'], snapshot['decision_rate'], snapshot['latency'])
+        self.root.after(config.settings.CP_REFRESH_INTERVAL_MS, self._poll_telemetry)
+
+    def update(self, autoplay: bool, decision_rate: float, latency=None):
         # 更新标签的文本
-        self.label.config(text=f"开启自动: {autoplay}\n决策数: {decision_rate:.2f}")
+        lines = [f"开启自动: {'是' if autoplay else '否'}", f"决策数: {decision_rate:.2f}/s"]
+        for stage, percentiles in (latency or {}).items():
+            if percentiles is not None:
+                p50, p99 = percentiles
+                lines.append(f"{self.STAGE_NAMES.get(stage, stage)}: p50 {p50 * 1000:.1f} / p99 {p99 * 1000:.1f} ms")
+        self.label.config(text="\n".join(lines))
 
 if __name__ == "__main__":
 
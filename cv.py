@@ -13,16 +13,254 @@ Description:
 import config.settings
 from _logger import logger
 
-import pygetwindow as gw
-import pyautogui
 from PIL import Image
-import mss
 import numpy as np
 import cv2
-from typing import List, Tuple, Optional, Any
+import os
+import json
+import tempfile
+import time
+from enum import Enum
+from typing import List, Tuple, Dict, Optional, Any
 import _utils
 import alg
-import keyboardctrl
+import framesource
+import metrics
+import profiling
+
+class ZoneGeometry:
+    '''
+    Calibrated positions inside the game window, everything the per frame parsing needs:
+        P zone and N zone bbox,
+        cell center grid of P zone (20 rows * 10 columns),
+        spawn cells (rows 0-1, columns 3-6) and the cells probed for the current block,
+        block colors as they are actually rendered on this machine.
+    It is persisted per window size and DPI, so the next start only verifies it with a few pixels
+    instead of searching the color masks again.
+    '''
+    ROWS, COLS = 20, 10
+    SPAWN_ROWS = (0, 1)
+    SPAWN_COLS = (3, 4, 5, 6)
+    SPAWN_PROBES = ((0, 4), (0, 5)) # current block probes, if the first is background try the second one.
+    PROFILE_VERSION = 1
+
+    def __init__(self):
+        self.p_bbox: Optional[Tuple[int, int, int, int]] = None
+        self.n_bbox: Optional[Tuple[int, int, int, int]] = None
+        self.cell_ys: Optional[np.ndarray] = None # pixel y of each cell center, shape (20, 10)
+        self.cell_xs: Optional[np.ndarray] = None
+        self.o_bbox: Optional[Tuple[int, int, int, int]] = None # only present in versus matches
+        self.o_cell_ys: Optional[np.ndarray] = None
+        self.o_cell_xs: Optional[np.ndarray] = None
+        self.piece_colors: Dict[_utils.TetrisBlockType, List[int]] = self.default_piece_colors()
+        self._color_means: Dict[_utils.TetrisBlockType, np.ndarray] = {} # running averages of the rendered colors
+        self.dirty = False # changed since loaded from / saved to profile
+
+    @staticmethod
+    def default_piece_colors() -> Dict[_utils.TetrisBlockType, List[int]]:
+        return {
+            _utils.TetrisBlockType.I: list(config.settings.CV_BLOCK_I_COLOR),
+            _utils.TetrisBlockType.J: list(config.settings.CV_BLOCK_J_COLOR),
+            _utils.TetrisBlockType.L: list(config.settings.CV_BLOCK_L_COLOR),
+            _utils.TetrisBlockType.O: list(config.settings.CV_BLOCK_O_COLOR),
+            _utils.TetrisBlockType.S: list(config.settings.CV_BLOCK_S_COLOR),
+            _utils.TetrisBlockType.T: list(config.settings.CV_BLOCK_T_COLOR),
+            _utils.TetrisBlockType.Z: list(config.settings.CV_BLOCK_Z_COLOR),
+        }
+
+    def set_p_bbox(self, bbox: Tuple[int, int, int, int]):
+        self.p_bbox = tuple(int(v) for v in bbox)
+        x, y, w, h = self.p_bbox
+        cell_w, cell_h = w / self.COLS, h / self.ROWS
+        ys = np.round(y + np.arange(self.ROWS) * cell_h + cell_h / 2).astype(int)
+        xs = np.round(x + np.arange(self.COLS) * cell_w + cell_w / 2).astype(int)
+        self.cell_ys, self.cell_xs = np.meshgrid(ys, xs, indexing='ij')
+        self.dirty = True
+
+    def set_n_bbox(self, bbox: Tuple[int, int, int, int]):
+        self.n_bbox = tuple(int(v) for v in bbox)
+        self.dirty = True
+
+    def set_o_bbox(self, bbox: Tuple[int, int, int, int]):
+        '''
+        Opponent cells are neon frames with a dark center as the background, so sample on the left frame.
+        '''
+        self.o_bbox = tuple(int(v) for v in bbox)
+        x, y, w, h = self.o_bbox
+        cell_w, cell_h = w / self.COLS, h / self.ROWS
+        ys = np.round(y + np.arange(self.ROWS) * cell_h + cell_h / 2).astype(int)
+        xs = np.round(x + (np.arange(self.COLS) + config.settings.CV_OZONE_SAMPLE_OFFSET) * cell_w).astype(int)
+        self.o_cell_ys, self.o_cell_xs = np.meshgrid(ys, xs, indexing='ij')
+        self.dirty = True
+
+    def ready(self) -> bool:
+        return self.p_bbox is not None and self.n_bbox is not None
+
+    @property
+    def spawn_rect(self) -> Tuple[int, int, int, int]:
+        '''
+        Window relative rect covering the spawn cells.
+        '''
+        x, y, w, h = self.p_bbox
+        cell_w, cell_h = w / self.COLS, h / self.ROWS
+        left = round(x + self.SPAWN_COLS[0] * cell_w)
+        top = round(y + self.SPAWN_ROWS[0] * cell_h)
+        return left, top, round(len(self.SPAWN_COLS) * cell_w), round(len(self.SPAWN_ROWS) * cell_h)
+
+    @property
+    def spawn_centers(self) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        Cell centers of the spawn cells, relative to spawn_rect.
+        '''
+        left, top, _, _ = self.spawn_rect
+        rows = slice(self.SPAWN_ROWS[0], self.SPAWN_ROWS[-1] + 1)
+        cols = slice(self.SPAWN_COLS[0], self.SPAWN_COLS[-1] + 1)
+        return self.cell_ys[rows, cols] - top, self.cell_xs[rows, cols] - left
+
+    def verify_p_zone(self, img_bgr: np.ndarray) -> bool:
+        '''
+        Probe a few points of the P zone border, much cheaper than get_P_zone().
+        '''
+        if self.p_bbox is None:
+            return False
+        x, y, w, h = self.p_bbox
+        points = [(x, y + h // 4), (x, y + h // 2), (x + w - 1, y + h // 4), (x + w - 1, y + h // 2), (x + w // 2, y)]
+        return self._all_color(img_bgr, points, config.settings.CV_PZONE_BBOX_COLOR)
+
+    def verify_n_zone(self, img_bgr: np.ndarray) -> bool:
+        '''
+        Probe the middle of each N zone edge, the block itself is always in the center.
+        '''
+        if self.n_bbox is None:
+            return False
+        x, y, w, h = self.n_bbox
+        points = [(x + w // 2, y + 2), (x + 2, y + h // 2), (x + w - 3, y + h // 2), (x + w // 2, y + h - 3)]
+        return self._all_color(img_bgr, points, config.settings.CV_NZONE_COLOR)
+
+    def verify_o_zone(self, img_bgr: np.ndarray) -> bool:
+        '''
+        Probe the thin dark lines left and right of the opponent board, they share the background HSV range.
+        '''
+        if self.o_bbox is None:
+            return False
+        x, y, w, h = self.o_bbox
+        height, width = img_bgr.shape[:2]
+        if x < 1 or x + w >= width or y + h > height:
+            return False
+        probe_ys = [y + h * i // 6 for i in range(1, 6)]
+        probes = np.array([[img_bgr[py, x - 1] for py in probe_ys] + [img_bgr[py, x + w] for py in probe_ys]], dtype=np.uint8)
+        in_range = cv2.inRange(cv2.cvtColor(probes, cv2.COLOR_BGR2HSV),
+                               np.array(config.settings.CV_OZONE_BACKGROUND_HSV_LOWER, dtype=np.uint8),
+                               np.array(config.settings.CV_OZONE_BACKGROUND_HSV_UPPER, dtype=np.uint8))
+        return np.count_nonzero(in_range) >= 0.8 * in_range.size
+
+    @staticmethod
+    def _all_color(img_bgr: np.ndarray, points: List[Tuple[int, int]], color: List[int]) -> bool:
+        height, width = img_bgr.shape[:2]
+        for px, py in points:
+            if not (0 <= px < width and 0 <= py < height):
+                return False
+            if not np.array_equal(img_bgr[py, px], color):
+                return False
+        return True
+
+    def match_block_color(self, bgr: np.ndarray) -> Optional[_utils.TetrisBlockType]:
+        '''
+        Exact match against the known colors first. Otherwise accept the nearest configured color
+        within CV_BLOCK_COLOR_TOLERANCE and learn the rendered color for next time.
+        The configured color stays the anchor: the learned one is a running average of the matches,
+        which stays within the tolerance of it, and is only stored (and saved with the profile)
+        once it moved CV_BLOCK_COLOR_SAVE_DELTA away from the stored color.
+        '''
+        for block_type, color in self.piece_colors.items():
+            if np.array_equal(bgr, color):
+                return block_type
+
+        bgr = np.asarray(bgr, dtype=int)
+        best_type, best_distance = None, None
+        for block_type, color in self.default_piece_colors().items():
+            distance = int(np.abs(bgr - color).sum())
+            if best_distance is None or distance < best_distance:
+                best_type, best_distance = block_type, distance
+        if best_distance is None or best_distance > config.settings.CV_BLOCK_COLOR_TOLERANCE:
+            return None
+        mean = self._color_means.get(best_type)
+        if mean is None:
+            mean = np.asarray(self.piece_colors[best_type], dtype=float)
+        # both ends are within the tolerance of the anchor, so is every average of them
+        mean = mean + config.settings.CV_BLOCK_COLOR_LEARN_RATE * (bgr - mean)
+        self._color_means[best_type] = mean
+        learned = np.round(mean).astype(int)
+        if int(np.abs(learned - self.piece_colors[best_type]).sum()) >= config.settings.CV_BLOCK_COLOR_SAVE_DELTA:
+            logger.info(f'learned color {learned.tolist()} for block {best_type.value}')
+            self.piece_colors[best_type] = learned.tolist()
+            self.dirty = True
+        return best_type
+
+    def to_dict(self) -> dict:
+        return {
+            'version': self.PROFILE_VERSION,
+            'p_zone_bbox': list(self.p_bbox) if self.p_bbox else None,
+            'n_zone_bbox': list(self.n_bbox) if self.n_bbox else None,
+            'o_zone_bbox': list(self.o_bbox) if self.o_bbox else None,
+            'cell_centers': [self.cell_ys.tolist(), self.cell_xs.tolist()] if self.cell_ys is not None else None,
+            'spawn_cells': [[row, col] for row in self.SPAWN_ROWS for col in self.SPAWN_COLS],
+            'piece_colors': {block_type.value: color for block_type, color in self.piece_colors.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'ZoneGeometry':
+        if data.get('version') != cls.PROFILE_VERSION:
+            raise ValueError(f"Unsupported profile version {data.get('version')}")
+        geometry = cls()
+        if data['p_zone_bbox'] is not None:
+            geometry.set_p_bbox(data['p_zone_bbox'])
+            if data.get('cell_centers') is not None:
+                geometry.cell_ys = np.array(data['cell_centers'][0], dtype=int)
+                geometry.cell_xs = np.array(data['cell_centers'][1], dtype=int)
+        if data['n_zone_bbox'] is not None:
+            geometry.set_n_bbox(data['n_zone_bbox'])
+        if data.get('o_zone_bbox') is not None:
+            geometry.set_o_bbox(data['o_zone_bbox'])
+        for value, color in data.get('piece_colors', {}).items():
+            geometry.piece_colors[_utils.TetrisBlockType(value)] = list(color)
+        geometry.dirty = False
+        return geometry
+
+    @staticmethod
+    def profile_path(width: int, height: int, dpi: int) -> str:
+        return os.path.join(config.settings.CV_PROFILE_DIR, f'calibration_{width}x{height}_{dpi}dpi.json')
+
+    @classmethod
+    def load(cls, path: str) -> Optional['ZoneGeometry']:
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return cls.from_dict(json.load(f))
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f'ignore broken calibration profile {path}: {e}')
+            return None
+
+    def save(self, path: str):
+        '''
+        Write to a temporary file and move it over path, windows of the same size share the profile
+        and may save it at the same time, a reader never sees a half written file.
+        '''
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path), suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(self.to_dict(), f, indent=2)
+                os.replace(temp_path, path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+            self.dirty = False
+        except OSError as e:
+            logger.warning(f'cannot save calibration profile {path}: {e}')
+
 
 class ScreenshotProcessor:
     '''
@@ -30,17 +268,56 @@ class ScreenshotProcessor:
     Then recognize P zone and N zone.
     Then store the game state and next block.
     '''
-    def __init__(self):
-        self.window = None # automatically find the target window when invoking capture()
+    def __init__(self, source: Optional[framesource.FrameSource] = None):
+        # capture backend, live window grab by default. The window is found by the source when invoking capture()
+        self.source = source if source is not None else framesource.MssFrameSource()
+        self.frame_seq = 0
+        self.frame_timestamp_ns = 0
         
-        # this screenshot not modified.
-        self.screenshot: Optional[Image.Image] = None # always store the last screenshot, use other code to gurantee the sc is up to date.
+        # BGR frame as returned by the source, not modified. Parsing works on it directly.
+        self.frame_bgr: Optional[np.ndarray] = None
+        self._screenshot_cache: Tuple[int, Optional[Image.Image]] = (-1, None)
 
         self.annotated_image: Optional[Image.Image] = None # in RGB format, used for debug.
         self.playable = False
 
+        # calibrated zones, loaded from the profile of current window size and DPI. Also used by SpawnDetector.
+        self.geometry: Optional[ZoneGeometry] = None
+        self._profile_key: Optional[Tuple[int, int, int]] = None # (width, height, dpi)
+        self._profile_path: Optional[str] = None
+        self._o_zone_last_search = -float('inf')
+        self._o_zone_retry_interval = config.settings.CV_OZONE_RETRY_INTERVAL # doubled after every miss
+
         pass
     
+    @property
+    def window(self):
+        return self.source.window
+
+    def close(self):
+        self.source.close()
+
+    @property
+    def screenshot(self) -> Optional[Image.Image]:
+        '''
+        RGB PIL image of the current frame, only converted when asked for (debug, glance).
+        '''
+        if self.frame_bgr is None:
+            return None
+        seq, image = self._screenshot_cache
+        if seq != self.frame_seq or image is None:
+            image = Image.fromarray(cv2.cvtColor(self.frame_bgr, cv2.COLOR_BGR2RGB))
+            self._screenshot_cache = (self.frame_seq, image)
+            metrics.CACHE_REQUESTS.inc(cache='screenshot', result='miss')
+        else:
+            metrics.CACHE_REQUESTS.inc(cache='screenshot', result='hit')
+        return image
+
+    @screenshot.setter
+    def screenshot(self, image: Image.Image):
+        self.frame_bgr = cv2.cvtColor(np.array(image.convert('RGB')), cv2.COLOR_RGB2BGR)
+        self.frame_seq += 1
+
     def glance(self):
         '''
         only for debug
@@ -48,6 +325,7 @@ class ScreenshotProcessor:
         self.screenshot.show()
         return
     
+    @profiling.traced('cv.capture')
     def capture(self) -> bool:
 
         logger.debug('capture begin')
@@ -55,36 +333,62 @@ class ScreenshotProcessor:
         self.playable = False
 
         # invoke individually before get_P_zone() and get_N_zone()
-        if self.window is None:
-            try:
-                self.window = _utils.WindowUtils.find_tetris_window()
-                logger.debug(f"Found window")
-            except:
-                logger.error('capture error')
-                return False
-
-        _utils.WindowUtils.bring_to_front(self.window)
-
-        left, top, width, height = self.window.left, self.window.top, self.window.width, self.window.height
+        if not self.source.open():
+            logger.error('capture error')
+            metrics.PERCEPTION_FAILURES.inc(zone='capture', reason='source_closed')
+            return False
 
+        self.source.bring_to_front()
 
-        with mss.mss() as sct:
-            monitor = {"left": left, "top": top, "width": width, "height": height}
-            screenshot = sct.grab(monitor)
-            image = Image.fromarray(np.array(screenshot)[:, :, :3][..., ::-1])  # Convert BGR to RGB
-        self.screenshot = image
-        self.playable = True
+        latest = self.source.grab()
+        if latest is None:
+            logger.debug('no new frame')
+            metrics.PERCEPTION_FAILURES.inc(zone='capture', reason='no_frame')
+            return False
+        self.load_frame(latest)
 
         logger.debug('capture end')
         return True
+
+    def load_frame(self, latest: Tuple[int, int, List[np.ndarray]]):
+        '''
+        Use a frame grabbed elsewhere, e.g. by the capture stage of pipeline.Pipeline.
+        :param latest: return value of FrameSource.grab() without rects.
+        '''
+        self.frame_seq, self.frame_timestamp_ns, (self.frame_bgr,) = latest
+        self.load_profile()
+        self.playable = True
     
+    def load_profile(self):
+        '''
+        Pick the calibration profile matching current window size and DPI, only when either changed.
+        load_frame() calls it, others only need it for a frame set without load_frame().
+        '''
+        height, width = self.frame_bgr.shape[:2]
+        dpi = _utils.WindowUtils.get_window_dpi(self.window)
+        if self._profile_key == (width, height, dpi):
+            return
+        self._profile_key = (width, height, dpi)
+        self._profile_path = ZoneGeometry.profile_path(width, height, dpi)
+        self.geometry = ZoneGeometry.load(self._profile_path)
+        if self.geometry is None:
+            logger.info(f'no calibration profile for {width}x{height} {dpi}dpi, calibrate from color masks')
+            self.geometry = ZoneGeometry()
+        else:
+            logger.info(f'calibration profile loaded: {self._profile_path}')
+
+    def _save_profile(self):
+        if self.geometry is not None and self.geometry.dirty and self._profile_path is not None:
+            self.geometry.save(self._profile_path)
+            logger.info(f'calibration profile saved: {self._profile_path}')
+
     def get_P_zone(self)->Tuple[cv2.typing.MatLike,Tuple[int,int,int,int]|None]:
         '''
         Palletizing Zone is the main gaming zone, consists of 20 rows and 10 columns.
 
         Return: coordinate of leftmost topmost, and width height.
         '''
-        img_cv = cv2.cvtColor(np.array(self.screenshot), cv2.COLOR_RGB2BGR)
+        img_cv = self.frame_bgr.copy() # annotated below
         
         target_color = np.array(config.settings.CV_PZONE_BBOX_COLOR, dtype=np.uint8)
         
@@ -112,90 +416,109 @@ class ScreenshotProcessor:
         cv2.rectangle(img_cv, (x, y), (x + w, y + h), (0, 255, 0), 2)
         return img_cv, (x, y, w, h)
     
+    def _read_board(self, img_bgr: np.ndarray, threshold: int) -> np.ndarray:
+        cell_values = img_bgr[self.geometry.cell_ys, self.geometry.cell_xs].max(axis=-1)
+        board = (cell_values >= threshold).astype(np.uint8)
+        board[:2] = 0 # always ignore first two rows.
+        return board
+
+    def _late_capture_board(self, img_bgr: np.ndarray, threshold: int) -> Optional[np.ndarray]:
+        '''
+        Return: the predicted board if the observed one only has the falling block (1 to 4 cells) more, else None.
+        '''
+        game_state_singleton = alg.GameState()
+        predicted = game_state_singleton.predicted_board
+        if predicted is None:
+            return None
+        observed = self._read_board(img_bgr, threshold) != 0
+        expected = predicted != 0
+        if np.any(expected & ~observed) or not 1 <= np.count_nonzero(observed & ~expected) <= 4:
+            return None
+        game_state_singleton.resolve_prediction('verified')
+        return predicted
+
+    @profiling.traced('cv.get_P_zone_new_state')
     def get_P_zone_new_state(self) -> bool:
         '''
         In this method, determine which block is filled, and internally update GameState singleton.
         new state is represented by ndarray of 20 rows and 10 columns.
 
-        Return: success or not.
-        '''
+        The P zone bbox comes from the calibration profile and is only verified here,
+        get_P_zone() runs again when the verification fails.
 
-        img_with_bbox, bbox = self.get_P_zone() # here the img_with_bbox is in BGR format.
-        if bbox is None:
-            return False
+        When GameState holds a predicted board from the last decision, only its discriminating cells are sampled.
+        All cells are read only when they do not match, and the mismatch is reported as misdrop or garbage.
+        The current block comes from the piece queue of GameState once it is tracked, a late capture
+        (block already below the spawn rows) is then still usable if the board matches the prediction.
 
-        x, y, w, h = bbox
-        cell_width_in_pixel_float = w / 10
-        cell_height_in_pixel_float = h / 20
-
-        p_zone_mask = np.zeros((20, 10), dtype=np.uint8) # 20 rows and 10 columns
-        # Iterate over rows and columns, skipping the top 2 rows
-        for row in range(2, 20):
-            for col in range(10):
-            # Calculate the center of each cell
-                center_x = x + col * cell_width_in_pixel_float + cell_width_in_pixel_float / 2
-                center_x = round(center_x)
-                center_y = y + row * cell_height_in_pixel_float + cell_height_in_pixel_float / 2
-                center_y = round(center_y)
-
-                # Get the pixel value at the center
-                cell_center_bgr = img_with_bbox[center_y, center_x] # BGR
-                # Here we do not match exact color, the backgroud is relativly dark, so we use HSV to match
-                # This method can efficiently discard ghost block.
-                pixel_HSV = cv2.cvtColor(np.uint8([[cell_center_bgr]]), cv2.COLOR_BGR2HSV)[0][0]
-                
-                if pixel_HSV[2] < config.settings.CV_BLOCKS_GHOST_HSV_V_THRESHOLD:
-                    # Draw a small circle at the center of the cell, indicate the cell is empty
-                    ##radius = min(cell_width_in_pixel_float, cell_height_in_pixel_float) // 6
-                    ##radius = round(radius)
-                    ##cv2.circle(img_with_bbox, (center_x, center_y), radius, (0, 0, 0), -1)
-                    pass
-                else:
-                    p_zone_mask[row, col] = 1 # 1 means this cell is filled. always ignore first two rows.
+        Return: success or not.
+        '''
+        if self.geometry is None:
+            self.load_profile()
+        geometry = self.geometry
+        img_bgr = self.frame_bgr
+        if not geometry.verify_p_zone(img_bgr):
+            _, bbox = self.get_P_zone()
+            if bbox is None:
+                metrics.PERCEPTION_FAILURES.inc(zone='P', reason='no_bbox')
+                return False
+            geometry.set_p_bbox(bbox)
 
         game_state_singleton = alg.GameState()
-        # first update board
-        game_state_singleton.update_board(p_zone_mask)
-        # then update current block
+        tracked_block = game_state_singleton.current_block if game_state_singleton.queue_tracked else None
+
+        # first check the current block
         # match excat color, check the row 1 col 5 color, if it is background color, check row 1 col 6.
         # if both are empty, it means that capture is too late, may it goes down already.
+        # The piece queue of GameState already knows which block spawned, then the probe only confirms it.
+        spawn_bgr = None
+        for row, col in geometry.SPAWN_PROBES:
+            cell_center_bgr = img_bgr[geometry.cell_ys[row, col], geometry.cell_xs[row, col]] # BGR
+            if not np.array_equal(cell_center_bgr, config.settings.CV_PZONE_BACKGROUND_COLOR):
+                spawn_bgr = cell_center_bgr
+                break
+        if spawn_bgr is None and tracked_block is None:
+            logger.info("Cell is background color, no block detected in row 1 col 5 and 6.")
+            metrics.PERCEPTION_FAILURES.inc(zone='P', reason='no_block')
+            return False
 
-
-        # try to find current block in the top middle.
-        center_y = y + 0*cell_height_in_pixel_float + cell_height_in_pixel_float / 2
-        center_y = round(center_y)
-        center_x = x + 4 * cell_width_in_pixel_float + cell_width_in_pixel_float / 2
-        center_x = round(center_x)
-        cell_center_bgr = img_with_bbox[center_y, center_x] # BGR, here y refers to the picture y, but it is literally x in ndarray.
-        
-        block_colors_dict = {
-            _utils.TetrisBlockType.I: config.settings.CV_BLOCK_I_COLOR,
-            _utils.TetrisBlockType.J: config.settings.CV_BLOCK_J_COLOR,
-            _utils.TetrisBlockType.L: config.settings.CV_BLOCK_L_COLOR,
-            _utils.TetrisBlockType.O: config.settings.CV_BLOCK_O_COLOR,
-            _utils.TetrisBlockType.S: config.settings.CV_BLOCK_S_COLOR,
-            _utils.TetrisBlockType.T: config.settings.CV_BLOCK_T_COLOR,
-            _utils.TetrisBlockType.Z: config.settings.CV_BLOCK_Z_COLOR,
-        }
-
-        if not np.all(cell_center_bgr == config.settings.CV_PZONE_BACKGROUND_COLOR):
-            for block_type, color in block_colors_dict.items():
-                if np.all(cell_center_bgr == color):
-                    game_state_singleton.update_current_block(block_type)
-                    break
-        else:
-            # try to find row 1 col 6
-            center_x = x + 5 * cell_width_in_pixel_float + cell_width_in_pixel_float / 2
-            center_x = round(center_x)
-            cell_center_bgr = img_with_bbox[center_y, center_x] # BGR
-            if np.all(cell_center_bgr == config.settings.CV_PZONE_BACKGROUND_COLOR):
-                logger.info("Cell is background color, no block detected in row 1 col 5 and 6.")
+        # Here we do not match exact color, the backgroud is relativly dark,
+        # so we use HSV V (= max of B, G, R) to match. This method can efficiently discard ghost block.
+        threshold = config.settings.CV_BLOCKS_GHOST_HSV_V_THRESHOLD
+        p_zone_mask = None
+        if spawn_bgr is None:
+            # Late capture, the falling block is on the board. Accept the predicted board if the observed one
+            # is exactly it plus the falling block, otherwise wait for a better frame.
+            p_zone_mask = self._late_capture_board(img_bgr, threshold)
+            if p_zone_mask is None:
+                logger.info(f"Late capture, {tracked_block} left the spawn area and the board cannot be predicted.")
+                metrics.PERCEPTION_FAILURES.inc(zone='P', reason='late_capture')
                 return False
-            for block_type, color in block_colors_dict.items():
-                if np.all(cell_center_bgr == color):
-                    game_state_singleton.update_current_block(block_type)
-                    break
-
+        elif game_state_singleton.predicted_board is not None:
+            rows, cols = game_state_singleton.verification_cells()
+            cell_values = img_bgr[geometry.cell_ys[rows, cols], geometry.cell_xs[rows, cols]].max(axis=-1)
+            if np.array_equal(cell_values >= threshold, game_state_singleton.predicted_board[rows, cols] != 0):
+                p_zone_mask = game_state_singleton.predicted_board
+                game_state_singleton.resolve_prediction('verified')
+
+        if p_zone_mask is None:
+            # Sample all cell centers at once.
+            p_zone_mask = self._read_board(img_bgr, threshold)
+            if game_state_singleton.predicted_board is not None:
+                event = game_state_singleton.classify_misprediction(p_zone_mask)
+                logger.warning(f'Board does not match the prediction of last decision: {event}')
+                game_state_singleton.resolve_prediction(event)
+
+        # then update board and current block
+        game_state_singleton.update_board(p_zone_mask)
+        if spawn_bgr is not None:
+            if tracked_block is not None and np.array_equal(spawn_bgr, geometry.piece_colors.get(tracked_block)):
+                block_type = tracked_block # confirmed
+            else:
+                block_type = geometry.match_block_color(spawn_bgr)
+            game_state_singleton.confirm_current_block(block_type)
+
+        self._save_profile()
         #self.annotated_image = Image.fromarray(cv2.cvtColor(img_with_bbox, cv2.COLOR_BGR2RGB))
         return True
         
@@ -206,7 +529,7 @@ class ScreenshotProcessor:
         
         Return: the bounding box of the largest connected component in the mask.
         '''
-        img_cv = cv2.cvtColor(np.array(self.screenshot), cv2.COLOR_RGB2BGR)
+        img_cv = self.frame_bgr.copy() # annotated below
         
         target_color = np.array(config.settings.CV_NZONE_COLOR, dtype=np.uint8)
         
@@ -232,55 +555,331 @@ class ScreenshotProcessor:
         
         return img_cv, (x, y, w, h)
     
+    @profiling.traced('cv.get_N_zone_new_state')
     def get_N_zone_new_state(self) -> bool:
         '''
         Determine the next block type and update the game state.
         '''
 
         logger.debug('get_N_zone_new_state')
-        img_with_bbox, bbox = self.get_N_zone()
-        if bbox is None:
-            return False
-        x, y, w, h = bbox
-        region_of_interest = img_with_bbox[y:y + h, x:x + w]
-
-        # Define the block colors to check against
-        block_colors_dict = {
-            _utils.TetrisBlockType.I: config.settings.CV_BLOCK_I_COLOR,
-            _utils.TetrisBlockType.O: config.settings.CV_BLOCK_O_COLOR,
-            _utils.TetrisBlockType.T: config.settings.CV_BLOCK_T_COLOR,
-            _utils.TetrisBlockType.S: config.settings.CV_BLOCK_S_COLOR,
-            _utils.TetrisBlockType.Z: config.settings.CV_BLOCK_Z_COLOR,
-            _utils.TetrisBlockType.J: config.settings.CV_BLOCK_J_COLOR,
-            _utils.TetrisBlockType.L: config.settings.CV_BLOCK_L_COLOR,
-        }
+        if self.geometry is None:
+            self.load_profile()
+        geometry = self.geometry
+        img_bgr = self.frame_bgr
+        if not geometry.verify_n_zone(img_bgr):
+            _, bbox = self.get_N_zone()
+            if bbox is None:
+                metrics.PERCEPTION_FAILURES.inc(zone='N', reason='no_bbox')
+                return False
+            geometry.set_n_bbox(bbox)
+        x, y, w, h = geometry.n_bbox
+        region_of_interest = img_bgr[y:y + h, x:x + w]
 
         max_pixel_sum = 0
         detected_block_type = None
 
-        for item in block_colors_dict.items():
-            target_color = np.array(item[1], dtype=np.uint8)
+        for block_type, color in geometry.piece_colors.items():
+            target_color = np.array(color, dtype=np.uint8)
             mask = cv2.inRange(region_of_interest, target_color, target_color)
             pixel_sum = np.sum(mask)  # Sum of pixel intensities in the mask
 
             if pixel_sum > max_pixel_sum:
                 max_pixel_sum = pixel_sum
-                detected_block_type = item[0]
+                detected_block_type = block_type
 
         if detected_block_type is None:
             logger.error('cannot detect in get_N_zone_new_state')
+            metrics.PERCEPTION_FAILURES.inc(zone='N', reason='no_block')
             return False
 
         # Update the game state with the detected block type
         game_state_singleton = alg.GameState()
         game_state_singleton.update_next_block(detected_block_type)
         #logger.debug(f'Detected NEXT block type if file cv.py: {detected_block_type}')
+        self._save_profile()
+        return True
+
+    def get_O_zone(self) -> Tuple[cv2.typing.MatLike, Tuple[int, int, int, int]|None]:
+        '''
+        Opponent Zone is the opponent board in versus matches, 20 rows and 10 columns on a dark blue background.
+        Empty cells and the centers of filled cells are all in the background HSV range, the largest such
+        region is the board. Then the bbox is refined to the thin dark lines around the board.
+
+        Return: coordinate of leftmost topmost, and width height. None if there is no opponent.
+        '''
+        img_cv = self.frame_bgr.copy() # annotated below
+        hsv = cv2.cvtColor(img_cv, cv2.COLOR_BGR2HSV)
+        mask = cv2.inRange(hsv,
+                           np.array(config.settings.CV_OZONE_BACKGROUND_HSV_LOWER, dtype=np.uint8),
+                           np.array(config.settings.CV_OZONE_BACKGROUND_HSV_UPPER, dtype=np.uint8))
+        closed = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones((9, 9), np.uint8))
+        contours, _ = cv2.findContours(closed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        if not contours:
+            return img_cv, None
+
+        largest_contour = max(contours, key=cv2.contourArea)
+        x, y, w, h = cv2.boundingRect(largest_contour)
+        # must look like a 20 * 10 board and be mostly covered, otherwise it is some background decoration.
+        if not (1.8 < h / w < 2.2) or cv2.contourArea(largest_contour) < 0.8 * w * h:
+            return img_cv, None
+
+        board = mask[y:y + h, x:x + w] > 0
+        col_ratio, row_ratio = board.mean(axis=0), board.mean(axis=1)
+        edge = max(2, w // 20)
+        left_lines = np.nonzero(col_ratio[:edge] > 0.9)[0]
+        right_lines = np.nonzero(col_ratio[-edge:] > 0.9)[0]
+        bottom_lines = np.nonzero(row_ratio[-edge:] > 0.9)[0]
+        if left_lines.size and right_lines.size and bottom_lines.size:
+            left = x + left_lines[-1] + 1
+            right = x + w - edge + right_lines[0]
+            bottom = y + h - edge + bottom_lines[0]
+            w = right - left
+            h = 2 * w # cells are square, the top row has no line
+            x, y = left, bottom - h
+
+        cv2.rectangle(img_cv, (x, y), (x + w, y + h), (0, 255, 0), 2)
+        return img_cv, (int(x), int(y), int(w), int(h))
+
+    def get_O_zone_new_state(self) -> bool:
+        '''
+        Read the opponent board into GameState with the same cached geometry and single pass sampling
+        as the P zone. While there is no opponent the color mask search waits CV_OZONE_RETRY_INTERVAL
+        seconds, doubled after every miss up to CV_OZONE_RETRY_MAX_INTERVAL, so single player frames
+        almost never pay for it.
+
+        Return: success or not.
+        '''
+        if self.geometry is None:
+            self.load_profile()
+        geometry = self.geometry
+        img_bgr = self.frame_bgr
+        if not geometry.verify_o_zone(img_bgr):
+            alg.GameState().update_opponent_board(None)
+            now = time.monotonic()
+            if now - self._o_zone_last_search < self._o_zone_retry_interval:
+                metrics.PERCEPTION_FAILURES.inc(zone='O', reason='retry_wait')
+                return False
+            self._o_zone_last_search = now
+            _, bbox = self.get_O_zone()
+            if bbox is None:
+                self._o_zone_retry_interval = min(2 * self._o_zone_retry_interval,
+                                                  config.settings.CV_OZONE_RETRY_MAX_INTERVAL)
+                metrics.PERCEPTION_FAILURES.inc(zone='O', reason='no_bbox')
+                return False
+            self._o_zone_retry_interval = config.settings.CV_OZONE_RETRY_INTERVAL
+            geometry.set_o_bbox(bbox)
+
+        samples = img_bgr[geometry.o_cell_ys, geometry.o_cell_xs]
+        empty = cv2.inRange(cv2.cvtColor(samples, cv2.COLOR_BGR2HSV),
+                            np.array(config.settings.CV_OZONE_BACKGROUND_HSV_LOWER, dtype=np.uint8),
+                            np.array(config.settings.CV_OZONE_BACKGROUND_HSV_UPPER, dtype=np.uint8))
+        opponent_board = (empty == 0).astype(np.uint8)
+        opponent_board[:2] = 0 # same as P zone, the first two rows belong to the falling block
+        alg.GameState().update_opponent_board(opponent_board)
+        self._save_profile()
+        return True
+
+
+class ScreenState(Enum):
+    PLAYING = 'playing'
+    COUNTDOWN = 'countdown'
+    GAME_OVER = 'game_over'
+    UNKNOWN = 'unknown'
+
+
+class ScreenStateClassifier:
+    '''
+    Decide from a few hundred probe pixels (P zone border probes and the 20 * 10 cell centers)
+    whether the frame is worth the full P / N zone parsing.
+        UNKNOWN     P zone border not visible: menus, matchmaking, result screens
+        COUNTDOWN   board visible, nothing on it and no block spawned yet: the round is about to start
+        GAME_OVER   most filled cells are grey, the stack is greyed out after topping out
+        PLAYING     otherwise
+    '''
+    def __init__(self, processor: ScreenshotProcessor):
+        self.processor = processor
+        self._last_calibration = -float('inf')
+
+    def _p_zone_visible(self, img_bgr: np.ndarray) -> bool:
+        geometry = self.processor.geometry
+        if geometry.verify_p_zone(img_bgr):
+            return True
+        # the color mask search costs much more than the probes, do not run it on every menu frame.
+        now = time.monotonic()
+        if now - self._last_calibration < config.settings.CV_SCREEN_CALIBRATE_INTERVAL:
+            return False
+        self._last_calibration = now
+        _, bbox = self.processor.get_P_zone()
+        if bbox is None:
+            return False
+        geometry.set_p_bbox(bbox)
+        return geometry.verify_p_zone(img_bgr)
+
+    def classify(self) -> ScreenState:
+        '''
+        Classify the frame of the last processor.capture().
+        '''
+        img_bgr = self.processor.frame_bgr
+        if img_bgr is None:
+            return ScreenState.UNKNOWN
+        if self.processor.geometry is None:
+            self.processor.load_profile()
+        if not self._p_zone_visible(img_bgr):
+            return ScreenState.UNKNOWN
+
+        geometry = self.processor.geometry
+        samples = cv2.cvtColor(img_bgr[geometry.cell_ys, geometry.cell_xs], cv2.COLOR_BGR2HSV)
+        filled = samples[..., 2] >= config.settings.CV_BLOCKS_GHOST_HSV_V_THRESHOLD
+        filled_count = np.count_nonzero(filled)
+        if filled_count == 0:
+            return ScreenState.COUNTDOWN
+        grey_count = np.count_nonzero(filled & (samples[..., 1] <= config.settings.CV_SCREEN_GREY_SATURATION_MAX))
+        if grey_count >= config.settings.CV_SCREEN_GAME_OVER_GREY_RATIO * filled_count:
+            return ScreenState.GAME_OVER
+        return ScreenState.PLAYING
+
+    @staticmethod
+    def backoff(state: ScreenState) -> float:
+        '''
+        Seconds to wait before the next capture when the state is not PLAYING.
+        '''
+        if state is ScreenState.PLAYING:
+            return 0.0
+        if state is ScreenState.COUNTDOWN:
+            return config.settings.CV_SCREEN_COUNTDOWN_POLL_INTERVAL
+        return config.settings.CV_SCREEN_IDLE_INTERVAL
+
+
+class SpawnDetector:
+    '''
+    Watch only the spawn area (rows 0-1, columns 3-6 of P zone) and the N zone.
+    Both regions are tiny, so they can be grabbed from the source at high frequency after a drop, and the full
+    capture / parsing only runs once a new block really appeared.
+
+    A spawn is reported when the spawn area is occupied and either
+        the spawn area was seen empty since arm() (the dropped block left it), or
+        the N zone differs from the one recorded in arm() (the queue moved on).
+    '''
+    def __init__(self, processor: ScreenshotProcessor):
+        self.processor = processor
+        self._last_seq = 0
+        self._reference_n_zone: Optional[np.ndarray] = None
+        self._armed_block_row: Optional[Tuple[int, int]] = None # (row, timestamp_ns) of the falling block in arm()
+
+    def ready(self) -> bool:
+        '''
+        Geometry is only known after the processor loaded a profile or parsed both zones.
+        '''
+        return (self.processor.window is not None
+                and self.processor.geometry is not None
+                and self.processor.geometry.ready())
+
+    def _grab_regions(self, rects: List[Tuple[int, int, int, int]]) -> Optional[List[np.ndarray]]:
+        '''
+        Copy the regions out of the newest frame not seen yet, None if the source has no new frame.
+        '''
+        latest = self.processor.source.grab(rects=rects, min_seq=self._last_seq + 1)
+        if latest is None:
+            return None
+        self._last_seq, _, images = latest
+        return images
+
+    def _spawn_occupied(self, spawn_img: np.ndarray) -> bool:
+        ys, xs = self.processor.geometry.spawn_centers
+        # HSV V channel is max(B, G, R), same threshold as get_P_zone_new_state, so ghost blocks are ignored.
+        return bool(np.any(spawn_img[ys, xs].max(axis=-1) >= config.settings.CV_BLOCKS_GHOST_HSV_V_THRESHOLD))
+
+    @staticmethod
+    def _thumbnail(img: np.ndarray) -> np.ndarray:
+        return img[::4, ::4].astype(np.int16)
+
+    def _falling_block_row(self, img: np.ndarray, origin: Tuple[int, int] = (0, 0)) -> Optional[int]:
+        '''
+        Top row of the cells lit in img but empty in GameState.game_board, that is the falling block.
+        :param origin: window coordinate of img[0, 0].
+        '''
+        geometry = self.processor.geometry
+        x, y = origin
+        lit = img[geometry.cell_ys - y, geometry.cell_xs - x].max(axis=-1) >= config.settings.CV_BLOCKS_GHOST_HSV_V_THRESHOLD
+        rows = np.nonzero((lit & (alg.GameState().game_board == 0)).any(axis=1))[0]
+        return int(rows[0]) if rows.size else None
+
+    def block_descent(self) -> Optional[Tuple[int, float]]:
+        '''
+        How far the falling block moved between the parsed frame and the frame grabbed in arm().
+
+        Return: (rows, seconds), None if the block was not found in either frame.
+        '''
+        if self._armed_block_row is None or self.processor.frame_bgr is None:
+            return None
+        parsed_row = self._falling_block_row(self.processor.frame_bgr)
+        if parsed_row is None:
+            return None
+        armed_row, armed_ns = self._armed_block_row
+        return armed_row - parsed_row, (armed_ns - self.processor.frame_timestamp_ns) / 1e9
+
+    def arm(self) -> bool:
+        '''
+        Record the N zone and the falling block row before actuation. Call it after a successful parse, before the keys are sent.
+        '''
+        if not self.ready():
+            self._reference_n_zone = None
+            return False
+        self._last_seq = 0 # the latest frame of the source is fine as reference
+        p_bbox = self.processor.geometry.p_bbox
+        latest = self.processor.source.grab(rects=[self.processor.geometry.n_bbox, p_bbox])
+        if latest is None:
+            self._reference_n_zone = None
+            self._armed_block_row = None
+            return False
+        self._last_seq, timestamp_ns, (n_zone_img, p_zone_img) = latest
+        self._reference_n_zone = self._thumbnail(n_zone_img)
+        # the P zone comes along for the gravity estimate, see block_descent()
+        row = self._falling_block_row(p_zone_img, p_bbox[:2])
+        self._armed_block_row = None if row is None else (row, timestamp_ns)
         return True
 
+    def wait_for_spawn(self, timeout: Optional[float] = None) -> bool:
+        '''
+        Poll the spawn area and N zone until a new block appears.
+
+        Return: True if spawn detected, False on timeout or if geometry is unknown (caller falls back to full capture).
+        '''
+        if not self.ready() or self._reference_n_zone is None:
+            return False
+        if timeout is None:
+            timeout = config.settings.CV_SPAWN_TIMEOUT
+
+        spawn_rect = self.processor.geometry.spawn_rect
+        deadline = time.monotonic() + timeout
+        seen_empty = False
+        while time.monotonic() < deadline:
+            regions = self._grab_regions([spawn_rect, self.processor.geometry.n_bbox])
+            if regions is None:
+                time.sleep(config.settings.CV_SPAWN_POLL_INTERVAL)
+                continue
+            spawn_img, n_zone_img = regions
+            if not self._spawn_occupied(spawn_img):
+                seen_empty = True
+            elif seen_empty:
+                return True
+            else:
+                n_zone = self._thumbnail(n_zone_img)
+                if n_zone.shape == self._reference_n_zone.shape:
+                    diff = np.mean(np.abs(n_zone - self._reference_n_zone))
+                    if diff > config.settings.CV_SPAWN_NZONE_DIFF_THRESHOLD:
+                        return True
+            time.sleep(config.settings.CV_SPAWN_POLL_INTERVAL)
+
+        logger.debug('wait_for_spawn timeout')
+        return False
+
+
 def _test_routine1():
     '''
     Test the ScreenshotProcessor class.
     '''
+    import keyboardctrl
     logger.info('test routine1')
     sp = ScreenshotProcessor()
     alg.GameState().reset()
@@ -297,6 +896,43 @@ def _test_routine1():
         sp.get_P_zone_new_state()
         sp.get_N_zone_new_state()
 
+def _bench_replay(paths: List[str], rounds: int = 20):
+    '''
+    Feed recorded frames back to back through the perception pipeline, print throughput and latency.
+    Works without the game window, e.g. python cv.py assets/test1.png assets/test2.png
+    '''
+    sp = ScreenshotProcessor(source=framesource.ReplayFrameSource(paths))
+    latencies = {'capture': [], 'P zone': [], 'N zone': [], 'O zone': []}
+    failures = 0
+    total = rounds * len(sp.source.frames)
+    begin = time.perf_counter()
+    for _ in range(total):
+        t0 = time.perf_counter()
+        sp.capture()
+        t1 = time.perf_counter()
+        p_ok = sp.get_P_zone_new_state()
+        t2 = time.perf_counter()
+        n_ok = sp.get_N_zone_new_state()
+        t3 = time.perf_counter()
+        sp.get_O_zone_new_state()
+        t4 = time.perf_counter()
+        latencies['capture'].append(t1 - t0)
+        latencies['P zone'].append(t2 - t1)
+        latencies['N zone'].append(t3 - t2)
+        latencies['O zone'].append(t4 - t3)
+        if not (p_ok and n_ok):
+            failures += 1
+    elapsed = time.perf_counter() - begin
+
+    print(f'{total} frames in {elapsed:.2f} s, {total / elapsed:.1f} frames/s, {failures} failed')
+    for stage, values in latencies.items():
+        p50, p99 = np.percentile(values, [50, 99]) * 1000
+        print(f'{stage}: p50 {p50:.2f} ms, p99 {p99:.2f} ms')
+
 
 if __name__ == '__main__':
-    _test_routine1()
\ No newline at end of file
+    import sys
+    if len(sys.argv) > 1:
+        _bench_replay(sys.argv[1:])
+    else:
+        _test_routine1()
\ No newline at end of file
@@ -0,0 +1,216 @@
+"""
+File: framering.py
+Author: KuRRe8
+Created: 2026-10-19
+Description:
+    后台截图进程，以及进程间共享的帧环形缓冲区。
+    截图进程独占一个核心，持续把游戏窗口的画面写入 multiprocessing.shared_memory，
+    每一帧带有序号和时间戳。决策线程只读取最新的一帧，不再阻塞在截图上。
+
+    共享内存布局:
+        int64 头部: [latest_seq, (seq, timestamp_ns, height, width) * slots]
+        uint8 数据: [slots, max_height, max_width, 3]，BGR
+    写入时先把槽位序号置为 -1，写完数据再写回序号(seqlock)，读取方据此丢弃被覆盖的帧。
+"""
+
+import config.settings
+from _logger import logger
+
+import multiprocessing
+from multiprocessing import shared_memory
+import time
+import numpy as np
+from typing import Tuple, Optional, List
+import _utils
+
+
+class FrameRing:
+    '''
+    Fixed size ring of frames in shared memory, one writer process and any number of readers.
+    Construct with create() in the owner process, and attach() with spec() in the others.
+    '''
+    HEADER_FIELDS = 4 # seq, timestamp_ns, height, width
+
+    def __init__(self, shm: shared_memory.SharedMemory, slots: int, max_height: int, max_width: int, owner: bool):
+        self.shm = shm
+        self.slots = slots
+        self.max_height = max_height
+        self.max_width = max_width
+        self.owner = owner
+
+        header_len = 1 + slots * self.HEADER_FIELDS
+        self._header = np.ndarray((header_len,), dtype=np.int64, buffer=shm.buf)
+        self._data = np.ndarray((slots, max_height, max_width, 3), dtype=np.uint8,
+                                buffer=shm.buf, offset=header_len * 8)
+
+    @classmethod
+    def _nbytes(cls, slots: int, max_height: int, max_width: int) -> int:
+        return (1 + slots * cls.HEADER_FIELDS) * 8 + slots * max_height * max_width * 3
+
+    @classmethod
+    def create(cls, slots: int, max_height: int, max_width: int) -> 'FrameRing':
+        shm = shared_memory.SharedMemory(create=True, size=cls._nbytes(slots, max_height, max_width))
+        ring = cls(shm, slots, max_height, max_width, owner=True)
+        ring._header.fill(0)
+        return ring
+
+    @classmethod
+    def attach(cls, name: str, slots: int, max_height: int, max_width: int) -> 'FrameRing':
+        shm = shared_memory.SharedMemory(name=name)
+        return cls(shm, slots, max_height, max_width, owner=False)
+
+    def spec(self) -> Tuple[str, int, int, int]:
+        '''
+        Picklable description, pass it to the other process and call FrameRing.attach(*spec).
+        '''
+        return self.shm.name, self.slots, self.max_height, self.max_width
+
+    def _slot_header(self, slot: int) -> np.ndarray:
+        start = 1 + slot * self.HEADER_FIELDS
+        return self._header[start:start + self.HEADER_FIELDS]
+
+    def latest_seq(self) -> int:
+        return int(self._header[0])
+
+    def write(self, frame: np.ndarray, timestamp_ns: int) -> int:
+        '''
+        Only the writer process calls this. Frames larger than the ring are cropped.
+
+        Return: sequence number of the written frame, starting from 1.
+        '''
+        seq = self.latest_seq() + 1
+        slot = seq % self.slots
+        h = min(frame.shape[0], self.max_height)
+        w = min(frame.shape[1], self.max_width)
+
+        header = self._slot_header(slot)
+        header[0] = -1 # mark the slot as being written
+        self._data[slot, :h, :w] = frame[:h, :w, :3]
+        header[1] = timestamp_ns
+        header[2] = h
+        header[3] = w
+        header[0] = seq
+        self._header[0] = seq
+        return seq
+
+    def read_latest(self, min_seq: int = 1,
+                    rects: Optional[List[Tuple[int, int, int, int]]] = None) -> Optional[Tuple[int, int, List[np.ndarray]]]:
+        '''
+        Copy out the latest frame, without waiting for the writer.
+        :param min_seq: frames older than this are treated as not available.
+        :param rects: (x, y, w, h) regions to copy instead of the whole frame, cheaper for small ROIs.
+
+        Return: (seq, timestamp_ns, [frame] or one array per rect), None if no frame or it was overwritten while copying.
+        '''
+        seq = self.latest_seq()
+        if seq < min_seq or seq <= 0:
+            return None
+        header = self._slot_header(seq % self.slots)
+        if header[0] != seq:
+            return None
+        timestamp_ns, h, w = int(header[1]), int(header[2]), int(header[3])
+        frame = self._data[seq % self.slots, :h, :w]
+        if rects is None:
+            images = [frame.copy()]
+        else:
+            images = [frame[y:y + rh, x:x + rw].copy() for x, y, rw, rh in rects]
+        if header[0] != seq: # writer wrapped around during copy
+            return None
+        return seq, timestamp_ns, images
+
+    def close(self):
+        # drop numpy views before closing, otherwise the buffer is still exported
+        del self._header
+        del self._data
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def capture_target(window) -> Tuple[Optional[int], Tuple[int, int, int, int]]:
+    '''
+    Picklable description of the window to capture: (handle, (left, top, width, height)).
+    The handle is None for stand-in windows (framesource.ReplayWindow), the rect is then captured as is.
+    '''
+    return getattr(window, '_hWnd', None), (window.left, window.top, window.width, window.height)
+
+
+def _capture_process_main(spec: Tuple[str, int, int, int], stop_event, interval: float,
+                          target: Tuple[Optional[int], Tuple[int, int, int, int]], grabber=None):
+    '''
+    Entry of the capture process. Keep it top level so it can be pickled by the spawn start method.
+    :param target: capture_target() of the window, each capture process follows its own window.
+    :param grabber: factory of the screen grabber context (mss.mss when None), whose grab(monitor) returns the pixels.
+    '''
+    if grabber is None:
+        import mss
+        grabber = mss.mss
+
+    ring = FrameRing.attach(*spec)
+    hwnd, rect = target
+    window = None
+    try:
+        with grabber() as sct:
+            while not stop_event.is_set():
+                begin = time.perf_counter()
+                try:
+                    if hwnd is None:
+                        left, top, width, height = rect
+                    else:
+                        if window is None:
+                            window = _utils.WindowUtils.find_window_by_handle(hwnd)
+                        # window position is queried each time, the game window may be moved.
+                        left, top, width, height = window.left, window.top, window.width, window.height
+                    shot = sct.grab({"left": left, "top": top, "width": width, "height": height})
+                except Exception:
+                    logger.warning(f'capture process grab failed for window {hwnd}, retrying.')
+                    window = None
+                    time.sleep(0.5)
+                    continue
+                ring.write(np.asarray(shot)[:, :, :3], time.time_ns())
+                remaining = interval - (time.perf_counter() - begin)
+                if remaining > 0:
+                    time.sleep(remaining)
+    finally:
+        ring.close()
+
+
+class CaptureProcess:
+    '''
+    Own the FrameRing and the process that fills it.
+    '''
+    def __init__(self, grabber=None):
+        '''
+        :param grabber: picklable factory of the screen grabber, see _capture_process_main.
+        '''
+        self.grabber = grabber
+        self.ring: Optional[FrameRing] = None
+        self._process: Optional[multiprocessing.Process] = None
+        self._stop_event = None
+
+    def start(self, window) -> FrameRing:
+        '''
+        Capture window (by its handle) into a new ring.
+        The ring is sized by the current window, later growth of the window is cropped.
+        '''
+        self.ring = FrameRing.create(config.settings.CV_FRAME_RING_SLOTS, window.height, window.width)
+        self._stop_event = multiprocessing.Event()
+        self._process = multiprocessing.Process(target=_capture_process_main,
+                                                args=(self.ring.spec(), self._stop_event,
+                                                      config.settings.CV_CAPTURE_INTERVAL, capture_target(window), self.grabber),
+                                                daemon=True)
+        self._process.start()
+        logger.info(f'capture process started, pid {self._process.pid}')
+        return self.ring
+
+    def stop(self):
+        if self._process is not None:
+            self._stop_event.set()
+            self._process.join(timeout=2)
+            if self._process.is_alive():
+                self._process.terminate()
+            self._process = None
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+        logger.info('capture process stopped')
@@ -0,0 +1,232 @@
+"""
+File: framesource.py
+Author: KuRRe8
+Created: 2026-10-19
+Description:
+    截图后端(FrameSource)。ScreenshotProcessor 和 SpawnDetector 只通过这个接口取帧，
+    因此感知流程可以脱离 Windows 窗口运行。
+        MssFrameSource      实时抓取游戏窗口(pygetwindow + mss)
+        RingFrameSource     读取后台截图进程写入的共享内存环形缓冲区
+        ReplayFrameSource   回放录制好的图片/目录/视频，用于 Linux 上的测试和性能统计
+    grab() 的返回值与 FrameRing.read_latest 一致: (seq, timestamp_ns, images)
+"""
+
+import config.settings
+from _logger import logger
+
+import os
+import time
+import mss
+import numpy as np
+import cv2
+from typing import List, Tuple, Optional, Union
+import _utils
+import framering
+
+
+class FrameSource:
+    '''
+    Interface of capture backends. Coordinates of rects are relative to the window.
+    '''
+    def __init__(self):
+        self.window = None # anything with left, top, width and height
+
+    def open(self) -> bool:
+        '''
+        Make sure the window (or recording) is available, cheap if already opened.
+        '''
+        raise NotImplementedError
+
+    def grab(self, rects: Optional[List[Tuple[int, int, int, int]]] = None,
+             min_seq: int = 1) -> Optional[Tuple[int, int, List[np.ndarray]]]:
+        '''
+        Return: (seq, timestamp_ns, [BGR frame] or one BGR array per rect), None if no frame newer than min_seq.
+        '''
+        raise NotImplementedError
+
+    def ended(self) -> bool:
+        '''
+        True when no new frame will ever come, e.g. a recording played to its end. Live capture never ends.
+        '''
+        return False
+
+    def bring_to_front(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class MssFrameSource(FrameSource):
+    '''
+    Live capture of the game window, each grab is a new frame.
+    '''
+    def __init__(self, window=None):
+        '''
+        :param window: pygetwindow.Window to capture, found by title on open() when None.
+        '''
+        super().__init__()
+        self.window = window
+        self._sct = None
+        self._seq = 0
+
+    def open(self) -> bool:
+        if self.window is None:
+            try:
+                self.window = _utils.WindowUtils.find_tetris_window()
+                logger.debug(f"Found window")
+            except Exception:
+                return False
+        return True
+
+    def grab(self, rects=None, min_seq=1):
+        if self._sct is None:
+            self._sct = mss.mss() # keep one instance, creating it per grab costs more than a small grab itself.
+        left, top = self.window.left, self.window.top
+        if rects is None:
+            rects = [(0, 0, self.window.width, self.window.height)]
+        images = []
+        for x, y, w, h in rects:
+            monitor = {"left": left + x, "top": top + y, "width": w, "height": h}
+            images.append(cv2.cvtColor(np.asarray(self._sct.grab(monitor)), cv2.COLOR_BGRA2BGR)) # contiguous BGR
+        self._seq += 1
+        return self._seq, time.time_ns(), images
+
+    def bring_to_front(self):
+        _utils.WindowUtils.bring_to_front(self.window)
+
+    def close(self):
+        if self._sct is not None:
+            self._sct.close()
+            self._sct = None
+
+
+class RingFrameSource(MssFrameSource):
+    '''
+    Frames written by framering.CaptureProcess, the window is only used for focus.
+    '''
+    def __init__(self, ring: Optional[framering.FrameRing], window=None):
+        '''
+        :param ring: None until the capture process is started, no frame meanwhile.
+        '''
+        super().__init__(window)
+        self.ring = ring
+
+    def grab(self, rects=None, min_seq=1):
+        if self.ring is None:
+            return None
+        return self.ring.read_latest(min_seq=min_seq, rects=rects)
+
+    def close(self):
+        pass # the ring belongs to CaptureProcess
+
+
+class ReplayWindow:
+    '''
+    Stand-in of pygetwindow.Window for recorded frames, counts how often it was brought to front.
+    '''
+    def __init__(self, width: int, height: int, title: str = 'replay'):
+        self.left = 0
+        self.top = 0
+        self.width = width
+        self.height = height
+        self.title = title
+        self.activations = 0
+
+    def activate(self):
+        self.activations += 1
+
+
+class ReplayFrameSource(FrameSource):
+    '''
+    Feed recorded frames as if they were captured live.
+    paths may contain image files, directories of images (sorted by name) and videos.
+
+    When fps is None every grab returns the next frame (back to back, for throughput numbers),
+    otherwise the frame is chosen by wall clock since open(), like a live game.
+    '''
+    IMAGE_EXTS = ('.png', '.jpg', '.jpeg', '.bmp')
+    VIDEO_EXTS = ('.mp4', '.avi', '.mkv', '.mov')
+
+    def __init__(self, paths: Union[str, List[str]], fps: Optional[float] = None, loop: bool = True):
+        super().__init__()
+        if isinstance(paths, str):
+            paths = [paths]
+        self.frames: List[np.ndarray] = []
+        for path in paths:
+            self.frames.extend(self._load(path))
+        if not self.frames:
+            raise ValueError(f'No frame found in {paths}')
+        self.fps = fps
+        self.loop = loop
+        self._index = -1
+        self._seq = 0
+        self._start = None
+
+    @classmethod
+    def _load(cls, path: str) -> List[np.ndarray]:
+        if os.path.isdir(path):
+            frames = []
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(cls.IMAGE_EXTS + cls.VIDEO_EXTS):
+                    frames.extend(cls._load(os.path.join(path, name)))
+            return frames
+        if path.lower().endswith(cls.VIDEO_EXTS):
+            frames = []
+            video = cv2.VideoCapture(path)
+            while True:
+                ok, frame = video.read()
+                if not ok:
+                    break
+                frames.append(frame)
+            video.release()
+            return frames
+        frame = cv2.imread(path, cv2.IMREAD_COLOR)
+        if frame is None:
+            logger.warning(f'cannot read frame {path}')
+            return []
+        return [frame]
+
+    def open(self) -> bool:
+        if self._start is None:
+            self._start = time.perf_counter()
+        if self.window is None:
+            height, width = self.frames[0].shape[:2]
+            self.window = ReplayWindow(width, height)
+        return True
+
+    def _next_index(self) -> Optional[int]:
+        if self.fps is None:
+            index = self._index + 1
+        else:
+            index = int((time.perf_counter() - self._start) * self.fps)
+        if index >= len(self.frames):
+            if not self.loop:
+                return None
+            index %= len(self.frames)
+        return index
+
+    def ended(self) -> bool:
+        return not self.loop and self._start is not None and self._next_index() is None
+
+    def grab(self, rects=None, min_seq=1):
+        self.open()
+        index = self._next_index()
+        if index is None:
+            return None
+        if self.fps is None or index != self._index:
+            self._index = index
+            self._seq += 1
+        if self._seq < min_seq:
+            return None # still the same frame
+        frame = self.frames[index]
+        self.window.height, self.window.width = frame.shape[:2]
+        if rects is None:
+            images = [frame.copy()]
+        else:
+            images = [frame[y:y + h, x:x + w].copy() for x, y, w, h in rects]
+        return self._seq, time.time_ns(), images
+
+    def bring_to_front(self):
+        if self.window is not None:
+            self.window.activate()
@@ -62,6 +62,20 @@ class GameConcept():
         new_board = np.vstack([np.zeros((cleared, board.shape[1]), dtype=int), new_board])
         return new_board, cleared
 
+    @classonlymethod
+    def clear_type(cls, cleared: int) -> Optional[str]:
+        match cleared:
+            case 0:
+                return None
+            case 1:
+                return 'single'
+            case 2:
+                return 'double'
+            case 3:
+                return 'triple'
+            case _: # may get more than 4 clear because of garbage block, scored as tetris
+                return 'tetris'
+
     @classonlymethod
     def clear_lines_attack_score(cls, cleared: int) -> float:
         fac = 4
@@ -119,16 +133,9 @@ class GameConcept():
         rows, cols = board.shape
         results = []
 
-        shapes = Tetrominoes.shapes[block_type]
-        for spin_index, shape in enumerate(shapes):
-            block_matrix = np.array(shape)
-
-            used_cells = [(row_idx, col_idx) for row_idx in range(4) for col_idx in range(4) if block_matrix[row_idx][col_idx]]
-            if not used_cells:
-                continue
-
-            min_col_idx = min(__ for _, __ in used_cells)
-            max_col_idx = max(__ for _, __ in used_cells)
+        for spin_index in range(len(Tetrominoes.shapes[block_type])):
+            block_matrix = Tetrominoes.matrix(block_type, spin_index)
+            min_col_idx, max_col_idx = Tetrominoes.col_bounds(block_type, spin_index)
             block_width = max_col_idx - min_col_idx + 1
 
             for col_idx in range(cols - block_width + 1):
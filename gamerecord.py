@@ -0,0 +1,180 @@
+"""
+File: gamerecord.py
+Author: KuRRe8
+Created: 2026-10-19
+Description:
+    对局记录的定长二进制格式：每次决策一条记录，棋盘按行压成 20 个 uint16，加上当前/下一个方块、
+    落点 (spin,row,col)、得分、消除行数和各阶段耗时。
+    GameRecordWriter 在对局中追加记录，read_records() 用 numpy.memmap 把整个文件映射为结构化数组，
+    可以把真实对局的局面重新交给 SearchAlgorithm 做回归检查或调权重。
+        python gamerecord.py <file.btr>    重放文件中的局面，统计和记录的决策一致的比例
+"""
+
+import config.settings
+from _logger import logger
+
+import os
+import time
+from typing import Optional, Tuple
+import numpy as np
+import _utils
+import alg
+
+
+MAGIC = b'BTRC'
+VERSION = 1
+HEADER_SIZE = 16 # magic, version (uint16), record size (uint16), reserved
+PIECES = list(_utils.TetrisBlockType) # code = index + 1, 0 for none
+
+RECORD_DTYPE = np.dtype([
+    ('time', '<f8'),            # time.time() of the decision
+    ('board', '<u2', (20,)),    # board before the decision, bit c of row r is column c
+    ('current', 'u1'),
+    ('next', 'u1'),
+    ('spin', 'u1'),
+    ('row', 'i1'),
+    ('col', 'i1'),
+    ('lines', 'u1'),            # lines cleared by the placement
+    ('score', '<f4'),           # search score of the chosen move
+    ('budget', '<f4'),          # seconds, decision budget given to search
+    ('capture', '<f4'),         # seconds per stage
+    ('perceive', '<f4'),
+    ('search', '<f4'),
+    ('actuate', '<f4'),         # NaN when the keys were not confirmed
+])
+
+
+def piece_code(block: Optional[_utils.TetrisBlockType]) -> int:
+    return 0 if block is None else PIECES.index(block) + 1
+
+
+def piece_from_code(code: int) -> Optional[_utils.TetrisBlockType]:
+    return None if code == 0 else PIECES[code - 1]
+
+
+def pack_rows(board: np.ndarray) -> np.ndarray:
+    '''
+    One uint16 per row, bit c set when column c is filled.
+    '''
+    return ((board != 0).astype(np.uint16) << np.arange(board.shape[1], dtype=np.uint16)).sum(axis=1, dtype=np.uint16)
+
+
+def unpack_rows(rows: np.ndarray, cols: int = 10) -> np.ndarray:
+    '''
+    Inverse of pack_rows, also for a stack of boards (..., 20) -> (..., 20, cols).
+    '''
+    return ((rows[..., None] >> np.arange(cols, dtype=np.uint16)) & 1).astype(np.int8)
+
+
+def _header() -> bytes:
+    return MAGIC + np.array([VERSION, RECORD_DTYPE.itemsize], dtype='<u2').tobytes() + bytes(HEADER_SIZE - 8)
+
+
+class GameRecordWriter:
+    '''
+    Append records to a file, the header is written when the file is new.
+    '''
+    def __init__(self, path: Optional[str] = None, tag: str = ''):
+        '''
+        :param path: default RECORD_DIR/game.<time>[.tag].btr, tag tells apart sessions started together.
+        '''
+        if path is None:
+            os.makedirs(config.settings.RECORD_DIR, exist_ok=True)
+            name = f"game.{time.strftime('%Y-%m-%d_%H-%M-%S')}{'.' + tag if tag else ''}.btr"
+            path = os.path.join(config.settings.RECORD_DIR, name)
+        self.path = path
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(_header())
+        else:
+            _check_header(path)
+        self.count = 0
+
+    def append(self, board: np.ndarray, current, next_block, move: Tuple[int, int, int], score: float = np.nan,
+               lines: int = 0, budget: float = np.nan, capture: float = np.nan, perceive: float = np.nan,
+               search: float = np.nan, actuate: float = np.nan, timestamp: Optional[float] = None):
+        record = np.zeros((), dtype=RECORD_DTYPE)
+        record['time'] = time.time() if timestamp is None else timestamp
+        record['board'] = pack_rows(board)
+        record['current'] = piece_code(current)
+        record['next'] = piece_code(next_block)
+        record['spin'], record['row'], record['col'] = move
+        record['lines'] = lines
+        record['score'] = score
+        record['budget'] = budget
+        record['capture'] = capture
+        record['perceive'] = perceive
+        record['search'] = search
+        record['actuate'] = actuate
+        self._file.write(record.tobytes())
+        self.count += 1
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+            logger.info(f'game record closed: {self.path} ({self.count} records)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _check_header(path: str):
+    with open(path, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE or header[:4] != MAGIC:
+        raise ValueError(f'{path} is not a game record')
+    version, record_size = np.frombuffer(header[4:8], dtype='<u2')
+    if version != VERSION or record_size != RECORD_DTYPE.itemsize:
+        raise ValueError(f'{path} has version {version} with {record_size} byte records, '
+                         f'expected version {VERSION} with {RECORD_DTYPE.itemsize}')
+
+
+def read_records(path: str) -> np.ndarray:
+    '''
+    Map a whole session read-only as a structured array of RECORD_DTYPE, nothing is read until indexed.
+    A record cut off by a crash at the end is ignored.
+    '''
+    _check_header(path)
+    count = (os.path.getsize(path) - HEADER_SIZE) // RECORD_DTYPE.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    return np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=HEADER_SIZE, shape=(count,))
+
+
+def record_state(record) -> alg.BoardState:
+    return alg.BoardState.from_board(unpack_rows(record['board']), piece_from_code(int(record['current'])),
+                                     piece_from_code(int(record['next'])))
+
+
+def replay_decision(record) -> Tuple[int, int, int]:
+    '''
+    Search the position of a record again, without deadline.
+    '''
+    return alg.SearchAlgorithm.search(state=record_state(record))
+
+
+def replay(path: str) -> float:
+    '''
+    Return: share of recorded decisions the current SearchAlgorithm repeats.
+    '''
+    records = read_records(path)
+    same = 0
+    for record in records:
+        if replay_decision(record) == (int(record['spin']), int(record['row']), int(record['col'])):
+            same += 1
+    return same / len(records) if len(records) else 1.0
+
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    for path in sys.argv[1:]:
+        print(f'{path}: {len(read_records(path))} records, {replay(path) * 100:.1f}% same decisions')
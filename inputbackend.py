@@ -0,0 +1,231 @@
+"""
+File: inputbackend.py
+Author: KuRRe8
+Created: 2026-10-19
+Description:
+    按键输出后端(InputBackend)。KeyboardController 和 ActuationWorker 只通过这个接口发送按键。
+        KeyboardBackend     keyboard 模块，逐个发送(原有方式)
+        BatchedBackend      一次调用发送整个按键序列，按键间隔用 sleep + 忙等精确控制，Windows 上直接调用 SendInput
+        RecordingBackend    不发送按键，只记录时间戳，用于 Linux 上的测试和按键延迟/抖动统计
+    send_sequence() 的每一步是 (key, delay, hold): 距上一次按键的间隔、按住的时间(0 为单击)。
+    python inputbackend.py [backend] 统计该后端的按键间隔抖动(真实后端会按下 shift 键)。
+"""
+
+import config.settings
+from _logger import logger
+
+import sys
+import time
+from typing import List, Tuple, Optional
+import numpy as np
+
+
+def sleep_until(deadline: float, spin: bool = True):
+    '''
+    Sleep to time.perf_counter() deadline. With spin the last 2 ms are spent spinning,
+    time.sleep alone may overshoot by a scheduler tick.
+    '''
+    while True:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            return
+        if not spin:
+            time.sleep(remaining)
+            return
+        if remaining > 0.002:
+            time.sleep(remaining - 0.002)
+
+
+class InputBackend:
+    '''
+    Interface of key output backends. Keys are names of the keyboard module ('e', 'up', 'space', ...).
+    '''
+    PRECISE = True # spin the last part of each wait
+
+    def press(self, key: str):
+        raise NotImplementedError
+
+    def release(self, key: str):
+        raise NotImplementedError
+
+    def tap(self, key: str):
+        self.press(key)
+        self.release(key)
+
+    def hold(self, key: str, seconds: float):
+        self.press(key)
+        try:
+            sleep_until(time.perf_counter() + seconds, self.PRECISE)
+        finally:
+            self.release(key)
+
+    def send_sequence(self, steps: List[Tuple[str, float, float]], start: Optional[float] = None) -> List[float]:
+        '''
+        Send keys on a schedule, each step is (key, delay after the previous key was sent or released, hold seconds).
+        :param start: time.perf_counter() the first delay counts from, default now.
+
+        Return: time.perf_counter() at which each key was pressed.
+        '''
+        sent = []
+        previous = time.perf_counter() if start is None else start
+        for key, delay, hold in steps:
+            sleep_until(previous + delay, self.PRECISE)
+            sent.append(time.perf_counter())
+            if hold > 0:
+                self.hold(key, hold)
+            else:
+                self.tap(key)
+            previous = time.perf_counter() if hold > 0 else sent[-1]
+        return sent
+
+    def close(self):
+        pass
+
+
+class KeyboardBackend(InputBackend):
+    '''
+    The keyboard module, one keyboard.send per key, paced by plain time.sleep.
+    '''
+    PRECISE = False
+
+    def __init__(self):
+        import keyboard
+        self._keyboard = keyboard
+
+    def press(self, key):
+        self._keyboard.press(key)
+
+    def release(self, key):
+        self._keyboard.release(key)
+
+    def tap(self, key):
+        self._keyboard.send(key)
+
+
+class BatchedBackend(KeyboardBackend):
+    '''
+    Whole sequences in one call with spin-waited spacing. On Windows keys go through user32.SendInput
+    with scan codes (games reading DirectInput see them too), elsewhere through the keyboard module.
+    Every key of a plan waits at least its key interval (tens of milliseconds), so keys are never due
+    together and each one is its own SendInput call; only the down and up of a tap share one.
+    '''
+    PRECISE = True
+    VK_CODES = {'e': 0x45, 'up': 0x26, 'down': 0x28, 'left': 0x25, 'right': 0x27, 'space': 0x20, 'shift': 0x10}
+    EXTENDED = {'up', 'down', 'left', 'right'}
+
+    def __init__(self):
+        super().__init__()
+        self._user32 = None
+        if sys.platform == 'win32':
+            import ctypes
+            self._ctypes = ctypes
+            self._user32 = ctypes.windll.user32
+            self._define_input_struct()
+
+    def _define_input_struct(self):
+        ctypes = self._ctypes
+        from ctypes import wintypes
+
+        class KEYBDINPUT(ctypes.Structure):
+            _fields_ = [('wVk', wintypes.WORD), ('wScan', wintypes.WORD), ('dwFlags', wintypes.DWORD),
+                        ('time', wintypes.DWORD), ('dwExtraInfo', ctypes.POINTER(ctypes.c_ulong))]
+
+        class MOUSEINPUT(ctypes.Structure): # only for the size of the union
+            _fields_ = [('dx', wintypes.LONG), ('dy', wintypes.LONG), ('mouseData', wintypes.DWORD),
+                        ('dwFlags', wintypes.DWORD), ('time', wintypes.DWORD),
+                        ('dwExtraInfo', ctypes.POINTER(ctypes.c_ulong))]
+
+        class _INPUTUNION(ctypes.Union):
+            _fields_ = [('ki', KEYBDINPUT), ('mi', MOUSEINPUT)]
+
+        class INPUT(ctypes.Structure):
+            _fields_ = [('type', wintypes.DWORD), ('union', _INPUTUNION)]
+
+        self._INPUT = INPUT
+
+    def _inputs(self, key: str, up: bool):
+        KEYEVENTF_EXTENDEDKEY, KEYEVENTF_KEYUP, KEYEVENTF_SCANCODE = 0x1, 0x2, 0x8
+        scan = self._user32.MapVirtualKeyW(self.VK_CODES[key], 0)
+        flags = KEYEVENTF_SCANCODE | (KEYEVENTF_EXTENDEDKEY if key in self.EXTENDED else 0) | (KEYEVENTF_KEYUP if up else 0)
+        event = self._INPUT(type=1) # INPUT_KEYBOARD
+        event.union.ki.wScan = scan
+        event.union.ki.dwFlags = flags
+        return event
+
+    def _send_input(self, events: List[Tuple[str, bool]]):
+        array = (self._INPUT * len(events))(*[self._inputs(key, up) for key, up in events])
+        self._user32.SendInput(len(events), array, self._ctypes.sizeof(self._INPUT))
+
+    def press(self, key):
+        if self._user32 is None or key not in self.VK_CODES:
+            return super().press(key)
+        self._send_input([(key, False)])
+
+    def release(self, key):
+        if self._user32 is None or key not in self.VK_CODES:
+            return super().release(key)
+        self._send_input([(key, True)])
+
+    def tap(self, key):
+        if self._user32 is None or key not in self.VK_CODES:
+            return super().tap(key)
+        self._send_input([(key, False), (key, True)]) # down and up in one SendInput call
+
+
+class RecordingBackend(InputBackend):
+    '''
+    Send nothing, record (event, key, time.perf_counter()) for tests and headless benchmarks.
+    '''
+    def __init__(self):
+        self.events: List[Tuple[str, str, float]] = []
+
+    def press(self, key):
+        self.events.append(('press', key, time.perf_counter()))
+
+    def release(self, key):
+        self.events.append(('release', key, time.perf_counter()))
+
+    def tap(self, key):
+        self.events.append(('tap', key, time.perf_counter()))
+
+    def keys(self) -> List[str]:
+        '''
+        Keys in the order they went down.
+        '''
+        return [key for event, key, _ in self.events if event != 'release']
+
+    def clear(self):
+        self.events.clear()
+
+
+BACKENDS = {'keyboard': KeyboardBackend, 'batched': BatchedBackend, 'recording': RecordingBackend}
+
+
+def create_backend(name: Optional[str] = None) -> InputBackend:
+    '''
+    :param name: one of BACKENDS, default KBD_BACKEND.
+    '''
+    if name is None:
+        name = config.settings.KBD_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f'Unknown input backend {name}, expected one of {list(BACKENDS)}')
+    return BACKENDS[name]()
+
+
+def _bench_backend(name: str, keys: int = 50):
+    '''
+    Send keys at KBD_MININTERVAL and report how far the actual spacing is from the schedule.
+    '''
+    backend = create_backend(name)
+    interval = config.settings.KBD_MININTERVAL
+    key = 'shift' # harmless for the focused window
+    sent = backend.send_sequence([(key, interval, 0.0)] * keys)
+    jitter = np.abs(np.diff(sent) - interval) * 1000
+    p50, p99 = np.percentile(jitter, [50, 99])
+    print(f'{name}: {keys} keys at {interval * 1000:.0f} ms, jitter p50 {p50:.3f} ms, p99 {p99:.3f} ms, max {jitter.max():.3f} ms')
+    backend.close()
+
+
+if __name__ == '__main__':
+    for name in (sys.argv[1:] or ['recording']):
+        _bench_backend(name)
@@ -0,0 +1,169 @@
+"""
+File: inputplan.py
+Author: KuRRe8
+Created: 2026-10-19
+Description:
+    把搜索得到的落点 (block, spin, col) 编译成最短的按键序列。
+    四种朝向的方块用反向旋转(up)代替三次正向旋转(e)，先在出块位置旋转再平移，避免贴墙旋转时的踢墙偏移。
+    平移较远时按住方向键利用游戏的自动移动(DAS/ARR)，比逐格点按更快时才使用。
+    每个计划附带预计的执行时间，搜索在得分相同时用它选择按键更少的落点。
+    每个按键前的间隔按种类(旋转/平移/落下)取标定值，见 key_interval()。
+"""
+
+import config.settings
+
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import _utils
+import metrics
+
+
+def hold_duration(cells: int, to_wall: bool = False) -> float:
+    '''
+    How long a direction key is held to move cells columns: the first move happens on press,
+    the second after KBD_DAS and then one every KBD_ARR.
+    At the wall overshooting does no harm, so hold until the last move is surely done.
+    Otherwise release in the middle of the interval after the last move.
+    '''
+    if cells <= 1:
+        return 0.0
+    if to_wall:
+        return config.settings.KBD_DAS + (cells - 1) * config.settings.KBD_ARR
+    return config.settings.KBD_DAS + (cells - 1.5) * config.settings.KBD_ARR
+
+
+def parse_hold(action: str) -> Optional[Tuple[str, int, bool]]:
+    '''
+    Hold actions are written as 'wall_left:5' (slide to the wall) or 'hold_right:3' (exact columns).
+
+    Return: (direction, cells, to_wall), None for a tap action.
+    '''
+    name, _, cells = action.partition(':')
+    kind, _, direction = name.partition('_')
+    if kind not in ('wall', 'hold') or not cells:
+        return None
+    return direction, int(cells), kind == 'wall'
+
+
+ACTION_KINDS = {'rotate': 'ROTATE', 'rotate_ccw': 'ROTATE', 'left': 'SHIFT', 'right': 'SHIFT',
+                'drop': 'DROP', 'soft_drop': 'DROP'}
+
+
+def key_interval(action: str) -> float:
+    '''
+    Seconds to wait before the key of action: KBD_MININTERVAL_<kind> when calibrated, else KBD_MININTERVAL.
+    Held shifts count as shifts.
+    '''
+    hold = parse_hold(action)
+    kind = ACTION_KINDS[hold[0] if hold is not None else action]
+    interval = getattr(config.settings, f'KBD_MININTERVAL_{kind}', None)
+    return config.settings.KBD_MININTERVAL if interval is None else interval
+
+
+def action_time(action: str) -> float:
+    '''
+    Every key, tapped or held, waits key_interval() before it is pressed.
+    '''
+    hold = parse_hold(action)
+    if hold is None:
+        return key_interval(action)
+    _, cells, to_wall = hold
+    return key_interval(action) + hold_duration(cells, to_wall)
+
+
+class InputPlan:
+    '''
+    Key actions for one placement, executed by KeyboardController.execute_plan().
+    Actions are abstract: 'rotate' (e), 'rotate_ccw' (up), 'left', 'right', 'drop' (space),
+    and held shifts 'wall_left:n', 'hold_right:n' (see parse_hold).
+    to_wall is 'left' or 'right' when the target touches the wall, so extra shifts do no harm.
+    '''
+    def __init__(self, actions: List[str], to_wall: Optional[str] = None):
+        self.actions = actions
+        self.to_wall = to_wall
+
+    @property
+    def expected_time(self) -> float:
+        '''
+        Seconds to send the plan.
+        '''
+        return sum(action_time(action) for action in self.actions)
+
+    def __eq__(self, other):
+        return isinstance(other, InputPlan) and self.actions == other.actions and self.to_wall == other.to_wall
+
+    def __repr__(self):
+        return f'InputPlan({self.actions}, to_wall={self.to_wall})'
+
+
+class InputCompiler:
+    '''
+    Compile placements into InputPlan, plans only depend on block, spin and column so they are cached.
+    '''
+    SPAWN_COL = 3 # the block matrix starts at column 3 (start from 0)
+    _cache: Dict[tuple, InputPlan] = {}
+
+    def __init__(self):
+        raise NotImplementedError("InputCompiler cannot be instantiated.")
+
+    @_utils.classonlymethod
+    def rotation_actions(cls, block: _utils.TetrisBlockType, spin: int) -> List[str]:
+        '''
+        Shapes with four orientations reach spin 3 with one counter rotation. Shapes modelled with two
+        orientations (I, S, Z) only use 'e', the counter rotation of the game puts them one column apart.
+        '''
+        orientations = len(_utils.Tetrominoes.shapes[block])
+        if orientations == 4 and spin == 3:
+            return ['rotate_ccw']
+        return ['rotate'] * spin
+
+    @_utils.classonlymethod
+    def wall_cols(cls, block: _utils.TetrisBlockType, spin: int, cols: int = 10) -> Tuple[int, int]:
+        '''
+        Leftmost and rightmost column offset of the block matrix for this spin.
+        '''
+        used_cols = np.nonzero(np.any(_utils.Tetrominoes.matrix(block, spin) != 0, axis=0))[0]
+        return -int(used_cols[0]), cols - 1 - int(used_cols[-1])
+
+    @_utils.classonlymethod
+    def compile(cls, block: _utils.TetrisBlockType, spin: int, col: int, cols: int = 10) -> InputPlan:
+        # timing settings are part of the key, calibration may change them at runtime
+        key = (block, spin, col, cols, config.settings.KBD_DAS_ENABLED, config.settings.KBD_DAS_EXACT,
+               config.settings.KBD_DAS, config.settings.KBD_ARR, config.settings.KBD_MININTERVAL,
+               config.settings.KBD_MININTERVAL_ROTATE, config.settings.KBD_MININTERVAL_SHIFT,
+               config.settings.KBD_MININTERVAL_DROP)
+        plan = cls._cache.get(key)
+        if plan is not None:
+            metrics.CACHE_REQUESTS.inc(cache='input_plan', result='hit')
+            return plan
+        metrics.CACHE_REQUESTS.inc(cache='input_plan', result='miss')
+
+        left_wall, right_wall = cls.wall_cols(block, spin, cols)
+        to_wall = 'left' if col == left_wall else 'right' if col == right_wall else None
+
+        # rotate first, the block is still in the middle and no wall kick happens
+        actions = cls.rotation_actions(block, spin)
+        destination = col - cls.SPAWN_COL
+        direction = 'left' if destination < 0 else 'right'
+        actions += cls.shift_actions(direction, abs(destination), to_wall == direction)
+        actions.append('drop')
+
+        plan = cls._cache[key] = InputPlan(actions, to_wall)
+        return plan
+
+    @_utils.classonlymethod
+    def shift_actions(cls, direction: str, cells: int, to_wall: bool) -> List[str]:
+        '''
+        Taps, or one held key when the calibrated auto shift is not slower than tapping.
+        '''
+        taps = [direction] * cells
+        if cells < 2 or not config.settings.KBD_DAS_ENABLED or not (to_wall or config.settings.KBD_DAS_EXACT):
+            return taps
+        hold = f"{'wall' if to_wall else 'hold'}_{direction}:{cells}"
+        if action_time(hold) <= sum(action_time(tap) for tap in taps):
+            return [hold]
+        return taps
+
+    @_utils.classonlymethod
+    def expected_time(cls, block: _utils.TetrisBlockType, spin: int, col: int) -> float:
+        return cls.compile(block, spin, col).expected_time
@@ -4,14 +4,22 @@ Author: KuRRe8
 Created: 2025-04-05
 Description:
     控制键盘操作的模块，包括左移、右移、变形，快速下落等功能。
+    ActuationWorker 在独立线程中按计划发送按键，决策线程提交后即可继续截图和搜索。
+    按键都经过 inputbackend 的后端发送(KBD_BACKEND)，测试时可以换成 RecordingBackend。
 """
 
 import config.settings
 from _logger import logger
 import keyboard
 import time
+import queue
+import threading
+from concurrent.futures import Future
 from _utils import classonlymethod
-from typing import Callable
+from typing import Callable, List, Optional, Tuple
+import inputplan
+import inputbackend
+import profiling
 
 
 class KeyboardController:
@@ -19,67 +27,209 @@ class KeyboardController:
     Encapsulated the keyboard control method.
     Rotate before move left right since rotate will change the position near the wall.
     """
+    # keys of the abstract actions in inputplan.InputPlan
+    ACTION_KEYS = {'rotate': 'e', 'rotate_ccw': 'up', 'left': 'left', 'right': 'right', 'drop': 'space', 'soft_drop': 'down'}
+    _backend: Optional[inputbackend.InputBackend] = None
+
     def __init__(self):
         raise NotImplementedError("KeyboardController cannot be instantiated.")
 
+    @classonlymethod
+    def backend(cls) -> inputbackend.InputBackend:
+        '''
+        The backend keys are sent through, created from KBD_BACKEND on first use.
+        '''
+        if cls._backend is None:
+            cls._backend = inputbackend.create_backend()
+            logger.info(f'input backend: {type(cls._backend).__name__}')
+        return cls._backend
 
     @classonlymethod
+    def set_backend(cls, backend: Optional[inputbackend.InputBackend]):
+        '''
+        Replace the backend, None goes back to KBD_BACKEND on next use.
+        '''
+        if cls._backend is not None and cls._backend is not backend:
+            cls._backend.close()
+        cls._backend = backend
+
+    @classonlymethod
+    @profiling.traced('kbd.press_left')
     def press_left(cls):
-        keyboard.send('left')
+        cls.backend().tap('left')
 
     @classonlymethod
+    @profiling.traced('kbd.press_right')
     def press_right(cls):
-        keyboard.send('right')
+        cls.backend().tap('right')
 
     @classonlymethod
+    @profiling.traced('kbd.press_up')
     def press_up(cls):
-        keyboard.send('up')
+        cls.backend().tap('up')
     
     @classonlymethod
+    @profiling.traced('kbd.press_drop')
     def press_drop(cls):
-        time.sleep(config.settings.KBD_MININTERVAL)
-        keyboard.send('space')
+        cls.backend().send_sequence([('space', inputplan.key_interval('drop'), 0.0)])
 
     @classonlymethod
+    @profiling.traced('kbd.press_rotate')
     def press_rotate(cls):
-        keyboard.send('e')
+        cls.backend().tap('e')
 
     @classonlymethod
+    @profiling.traced('kbd.press_soft_drop')
     def press_soft_drop(cls):
-        keyboard.send('down')
+        cls.backend().tap('down')
 
     @classonlymethod
+    @profiling.traced('kbd.multi_left')
     def multi_left(cls, multi: int):
-        for _ in range(multi):
-            time.sleep(config.settings.KBD_MININTERVAL)
-            keyboard.send('left')
+        cls.backend().send_sequence([('left', inputplan.key_interval('left'), 0.0)] * multi)
 
     @classonlymethod
+    @profiling.traced('kbd.multi_right')
     def multi_right(cls, multi: int):
-        for _ in range(multi):
-            time.sleep(config.settings.KBD_MININTERVAL)
-            keyboard.send('right')
+        cls.backend().send_sequence([('right', inputplan.key_interval('right'), 0.0)] * multi)
 
     @classonlymethod
+    @profiling.traced('kbd.multi_rotate')
     def multi_rotate(cls, multi: int):
-        for _ in range(multi):
-            time.sleep(config.settings.KBD_MININTERVAL)
-            keyboard.send('e')
+        cls.backend().send_sequence([('e', inputplan.key_interval('rotate'), 0.0)] * multi)
+
+    @classonlymethod
+    def plan_steps(cls, plan) -> List[Tuple[str, float, float]]:
+        '''
+        Backend steps (key, delay, hold) of an inputplan.InputPlan, each key after the interval of its kind
+        (inputplan.key_interval) like the multi_* methods, held shifts for their hold_duration.
+        '''
+        steps = []
+        for action in plan.actions:
+            hold = inputplan.parse_hold(action)
+            if hold is None:
+                steps.append((cls.ACTION_KEYS[action], inputplan.key_interval(action), 0.0))
+            else:
+                direction, cells, to_wall = hold
+                steps.append((cls.ACTION_KEYS[direction], inputplan.key_interval(action),
+                              inputplan.hold_duration(cells, to_wall)))
+        return steps
+
+    @classonlymethod
+    @profiling.traced('kbd.execute_plan')
+    def execute_plan(cls, plan) -> List[float]:
+        '''
+        Send the keys of an inputplan.InputPlan in one backend call.
+
+        Return: time.perf_counter() at which each key was pressed.
+        '''
+        return cls.backend().send_sequence(cls.plan_steps(plan))
 
     @classonlymethod
-    def assign_hotkey(cls, listener_func: Callable, stop_func:Callable, exit_routine: Callable):
+    @profiling.traced('kbd.hold_shift')
+    def hold_shift(cls, direction: str, cells: Optional[int] = None, to_wall: bool = False):
+        '''
+        Hold left or right and let the game auto shift (DAS, then ARR per column).
+        :param cells: columns to move, None slides to the wall from anywhere on the board.
+        :param to_wall: the target is the wall, holding longer does no harm.
+        '''
+        if cells is None:
+            cells, to_wall = 10, True
+        cls.backend().hold(cls.ACTION_KEYS[direction], inputplan.hold_duration(cells, to_wall))
+
+    @classonlymethod
+    def assign_hotkey(cls, listener_func: Callable, stop_func:Callable, exit_routine: Callable,
+                      profile_func: Optional[Callable] = None, trace_func: Optional[Callable] = None):
         logger.info(f'assigning hot keys {config.settings.KBD_LISTENER_FUNC_HOTKEY}, '
                     f'{config.settings.KBD_STOP_FUNC_HOTKEY}, '
                     f'{config.settings.KBD_EXIT_HOTKEY} ')
         keyboard.add_hotkey(config.settings.KBD_LISTENER_FUNC_HOTKEY, listener_func)
         keyboard.add_hotkey(config.settings.KBD_STOP_FUNC_HOTKEY, stop_func)
         keyboard.add_hotkey(config.settings.KBD_EXIT_HOTKEY, exit_routine)
+        if profile_func is not None:
+            keyboard.add_hotkey(config.settings.KBD_PROFILE_HOTKEY, profile_func)
+        if trace_func is not None:
+            keyboard.add_hotkey(config.settings.KBD_TRACE_HOTKEY, trace_func)
    
     @classonlymethod
     def cancel_hotkey(cls):
         logger.info('cancel all hotkeys')
         keyboard.remove_all_hotkeys()
 
+class ActuationWorker(threading.Thread):
+    '''
+    Send InputPlans from a queue in a background thread, each plan in one backend send_sequence call.
+    The schedule continues from the last key of the previous plan: the first key is due its key interval after it,
+    so time spent elsewhere (queue wait, search) counts toward the interval instead of adding to it.
+
+    submit() returns a Future, its result is the time.perf_counter() when the last key (the drop) was sent.
+    Cancel the Future to skip a plan that has not started yet.
+    '''
+    _STOP = object()
+
+    def __init__(self, backend: Optional[inputbackend.InputBackend] = None):
+        super().__init__(name='actuation', daemon=True)
+        self._backend = backend if backend is not None else KeyboardController.backend()
+        self._queue = queue.Queue()
+        self._last_sent = -float('inf') # time.perf_counter() of the last key, or the release of a held one
+
+    def submit(self, plan) -> Future:
+        future = Future()
+        self._queue.put((plan, future))
+        return future
+
+    def cancel_pending(self) -> int:
+        '''
+        Cancel every plan still waiting in the queue, the one being sent is finished.
+
+        Return: number of cancelled plans.
+        '''
+        cancelled = 0
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return cancelled
+            if item is self._STOP:
+                self._queue.put(item)
+                return cancelled
+            if item[1].cancel():
+                cancelled += 1
+
+    def stop(self, timeout: Optional[float] = None):
+        self.cancel_pending()
+        self._queue.put(self._STOP)
+        if self.is_alive():
+            self.join(timeout)
+
+    def run(self):
+        try:
+            self._run()
+        finally:
+            profiling.ProfileCapture.thread_exit()
+
+    def _run(self):
+        while True:
+            profiling.ProfileCapture.thread_hook()
+            try:
+                item = self._queue.get(timeout=0.1) # wake up now and then to follow the profile toggle
+            except queue.Empty:
+                continue
+            if item is self._STOP:
+                return
+            plan, future = item
+            if not future.set_running_or_notify_cancel():
+                continue # cancelled before it started
+            try:
+                with profiling.span('kbd.send_sequence'):
+                    sent = self._backend.send_sequence(KeyboardController.plan_steps(plan), start=self._last_sent)
+                self._last_sent = time.perf_counter()
+                future.set_result(sent[-1])
+            except Exception as e:
+                logger.error(f'actuation failed: {e}')
+                future.set_exception(e)
+
+
 # test code if directly run this script
 if __name__ == '__main__':
     kc = KeyboardController()
@@ -0,0 +1,189 @@
+"""
+File: metrics.py
+Author: KuRRe8
+Created: 2026-10-19
+Description:
+    Prometheus 文本格式的运行指标，可选地在本机 HTTP 端口上提供 /metrics，多个会话同时运行时可以集中抓取和对比。
+    指标在各模块中直接累加(加锁，开销约 1 微秒)，服务未启动时也照常计数。
+        tetris_decisions_total                       决策数
+        tetris_perception_failures_total{zone,reason} cv.py 中每个解析失败的返回路径
+        tetris_search_nodes_total                    搜索评估的局面数
+        tetris_cache_requests_total{cache,result}    缓存命中/未命中(按键计划、截图转换、棋盘预测)
+        tetris_stage_latency_seconds{stage}          各阶段延迟直方图
+        tetris_lines_cleared_total{type}             下一帧确认落点后计入的消除行数，按 single/double/triple/tetris 分类
+    METRICS_ENABLED 为 True 时 app.py 启动服务，端口被占用时依次尝试后面的端口。
+"""
+
+import config.settings
+from _logger import logger
+
+import bisect
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+
+class Metric:
+    '''
+    Base of labelled metrics. Label values are passed as keyword arguments in labelnames order.
+    '''
+    TYPE = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: Tuple[str, ...], extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(zip(self.labelnames, key))
+        if extra is not None:
+            pairs.append(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def expose(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.TYPE}']
+        return '\n'.join(lines + self._samples())
+
+
+class Counter(Metric):
+    TYPE = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f'{self.name}{self._labels(key)} {value:g}' for key, value in values]
+
+
+class Histogram(Metric):
+    TYPE = 'histogram'
+
+    def __init__(self, name, documentation, buckets: Sequence[float], labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple[str, ...], List[float]] = {} # per bucket counts, then +Inf count and sum
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.setdefault(key, [0] * (len(self.buckets) + 2))
+            counts[index] += 1
+            counts[-1] += value
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            counts = self._values.get(self._key(labels))
+            return 0 if counts is None else int(sum(counts[:-1]))
+
+    def _samples(self):
+        with self._lock:
+            values = sorted((key, list(counts)) for key, counts in self._values.items())
+        lines = []
+        for key, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts[:-1]):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                lines.append(f'{self.name}_bucket{self._labels(key, ("le", le))} {cumulative}')
+            lines.append(f'{self.name}_sum{self._labels(key)} {counts[-1]:g}')
+            lines.append(f'{self.name}_count{self._labels(key)} {cumulative}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def expose(self) -> str:
+        return '\n'.join(metric.expose() for metric in self._metrics) + '\n'
+
+
+REGISTRY = Registry()
+DECISIONS = REGISTRY.register(Counter('tetris_decisions_total', 'Placements decided.'))
+PERCEPTION_FAILURES = REGISTRY.register(Counter(
+    'tetris_perception_failures_total', 'Frames the perception gave up on.', ('zone', 'reason')))
+SEARCH_NODES = REGISTRY.register(Counter('tetris_search_nodes_total', 'Board positions evaluated by search.'))
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    'tetris_cache_requests_total', 'Cache lookups by cache and hit or miss.', ('cache', 'result')))
+STAGE_LATENCY = REGISTRY.register(Histogram(
+    'tetris_stage_latency_seconds', 'Latency of the decision pipeline stages.',
+    (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5), ('stage',)))
+LINES_CLEARED = REGISTRY.register(Counter(
+    'tetris_lines_cleared_total', 'Lines cleared by placements confirmed on the next frame, by clear type.', ('type',)))
+
+
+def _handler_class():
+    '''
+    http.server is only imported when serving, every instrumented module imports metrics.
+    '''
+    from http.server import BaseHTTPRequestHandler
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = REGISTRY.expose().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass # scrapes every few seconds would flood the console
+
+    return _Handler
+
+
+def start_server(port: Optional[int] = None, host: Optional[str] = None) -> Optional['ThreadingHTTPServer']:
+    '''
+    Serve /metrics in a daemon thread on the first free port from port (METRICS_PORT) on.
+
+    Return: the server (server.server_address has the port), None if no port was free.
+    '''
+    from http.server import ThreadingHTTPServer
+
+    handler = _handler_class()
+    if port is None:
+        port = config.settings.METRICS_PORT
+    if host is None:
+        host = config.settings.METRICS_HOST
+    for candidate in range(port, port + config.settings.METRICS_PORT_TRIES):
+        try:
+            server = ThreadingHTTPServer((host, candidate), handler)
+        except OSError:
+            continue
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+        logger.info(f'metrics endpoint: http://{host}:{server.server_address[1]}/metrics')
+        return server
+    logger.warning(f'no free port for the metrics endpoint in {port}-{port + config.settings.METRICS_PORT_TRIES - 1}')
+    return None
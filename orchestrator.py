@@ -0,0 +1,201 @@
+"""
+File: orchestrator.py
+Author: KuRRe8
+Created: 2026-10-19
+Description:
+    在一个进程中同时驱动多个游戏窗口。每个窗口一个 pipeline.Pipeline(各自的截图、解析、按键线程和 GameState)，
+    搜索交给所有窗口共享的 SearchPool，按键表、截图转换缓存等模块级的表和缓存也只有一份。
+    键盘只有一个，按键发给前台窗口，所以各窗口的按键计划通过 FocusScheduler 排队：
+    切换焦点到目标窗口、等待 ORCH_FOCUS_SETTLE，然后发送整个计划。截图不再切换焦点。
+    截图直接读取屏幕上窗口所在的区域，被别的窗口遮住的部分截到的是上层窗口的像素，所以游戏窗口必须平铺、互不重叠，
+    desktop_sources() 发现重叠时拒绝启动。启动后移动窗口造成的重叠不会被发现。
+    测试时用 framesource.ReplayFrameSource(ReplayWindow 记录焦点切换)和 inputbackend.RecordingBackend 代替真实窗口和键盘。
+"""
+
+import config.settings
+from _logger import logger
+
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+import _utils
+import alg
+import cv
+import framering
+import framesource
+import gamerecord
+import inputbackend
+from pipeline import Pipeline
+from telemetry import Telemetry
+
+
+class SearchPool:
+    '''
+    Search workers shared by every window, positions come in as alg.BoardState so no GameState is touched.
+    '''
+    def __init__(self, workers: Optional[int] = None):
+        if workers is None:
+            workers = config.settings.ORCH_SEARCH_WORKERS
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='search')
+
+    def submit(self, state: alg.BoardState, deadline: Optional[float] = None):
+        return self._executor.submit(alg.SearchAlgorithm.search_scored, state, deadline)
+
+    def search(self, state: alg.BoardState, deadline: Optional[float] = None) -> Tuple[Optional[Tuple[int, int, int]], float]:
+        '''
+        Blocking search on a worker, same result as alg.SearchAlgorithm.search_scored.
+        '''
+        return self.submit(state, deadline).result()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+class FocusScheduler:
+    '''
+    Hand the keyboard to one window at a time, brought to front before each plan
+    (the user may have clicked elsewhere), and given ORCH_FOCUS_SETTLE when the previous plan went to another window.
+    '''
+    def __init__(self, settle: Optional[float] = None):
+        self.settle = config.settings.ORCH_FOCUS_SETTLE if settle is None else settle
+        self.switches = 0
+        self._lock = threading.Lock()
+        self._focused = None
+
+    @contextmanager
+    def focus(self, source: framesource.FrameSource):
+        with self._lock:
+            source.bring_to_front()
+            if self._focused is not source:
+                self._focused = source
+                self.switches += 1
+                time.sleep(self.settle)
+            yield
+
+
+class FocusedBackend(inputbackend.InputBackend):
+    '''
+    InputBackend of one window: every call holds the keyboard through the FocusScheduler.
+    '''
+    def __init__(self, backend: inputbackend.InputBackend, scheduler: FocusScheduler, source: framesource.FrameSource):
+        self.backend = backend
+        self.scheduler = scheduler
+        self.source = source
+        self.PRECISE = backend.PRECISE
+
+    def press(self, key):
+        with self.scheduler.focus(self.source):
+            self.backend.press(key)
+
+    def release(self, key):
+        with self.scheduler.focus(self.source):
+            self.backend.release(key)
+
+    def tap(self, key):
+        with self.scheduler.focus(self.source):
+            self.backend.tap(key)
+
+    def hold(self, key, seconds):
+        with self.scheduler.focus(self.source):
+            self.backend.hold(key, seconds)
+
+    def send_sequence(self, steps, start=None):
+        with self.scheduler.focus(self.source):
+            return self.backend.send_sequence(steps, start)
+
+
+def overlapping_windows(windows: list) -> List[Tuple[int, int]]:
+    '''
+    Index pairs of the windows whose rects intersect.
+    '''
+    rects = [(w.left, w.top, w.left + w.width, w.top + w.height) for w in windows]
+    return [(i, j) for (i, a), (j, b) in itertools.combinations(enumerate(rects), 2)
+            if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]]
+
+
+def desktop_sources(limit: Optional[int] = None) -> Tuple[List[framesource.FrameSource], List[framering.CaptureProcess]]:
+    '''
+    One capture source per game window found by title, through a capture process each when CV_CAPTURE_PROCESS.
+    The windows must be tiled: captures read the screen without raising their window (the scheduler raises
+    the one receiving keys), so a covered part would show the window on top.
+
+    Return: (sources, capture processes to stop afterwards)
+    Raise: RuntimeError when windows overlap.
+    '''
+    if limit is None:
+        limit = config.settings.ORCH_MAX_WINDOWS
+    windows = _utils.WindowUtils.find_tetris_windows()[:limit]
+    overlaps = overlapping_windows(windows)
+    if overlaps:
+        raise RuntimeError(f'game windows {overlaps} overlap, tile them so that every window is fully visible')
+    sources, processes = [], []
+    for window in windows:
+        if config.settings.CV_CAPTURE_PROCESS:
+            process = framering.CaptureProcess()
+            sources.append(framesource.RingFrameSource(process.start(window), window))
+            processes.append(process)
+        else:
+            sources.append(framesource.MssFrameSource(window))
+    return sources, processes
+
+
+class Orchestrator:
+    '''
+    Run one Pipeline per capture source until play_event is cleared or close_event is set.
+    Window i plays in game context 'window<i>' (alg.GameState is per context).
+    '''
+    def __init__(self, sources: List[framesource.FrameSource], play_event: threading.Event,
+                 close_event: threading.Event, backend: Optional[inputbackend.InputBackend] = None,
+                 search_workers: Optional[int] = None, telemetry: Optional[Telemetry] = None):
+        '''
+        :param backend: the one keyboard, shared by all windows, default inputbackend.create_backend().
+        :param telemetry: shared by the pipelines, the control panel shows the totals.
+        '''
+        self.backend = backend if backend is not None else inputbackend.create_backend()
+        self.search_pool = SearchPool(search_workers)
+        self.focus = FocusScheduler()
+        self.telemetry = telemetry if telemetry is not None else Telemetry()
+        self.processors = []
+        self.pipelines = []
+        for index, source in enumerate(sources):
+            context = f'window{index}'
+            processor = cv.ScreenshotProcessor(source=source)
+            game_record = gamerecord.GameRecordWriter(tag=context) if config.settings.RECORD_GAMES else None
+            self.processors.append(processor)
+            self.pipelines.append(Pipeline(processor, play_event, close_event,
+                                           backend=FocusedBackend(self.backend, self.focus, source),
+                                           telemetry=self.telemetry, game_record=game_record, context=context,
+                                           search_pool=self.search_pool, bring_to_front=False))
+
+    def run(self) -> bool:
+        '''
+        Block until every pipeline stopped.
+
+        Return: False if a pipeline failed.
+        '''
+        results = [None] * len(self.pipelines)
+
+        def run_pipeline(index):
+            pipeline = self.pipelines[index]
+            _utils.bind_context(pipeline.context)
+            alg.GameState().reset() # left over from the last session of this window
+            results[index] = pipeline.run()
+
+        threads = [threading.Thread(target=run_pipeline, args=(index,), name=pipeline.context, daemon=True)
+                   for index, pipeline in enumerate(self.pipelines)]
+        logger.info(f'orchestrating {len(threads)} windows')
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.search_pool.close()
+        for processor in self.processors:
+            processor.close()
+        for index, ok in enumerate(results):
+            if not ok:
+                logger.warning(f'window{index} pipeline failed')
+        logger.info(f'orchestrator stopped, {self.focus.switches} focus switches')
+        return all(results)
@@ -0,0 +1,359 @@
+"""
+File: pipeline.py
+Author: KuRRe8
+Created: 2026-10-19
+Description:
+    决策循环流水线：截图 → 解析 → 搜索 → 按键，每个阶段一个线程，阶段之间用有界队列连接。
+    截图队列只保留最新的帧(满了丢弃旧帧)，解析阶段丢弃当前方块落下之前截到的过期帧；
+    搜索结果队列满时搜索阶段阻塞(背压)。
+    下一个方块要等当前方块落下才出现，所以解析阶段在按键和出块检测完成后才接收新帧，
+    与按键重叠的是截图、日志和下落速度测量，按键线程发送时决策线程不再等待。
+    play_event 清除或 close_event 置位后各阶段做完手上的一步就退出，与原来的串行循环一致。
+    截图源结束时(不循环的录像播放完)，截图阶段停止，手上的方块处理完后流水线正常退出。
+    各阶段的耗时和决策数记录到 telemetry.Telemetry，定期发送给控制面板。
+    LOG_DECISIONS 打开时每次决策写一条结构化记录(_logger.log_decision)，棋盘文本日志只在 LOG_BOARD_TEXT 打开时生成。
+    RECORD_GAMES 打开时每次决策追加一条二进制对局记录(gamerecord.GameRecordWriter)。
+    多窗口时(orchestrator.py)每个窗口一个 Pipeline，各阶段线程绑定到窗口的 GameState(context)，搜索交给共享的 search_pool。
+"""
+
+import config.settings
+from _logger import logger, log_decision
+
+import logging
+import queue
+import threading
+import time
+from typing import Optional
+import numpy as np
+import _utils
+import alg
+import cv
+import gamerecord
+import inputplan
+import keyboardctrl
+import profiling
+import timing
+from telemetry import Telemetry
+
+
+class LatestQueue:
+    '''
+    Bounded queue whose producer never blocks: putting into a full queue drops the oldest item.
+    '''
+    def __init__(self, maxsize: int = 1):
+        self._queue = queue.Queue(maxsize)
+        self.dropped = 0
+
+    def put(self, item):
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout: Optional[float] = None):
+        '''
+        Raise queue.Empty after timeout.
+        '''
+        return self._queue.get(timeout=timeout)
+
+
+class Pipeline:
+    '''
+    Run the decision loop on processor until play_event is cleared, close_event is set, a stage fails
+    or the frame source ended and the last block was handled.
+        capture     grab frames while perception accepts a new block, pause during the screen state backoff
+        perceive    classify the screen and parse the zones of the newest frame
+        search      search the placement and compile the key plan
+        actuate     send the plan through the ActuationWorker, wait for the next block, measure timing
+    '''
+    def __init__(self, processor: cv.ScreenshotProcessor, play_event: threading.Event, close_event: threading.Event,
+                 backend=None, telemetry: Optional[Telemetry] = None,
+                 game_record: Optional[gamerecord.GameRecordWriter] = None, context=None,
+                 search_pool=None, bring_to_front: bool = True):
+        '''
+        :param context: game context the stage threads bind to (_utils.bind_context), one per window.
+        :param search_pool: object with search(state, deadline) like orchestrator.SearchPool, None searches in the search stage.
+        :param bring_to_front: focus the window before each capture, off when input focus is scheduled elsewhere.
+        '''
+        self.processor = processor
+        self.context = context
+        self.search_pool = search_pool
+        self.bring_to_front = bring_to_front
+        self.telemetry = telemetry if telemetry is not None else Telemetry()
+        if game_record is None and config.settings.RECORD_GAMES:
+            game_record = gamerecord.GameRecordWriter()
+        self.game_record = game_record
+        self.play_event = play_event
+        self.close_event = close_event
+        self.spawn_detector = cv.SpawnDetector(processor)
+        self.screen_classifier = cv.ScreenStateClassifier(processor)
+        self.gravity = timing.GravityEstimator()
+        self.actuation_worker = keyboardctrl.ActuationWorker(backend)
+
+        self.frames = LatestQueue(config.settings.PIPELINE_FRAME_QUEUE_SIZE)
+        self.perceived = queue.Queue(1) # one block in flight between perceive and search
+        self.decisions = queue.Queue(config.settings.PIPELINE_DECISION_QUEUE_SIZE)
+        self.stale_frames = 0
+        self.failed = False
+
+        self._accepting = threading.Event() # perception may take a new block
+        self._accepting.set()
+        self._fresh_after_ns = 0 # frames captured before are stale
+        self._capture_resume = 0.0 # time.monotonic() when capture resumes after a screen backoff
+        self._last_seq = 0
+        self._source_ended = False
+        self._last_screen = None
+        self._round_end_frames = None # consecutive GAME_OVER / UNKNOWN frames since the last PLAYING one, None outside a round
+        self._stop = threading.Event()
+        self._threads = [threading.Thread(target=self._stage, args=(name, step), name=name, daemon=True)
+                         for name, step in (('capture', self._capture_step), ('perceive', self._perceive_step),
+                                            ('search', self._search_step), ('actuate', self._actuate_step))]
+
+    def running(self) -> bool:
+        return not self._stop.is_set() and self.play_event.is_set() and not self.close_event.is_set()
+
+    def run(self) -> bool:
+        '''
+        Block until the pipeline stops.
+
+        Return: False if a stage failed.
+        '''
+        self.actuation_worker.start()
+        for thread in self._threads:
+            thread.start()
+        while self.running():
+            self.telemetry.publish(autoplay=True)
+            self.close_event.wait(config.settings.PIPELINE_STAGE_POLL)
+        self._stop.set()
+        self.actuation_worker.cancel_pending()
+        for thread in self._threads:
+            thread.join(config.settings.CV_SPAWN_TIMEOUT + 2.0) # actuate may be waiting for a spawn
+        self.actuation_worker.stop(timeout=2)
+        if self.game_record is not None:
+            self.game_record.close() # one record file per play session
+        logger.info(f'pipeline stopped, {self.frames.dropped} frames replaced, {self.stale_frames} stale frames dropped')
+        return not self.failed
+
+    def _stage(self, name: str, step):
+        _utils.bind_context(self.context)
+        try:
+            while self.running():
+                try:
+                    profiling.ProfileCapture.thread_hook()
+                    step()
+                except Exception as e:
+                    logger.error(f'{name} stage failed: {e!r}')
+                    self.failed = True
+                    self._stop.set()
+        finally:
+            profiling.ProfileCapture.thread_exit()
+
+    def _put(self, target: queue.Queue, item) -> bool:
+        '''
+        Blocking put that gives up when the pipeline stops, the backpressure between stages.
+        '''
+        while self.running():
+            try:
+                target.put(item, timeout=config.settings.PIPELINE_STAGE_POLL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _capture_step(self):
+        if not self._accepting.wait(config.settings.PIPELINE_STAGE_POLL):
+            return
+        pause = self._capture_resume - time.monotonic()
+        if pause > 0:
+            self.close_event.wait(min(pause, config.settings.PIPELINE_STAGE_POLL))
+            return
+        source = self.processor.source
+        if not source.open():
+            logger.error('capture error')
+            self.close_event.wait(1)
+            return
+        if self.bring_to_front:
+            source.bring_to_front()
+        started = time.perf_counter()
+        latest = source.grab(min_seq=self._last_seq + 1)
+        if latest is None:
+            if source.ended() and not self._source_ended:
+                logger.info('frame source ended, stop after the frames in flight')
+                self._source_ended = True
+            if self._source_ended:
+                self.close_event.wait(config.settings.PIPELINE_STAGE_POLL)
+            else:
+                time.sleep(0.001)
+            return
+        capture_time = time.perf_counter() - started
+        self.telemetry.record('capture', capture_time)
+        self._last_seq = latest[0]
+        self.frames.put((latest, capture_time))
+
+    def _perceive_step(self):
+        try:
+            latest, capture_time = self.frames.get(config.settings.PIPELINE_STAGE_POLL)
+        except queue.Empty:
+            # nothing queued and no block between search and actuation: the last frame was handled
+            if self._source_ended and self._accepting.is_set():
+                self._stop.set()
+            return
+        if not self._accepting.is_set() or latest[1] < self._fresh_after_ns:
+            self.stale_frames += 1
+            return
+        started = time.perf_counter()
+        try:
+            perceived = self._perceive(latest)
+        finally:
+            perceive_time = time.perf_counter() - started
+            self.telemetry.record('perceive', perceive_time)
+        if not perceived:
+            return
+        self._accepting.clear() # until this block is dropped and the next one spawned
+        if not self._put(self.perceived, (latest[1], capture_time, perceive_time)):
+            self._accepting.set()
+
+    def _perceive(self, latest) -> bool:
+        '''
+        Return: True when the zones of a new block were parsed into GameState.
+        '''
+        sp = self.processor
+        sp.load_frame(latest)
+        # 菜单、匹配、倒计时和结算画面不做完整解析，按状态降低截图频率
+        screen = self.screen_classifier.classify()
+        if screen is not self._last_screen:
+            logger.info(f'Screen state: {screen.value}')
+            self._last_screen = screen
+        if screen is cv.ScreenState.PLAYING:
+            self._round_end_frames = 0
+        elif screen is cv.ScreenState.COUNTDOWN:
+            self._round_end_frames = None
+        elif self._round_end_frames is not None:
+            # a single misclassified frame (a flash, a popup) does not end the round
+            self._round_end_frames += 1
+            if self._round_end_frames < config.settings.CV_SCREEN_ROUND_END_FRAMES:
+                self.actuation_worker.cancel_pending()
+                self._capture_resume = time.monotonic() + config.settings.CV_SCREEN_COUNTDOWN_POLL_INTERVAL
+                return False
+            alg.GameState().reset() # round ended, the piece queue and prediction belong to it
+            self.gravity.reset()
+            self.telemetry.reset()
+            self._round_end_frames = None
+        if screen is not cv.ScreenState.PLAYING:
+            self.actuation_worker.cancel_pending()
+            self._capture_resume = time.monotonic() + self.screen_classifier.backoff(screen)
+            return False
+        if not sp.get_P_zone_new_state():
+            return False
+        if not sp.get_N_zone_new_state():
+            return False
+        sp.get_O_zone_new_state() # optional, only in versus matches
+
+        alg.GameState().up_to_date = True
+        return True
+
+    def _search_step(self):
+        try:
+            frame_ns, capture_time, perceive_time = self.perceived.get(timeout=config.settings.PIPELINE_STAGE_POLL)
+        except queue.Empty:
+            return
+        state = alg.GameState()
+        started = time.perf_counter()
+        # 根据下落速度估计本次决策可用的时间，超时后截断第二层搜索
+        budget = self.gravity.decision_budget(state.game_board)
+        deadline = time.perf_counter() + budget
+        if self.search_pool is None:
+            move, score = alg.SearchAlgorithm.search_scored(state.snapshot(), deadline)
+        else:
+            move, score = self.search_pool.search(state.snapshot(), deadline)
+        if move is None:
+            # the stack reached the spawn, nothing to send; the next frames show the game over screen
+            logger.info('No legal move for %s, skip the decision', state.current_block.value)
+            self._accepting.set()
+            return
+        spin, row, col = move
+        decision = None
+        if config.settings.LOG_DECISIONS or self.game_record is not None:
+            decision = {'time': time.time(), 'frame_ns': frame_ns, 'board': state.game_board.copy(),
+                        'current': state.current_block, 'next': state.next_block, 'move': (spin, row, col),
+                        'score': score, 'budget': budget, 'capture': capture_time, 'perceive': perceive_time}
+            if self.context is not None:
+                decision['window'] = self.context
+        state.predict_placement(spin, row, col) # verified by the next get_P_zone_new_state
+        plan = inputplan.InputCompiler.compile(state.current_block, spin, col)
+        self.gravity.observe_plan(plan.expected_time)
+        search_time = time.perf_counter() - started
+        self.telemetry.record('search', search_time)
+        self.telemetry.decision()
+        if decision is not None:
+            decision.update(keys=plan.actions, search=search_time, lines=state.predicted_lines)
+        # arguments are only formatted when INFO is enabled
+        logger.info('Current: %s, Next: %s,Decision spin: %s,Decision col: %s, Keys: %s',
+                    state.current_block.value, state.next_block.value, spin, col, plan.actions)
+        if not self._put(self.decisions, (plan, decision)):
+            self._accepting.set()
+
+    def _actuate_step(self):
+        try:
+            plan, decision = self.decisions.get(timeout=config.settings.PIPELINE_STAGE_POLL)
+        except queue.Empty:
+            return
+        try:
+            self.spawn_detector.arm()
+            # 按键在 actuation 线程中发送，这里继续做日志和出块检测
+            submitted = time.perf_counter()
+            actuation = self.actuation_worker.submit(plan)
+            alg.GameState().advance_queue() # next block becomes the current one, spawn probe only confirms it
+            if config.settings.LOG_BOARD_TEXT and logger.isEnabledFor(logging.INFO):
+                formatted_board = np.array2string(alg.GameState().game_board, separator=', ')
+                logger.info("GAME_BOARD:\n%s", formatted_board)
+            descent = self.spawn_detector.block_descent()
+            if descent is not None:
+                self.gravity.observe_descent(*descent)
+
+            # for each decision, we want next capture be accurate, wait until the next block shows up.
+            spawned = self.spawn_detector.wait_for_spawn(config.settings.CV_SPAWN_TIMEOUT + plan.expected_time)
+            spawn_time = time.perf_counter()
+            try:
+                drop_time = actuation.result(timeout=plan.expected_time + 1.0)
+            except Exception as e:
+                logger.warning(f'Actuation did not complete: {e!r}')
+                if decision is not None:
+                    self._finish_decision(decision, actuate=None, spawn_latency=None, error=repr(e))
+                return
+            self.telemetry.record('actuate', drop_time - submitted)
+            if spawned:
+                self.gravity.observe_spawn_latency(spawn_time - drop_time)
+            else:
+                logger.debug('Spawn not detected, fall back to full capture.')
+            if decision is not None:
+                self._finish_decision(decision, actuate=drop_time - submitted,
+                                      spawn_latency=spawn_time - drop_time if spawned else None)
+        finally:
+            self._fresh_after_ns = time.time_ns()
+            self._accepting.set()
+
+    def _finish_decision(self, decision: dict, **results):
+        '''
+        Write the decision to the game record and the decision log, whichever is enabled.
+        '''
+        decision.update(results)
+        if self.game_record is not None:
+            actuate = decision['actuate']
+            self.game_record.append(decision['board'], decision['current'], decision['next'], decision['move'],
+                                    score=decision['score'], lines=decision['lines'], budget=decision['budget'],
+                                    capture=decision['capture'], perceive=decision['perceive'],
+                                    search=decision['search'], actuate=np.nan if actuate is None else actuate,
+                                    timestamp=decision['time'])
+        if config.settings.LOG_DECISIONS:
+            record = dict(decision, board=_utils.pack_board(decision['board']).hex(), move=list(decision['move']),
+                          current=decision['current'].value,
+                          next=decision['next'].value if decision['next'] is not None else None,
+                          score=float(decision['score']))
+            log_decision(record)
@@ -0,0 +1,214 @@
+"""
+File: profiling.py
+Author: KuRRe8
+Created: 2026-10-19
+Description:
+    轻量的性能打点。traced 装饰器和 span 上下文把每次调用的开始时间和耗时记录到固定长度的内存环形缓冲区，
+    export_chrome_trace() 导出为 Chrome trace-event JSON，可以在 chrome://tracing 或 Perfetto 中查看。
+    高频函数(如 _evaluate)用 sample 参数只记录 N 次中的 1 次。
+    ProfileCapture 用热键开关 cProfile 和 tracemalloc，cProfile 只能分析调用 enable 的线程，
+    所以各流水线阶段在每一步开始前调用 thread_hook()，在自己的线程里开关分析器，结束时合并结果。
+    Python 3.12 起同一时间只能有一个分析器，此时只分析第一个调用 thread_hook() 的线程。
+"""
+
+import config.settings
+from _logger import logger
+
+import cProfile
+import functools
+import itertools
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Set
+import _utils
+
+
+_spans = deque(maxlen=config.settings.PROF_RING_SIZE) # (name, start_ns, duration_ns, thread id)
+
+
+def record_span(name: str, start_ns: int, duration_ns: int):
+    _spans.append((name, start_ns, duration_ns, threading.get_ident()))
+
+
+@contextmanager
+def span(name: str):
+    if not config.settings.PROF_SPANS_ENABLED:
+        yield
+        return
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        record_span(name, start, time.perf_counter_ns() - start)
+
+
+def traced(name: str, sample: int = 1):
+    '''
+    Decorator recording a span per call, or one call in sample.
+    Put it below @classonlymethod.
+    '''
+    def decorator(func):
+        counter = itertools.count()
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # the counter first, sampled functions are the hot ones
+            if (sample > 1 and next(counter) % sample) or not config.settings.PROF_SPANS_ENABLED:
+                return func(*args, **kwargs)
+            start = time.perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record_span(name, start, time.perf_counter_ns() - start)
+        return wrapper
+    return decorator
+
+
+def spans() -> List[tuple]:
+    return list(_spans)
+
+
+def clear_spans():
+    _spans.clear()
+
+
+def _output_path(prefix: str, ext: str) -> str:
+    os.makedirs(config.settings.PROF_OUTPUT_DIR, exist_ok=True)
+    return os.path.join(config.settings.PROF_OUTPUT_DIR, f"{prefix}.{time.strftime('%Y-%m-%d_%H-%M-%S')}.{ext}")
+
+
+def chrome_trace() -> Dict[str, object]:
+    '''
+    Complete events ('ph': 'X'), timestamps and durations in microseconds.
+    '''
+    pid = os.getpid()
+    return {'traceEvents': [{'name': name, 'cat': name.partition('.')[0], 'ph': 'X', 'ts': start / 1000,
+                             'dur': duration / 1000, 'pid': pid, 'tid': tid}
+                            for name, start, duration, tid in spans()],
+            'displayTimeUnit': 'ms'}
+
+
+def export_chrome_trace(path: Optional[str] = None) -> str:
+    '''
+    Write the spans in the ring to path, default logs/trace.<time>.json.
+
+    Return: the path written.
+    '''
+    if path is None:
+        path = _output_path('trace', 'json')
+    trace = chrome_trace()
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(trace, f)
+    logger.info(f"chrome trace exported: {path} ({len(trace['traceEvents'])} spans)")
+    return path
+
+
+class ProfileCapture:
+    '''
+    Toggle cProfile on every thread calling thread_hook(), and tracemalloc.
+    stop() waits for the hooked threads to hand in their profiles, then writes logs/profile.<time>.prof
+    and logs the top allocations.
+    Python 3.12+ allows one active profiler per process, there only the first hooked thread is profiled.
+    '''
+    _active = False
+    _lock = threading.Lock()
+    _running: Dict[int, cProfile.Profile] = {}
+    _finished: List[cProfile.Profile] = []
+    _refused: Set[int] = set() # threads that could not enable a profiler in this capture
+
+    def __init__(self):
+        raise NotImplementedError("ProfileCapture cannot be instantiated.")
+
+    @_utils.classonlymethod
+    def active(cls) -> bool:
+        return cls._active
+
+    @_utils.classonlymethod
+    def thread_hook(cls):
+        '''
+        Called by a thread between units of work, enables or disables its profiler to follow the toggle.
+        '''
+        ident = threading.get_ident()
+        running = cls._running.get(ident)
+        if cls._active and running is None:
+            if ident in cls._refused:
+                return
+            profile = cProfile.Profile()
+            with cls._lock:
+                cls._running[ident] = profile
+            try:
+                profile.enable()
+            except ValueError as e: # Python 3.12+: another thread holds the only profiler
+                with cls._lock:
+                    cls._running.pop(ident, None)
+                    cls._refused.add(ident)
+                logger.info(f'profile capture skips thread {threading.current_thread().name}: {e}')
+        elif not cls._active and running is not None:
+            cls.thread_exit()
+
+    @_utils.classonlymethod
+    def thread_exit(cls):
+        '''
+        Hand in the profile of the calling thread, called by hooked threads before they end.
+        '''
+        with cls._lock:
+            running = cls._running.pop(threading.get_ident(), None)
+            if running is not None:
+                running.disable()
+                cls._finished.append(running)
+
+    @_utils.classonlymethod
+    def start(cls):
+        if cls._active:
+            return
+        tracemalloc.start()
+        cls._active = True
+        logger.info('profile capture started')
+
+    @_utils.classonlymethod
+    def stop(cls, timeout: Optional[float] = None) -> Optional[str]:
+        '''
+        Return: path of the cProfile stats, None if nothing was profiled.
+        '''
+        if not cls._active:
+            return None
+        if timeout is None:
+            timeout = config.settings.PROF_STOP_TIMEOUT
+        cls._active = False
+        deadline = time.monotonic() + timeout
+        while cls._running and time.monotonic() < deadline:
+            time.sleep(0.01)
+        with cls._lock:
+            if cls._running:
+                logger.warning(f'{len(cls._running)} threads did not stop profiling in time')
+                cls._running.clear()
+            profiles, cls._finished = cls._finished, []
+            cls._refused.clear()
+
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        for stat in snapshot.statistics('lineno')[:config.settings.PROF_TRACEMALLOC_TOP]:
+            logger.info(f'tracemalloc: {stat}')
+
+        if not profiles:
+            return None
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        path = _output_path('profile', 'prof')
+        stats.dump_stats(path)
+        logger.info(f'profile capture saved: {path} ({len(profiles)} threads), view with python -m pstats {path}')
+        return path
+
+    @_utils.classonlymethod
+    def toggle(cls) -> Optional[str]:
+        if cls._active:
+            return cls.stop()
+        cls.start()
+        return None
@@ -0,0 +1,177 @@
+"""
+File: startup.py
+Author: KuRRe8
+Created: 2026-10-19
+Description:
+    启动加速。app.py 启动时 prewarm() 在后台线程中完成按下开始热键之前就能做的准备：
+        导入较重的模块(cv2、PIL、mss 等，经由 cv 和 pipeline)
+        构建方块表(_utils.Tetrominoes.build_tables)
+        对每种方块在空棋盘上搜索一次，填充 inputplan 的按键计划缓存
+        找到游戏窗口，创建 PlaySession(截图后端和 ScreenshotProcessor)，抓一帧加载该窗口大小的标定文件
+    thread_play 用 take_session() 取走准备好的会话，之后每局复用同一个会话，游戏窗口变化时才重建。
+    截图进程不在预热时启动：每局开始时 begin() 启动，结束时 end() 停止，不下棋时不占用 CPU。
+"""
+
+import config.settings
+from _logger import logger
+
+import threading
+import time
+from typing import Optional
+import numpy as np
+import _utils
+
+
+def window_key(window):
+    return getattr(window, '_hWnd', id(window))
+
+
+class PlaySession:
+    '''
+    Capture source and ScreenshotProcessor of one game window, kept across play sessions.
+    The capture process (CV_CAPTURE_PROCESS) only runs between begin() and end().
+    '''
+    def __init__(self, window, source=None):
+        '''
+        :param source: FrameSource of the window, live capture (CV_CAPTURE_PROCESS decides how) when None.
+        '''
+        import cv
+        import framering
+        import framesource
+
+        self.window = window
+        self.key = window_key(window)
+        self.capture_process = None
+        if source is not None:
+            pass
+        elif config.settings.CV_CAPTURE_PROCESS:
+            self.capture_process = framering.CaptureProcess()
+            source = framesource.RingFrameSource(None, window) # ring attached by begin()
+        else:
+            source = framesource.MssFrameSource(window)
+        self.processor = cv.ScreenshotProcessor(source=source)
+
+    def matches(self, window) -> bool:
+        return window_key(window) == self.key
+
+    def begin(self):
+        '''
+        Start the capture process for a play session.
+        '''
+        if self.capture_process is not None and self.capture_process.ring is None:
+            self.processor.source.ring = self.capture_process.start(self.window)
+
+    def end(self):
+        '''
+        Stop the capture process after a play session, the window and its profile are kept.
+        '''
+        if self.capture_process is not None and self.capture_process.ring is not None:
+            self.processor.source.ring = None
+            self.capture_process.stop()
+
+    def preload(self, timeout: Optional[float] = None) -> bool:
+        '''
+        Load one frame without taking focus, which picks the calibration profile of the window size.
+        With a capture process the frame is grabbed directly, the process is not started for it.
+
+        Return: False if no frame came within timeout (STARTUP_FRAME_TIMEOUT).
+        '''
+        import framesource
+
+        if timeout is None:
+            timeout = config.settings.STARTUP_FRAME_TIMEOUT
+        source = self.processor.source
+        if self.capture_process is not None:
+            source = framesource.MssFrameSource(self.window)
+        try:
+            if not source.open():
+                return False
+            deadline = time.monotonic() + timeout
+            while True:
+                latest = source.grab()
+                if latest is not None:
+                    self.processor.load_frame(latest)
+                    return True
+                if time.monotonic() > deadline:
+                    return False
+                time.sleep(0.01)
+        finally:
+            if source is not self.processor.source:
+                source.close()
+
+    def close(self):
+        self.end()
+        self.processor.close()
+
+
+def warm_search():
+    '''
+    Depth-1 search of every piece on an empty board: builds the piece tables and fills the key plan cache of inputplan.
+    '''
+    import alg
+
+    empty = np.zeros((20, 10), dtype=np.int8)
+    for block in _utils.TetrisBlockType:
+        alg.SearchAlgorithm.search_scored(alg.BoardState.from_board(empty, block))
+
+
+_lock = threading.Lock()
+_thread: Optional[threading.Thread] = None
+_session: Optional[PlaySession] = None
+
+
+def prewarm(find_window: bool = True) -> threading.Thread:
+    '''
+    Start the background preparation, see the module description.
+    '''
+    global _thread
+    _thread = threading.Thread(target=_prewarm, args=(find_window,), name='prewarm', daemon=True)
+    _thread.start()
+    return _thread
+
+
+def _prewarm(find_window: bool):
+    global _session
+    started = time.perf_counter()
+    try:
+        import cv # cv2, PIL, mss
+        import pipeline
+        _utils.Tetrominoes.build_tables()
+        warm_search()
+        logger.info(f'prewarm: modules and search caches ready in {time.perf_counter() - started:.2f} s')
+        if not find_window:
+            return
+        try:
+            window = _utils.WindowUtils.find_tetris_window()
+        except Exception:
+            logger.info('prewarm: game window not found, it is looked up again when play starts')
+            return
+        session = PlaySession(window)
+        if not session.preload():
+            logger.info('prewarm: no frame from the game window yet')
+        with _lock:
+            _session = session
+        logger.info(f'prewarm: game window ready in {time.perf_counter() - started:.2f} s')
+    except Exception as e:
+        logger.warning(f'prewarm failed: {e!r}')
+
+
+def take_session(window, timeout: Optional[float] = None) -> Optional[PlaySession]:
+    '''
+    Hand over the prewarmed session if it belongs to window, waiting up to timeout (STARTUP_WAIT) for a running prewarm.
+    A session of another window is closed.
+
+    Return: None if there is none.
+    '''
+    global _session
+    if _thread is None:
+        return None
+    _thread.join(config.settings.STARTUP_WAIT if timeout is None else timeout)
+    with _lock:
+        session, _session = _session, None
+    if session is None:
+        return None
+    if session.matches(window):
+        return session
+    session.close()
+    return None
@@ -0,0 +1,128 @@
+"""
+File: telemetry.py
+Author: KuRRe8
+Created: 2026-10-19
+Description:
+    运行指标：每秒决策数，以及截图、解析、搜索、按键各阶段延迟的 p50/p99。
+    决策进程记录并定期把快照放进 multiprocessing.Queue，控制面板进程用 root.after 轮询显示，
+    队列满时丢弃快照，不会阻塞决策循环。
+"""
+
+import config.settings
+
+import queue
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional, Tuple
+import numpy as np
+import metrics
+
+
+STAGES = ('capture', 'perceive', 'search', 'actuate')
+
+
+class LatencyRecorder:
+    '''
+    The last samples latencies of each stage, thread safe.
+    '''
+    def __init__(self, samples: Optional[int] = None):
+        if samples is None:
+            samples = config.settings.CP_TELEMETRY_SAMPLES
+        self._samples = {stage: deque(maxlen=samples) for stage in STAGES}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            self._samples[stage].append(seconds)
+
+    def percentiles(self, stage: str) -> Optional[Tuple[float, float]]:
+        '''
+        Return: (p50, p99) in seconds, None before the first sample.
+        '''
+        with self._lock:
+            samples = list(self._samples[stage])
+        if not samples:
+            return None
+        p50, p99 = np.percentile(samples, [50, 99])
+        return float(p50), float(p99)
+
+    def reset(self):
+        with self._lock:
+            for samples in self._samples.values():
+                samples.clear()
+
+
+class Telemetry:
+    '''
+    Producer side, owned by the play thread. publish() sends a snapshot at most every CP_TELEMETRY_INTERVAL:
+        {'autoplay': bool, 'decision_rate': decisions/s, 'latency': {stage: (p50, p99) seconds or None}}
+    '''
+    def __init__(self, channel=None):
+        '''
+        :param channel: multiprocessing.Queue read by the control panel, None only records.
+        '''
+        self.channel = channel
+        self.latency = LatencyRecorder()
+        self._decisions = deque()
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._last_publish = -float('inf')
+
+    def record(self, stage: str, seconds: float):
+        self.latency.record(stage, seconds)
+        metrics.STAGE_LATENCY.observe(seconds, stage=stage)
+
+    def decision(self):
+        metrics.DECISIONS.inc()
+        with self._lock:
+            self._decisions.append(time.perf_counter())
+
+    def decision_rate(self) -> float:
+        '''
+        Decisions per second over the last CP_TELEMETRY_WINDOW seconds (less right after the start).
+        '''
+        now = time.perf_counter()
+        window = config.settings.CP_TELEMETRY_WINDOW
+        with self._lock:
+            while self._decisions and self._decisions[0] < now - window:
+                self._decisions.popleft()
+            count = len(self._decisions)
+        elapsed = min(window, now - self._start)
+        return count / elapsed if elapsed > 0 else 0.0
+
+    def snapshot(self, autoplay: bool) -> Dict[str, object]:
+        return {'autoplay': autoplay, 'decision_rate': self.decision_rate(),
+                'latency': {stage: self.latency.percentiles(stage) for stage in STAGES}}
+
+    def publish(self, autoplay: bool, force: bool = False) -> bool:
+        '''
+        Return: whether a snapshot was sent.
+        '''
+        now = time.perf_counter()
+        if self.channel is None or (not force and now - self._last_publish < config.settings.CP_TELEMETRY_INTERVAL):
+            return False
+        self._last_publish = now
+        try:
+            self.channel.put_nowait(self.snapshot(autoplay))
+        except queue.Full:
+            return False # the panel is behind, the next snapshot replaces this one anyway
+        return True
+
+    def reset(self):
+        self.latency.reset()
+        with self._lock:
+            self._decisions.clear()
+        self._start = time.perf_counter()
+
+
+def latest_snapshot(channel) -> Optional[Dict[str, object]]:
+    '''
+    Consumer side: drain the channel without blocking, return the newest snapshot or None.
+    '''
+    snapshot = None
+    while True:
+        try:
+            snapshot = channel.get_nowait()
+        except queue.Empty:
+            return snapshot
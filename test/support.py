@@ -0,0 +1,16 @@
+import tempfile
+import unittest
+import config.settings
+
+
+class ProfileDirTestCase(unittest.TestCase):
+    '''
+    Window profiles written by the test go to a temporary CV_PROFILE_DIR (self.profile_dir), removed afterwards.
+    Subclasses that override setUp call super().setUp() first.
+    '''
+
+    def setUp(self):
+        profile_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(profile_dir.cleanup)
+        self.addCleanup(setattr, config.settings, 'CV_PROFILE_DIR', config.settings.CV_PROFILE_DIR)
+        config.settings.CV_PROFILE_DIR = self.profile_dir = profile_dir.name
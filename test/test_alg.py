@@ -0,0 +1,114 @@
+import copy
+import pickle
+import unittest
+import numpy as np
+from _utils import TetrisBlockType as B
+import alg
+from game import GameConcept
+
+class TestPieceQueue(unittest.TestCase):
+
+    def setUp(self):
+        alg.GameState().reset()
+
+    def test_advance_promotes_next(self):
+        state = alg.GameState()
+        state.update_current_block(B.I)
+        state.update_next_block(B.T)
+        state.advance_queue()
+        self.assertEqual(state.current_block, B.T)
+        self.assertIsNone(state.next_block)
+        self.assertTrue(state.queue_tracked)
+        self.assertEqual(list(state.piece_history), [B.I])
+        self.assertEqual(state.piece_counts[B.I], 1)
+
+    def test_bag_remaining(self):
+        state = alg.GameState()
+        # two full bags, the only alignment without repeats starts at the first piece
+        for block in [B.I, B.O, B.T, B.S, B.Z, B.J, B.L, B.L, B.J, B.Z, B.S, B.T, B.O, B.I, B.T]:
+            state.update_current_block(block)
+            state.advance_queue()
+        state.update_current_block(B.S)
+        self.assertEqual(state.bag_remaining(), {B.I, B.O, B.Z, B.J, B.L})
+
+    def test_not_a_bag(self):
+        state = alg.GameState()
+        for _ in range(8):
+            state.update_current_block(B.I)
+            state.advance_queue()
+        self.assertEqual(state.bag_remaining(), set(B))
+
+
+class TestSearchDeadline(unittest.TestCase):
+
+    def test_deadline_keeps_legal_move(self):
+        alg.test_alg_setUp2()
+        full = alg.SearchAlgorithm.search()
+        truncated = alg.SearchAlgorithm.search(deadline=0.0) # only the best depth-1 move gets depth-2
+        legal = GameConcept.possible_moves(alg.GameState().game_board, alg.GameState().current_block)
+        self.assertIn(full, legal)
+        self.assertIn(truncated, legal)
+
+    def test_no_deadline_unchanged(self):
+        alg.test_alg_setUp1()
+        self.assertEqual(alg.SearchAlgorithm.search(), (1, 16, 8))
+        self.assertEqual(alg.SearchAlgorithm.search(deadline=float('inf')), (1, 16, 8))
+
+
+class TestSearchNoMove(unittest.TestCase):
+
+    def setUp(self):
+        # the stack reaches row 2, only an O fits (cols 0-1), and it seals the spawn for every next block
+        self.board = np.ones((20, 10), dtype=np.int8)
+        self.board[:2] = 0
+        self.board[2:4, 0:2] = 0
+        self.board[2:4, 9] = 0
+        for row in range(4, 20):
+            self.board[row, row % 9 + 1] = 0
+
+    def test_placement_blocks_spawn(self):
+        self.assertEqual(len(GameConcept.possible_moves(self.board, B.O)), 1)
+        for next_block in B:
+            state = alg.BoardState.from_board(self.board, B.O, next_block)
+            self.assertEqual(alg.SearchAlgorithm.search_scored(state), (None, -float('inf')))
+            self.assertEqual(alg.SearchAlgorithm.search_scored(state, deadline=0.0), (None, -float('inf')))
+
+    def test_no_legal_move(self):
+        self.assertEqual(GameConcept.possible_moves(self.board, B.T), [])
+        self.assertIsNone(alg.SearchAlgorithm.search(state=alg.BoardState.from_board(self.board, B.T, B.I)))
+        self.assertIsNone(alg.SearchAlgorithm.search(state=alg.BoardState.from_board(self.board, B.T)))
+
+
+
+class TestBoardState(unittest.TestCase):
+
+    def setUp(self):
+        alg.test_alg_setUp1()
+        self.state = alg.GameState().snapshot()
+
+    def tearDown(self):
+        alg.GameState().reset()
+
+    def test_value_semantics(self):
+        same = alg.GameState().snapshot()
+        self.assertEqual(self.state, same)
+        self.assertEqual(len({self.state, same}), 1)
+        self.assertIs(copy.deepcopy(self.state), self.state)
+        self.assertEqual(pickle.loads(pickle.dumps(self.state)), self.state)
+        with self.assertRaises(AttributeError):
+            self.state.current_block = B.O
+        self.assertNotEqual(self.state.replace(next_block=B.O), self.state)
+        self.assertEqual((self.state.board_array() != 0).tolist(), (alg.GameState().game_board != 0).tolist())
+
+    def test_search_explicit_state(self):
+        alg.GameState().reset() # the singleton is not read when a state is given
+        self.assertEqual(alg.SearchAlgorithm.search(state=self.state), (1, 16, 8))
+        self.assertIsNone(alg.GameState().current_block)
+
+    def test_snapshot_bag(self):
+        self.assertIsNone(self.state.bag)
+        self.assertEqual(alg.GameState().snapshot(with_bag=True).bag, frozenset(alg.GameState().bag_remaining()))
+
+
+if __name__ == '__main__':
+    unittest.main()
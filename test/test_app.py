@@ -0,0 +1,100 @@
+import contextlib
+import io
+import os
+import threading
+import time
+import unittest
+from unittest import mock
+import _utils
+import alg
+import app
+import framesource
+import pipeline
+import startup
+from support import ProfileDirTestCase
+
+
+class TestBenchMode(ProfileDirTestCase):
+
+    def tearDown(self):
+        alg.GameState().reset()
+
+    def test_replay_bench(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            code = app.run_bench(['--bench', '--pieces', '2', '--seconds', '20'])
+        self.assertEqual(code, 0)
+        lines = output.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith('2 pieces in'))
+        self.assertIn('decisions/s', lines[0])
+        self.assertTrue(any(line.startswith('search') and 'p99' in line for line in lines))
+        self.assertEqual(os.listdir(self.profile_dir), []) # the bench kept its window profiles to itself
+
+
+class FakeSession:
+
+    def __init__(self, window):
+        self.window = window
+        self.processor = None
+        self.calls = []
+
+    def matches(self, window) -> bool:
+        return window is self.window
+
+    def begin(self):
+        self.calls.append('begin')
+
+    def end(self):
+        self.calls.append('end')
+
+    def close(self):
+        self.calls.append('close')
+
+
+class TestPlaySession(unittest.TestCase):
+
+    def tearDown(self):
+        alg.GameState().reset()
+
+    def test_failed_session_dropped(self):
+        play_event, close_event = threading.Event(), threading.Event()
+        results = [False, True, True]
+        sessions = []
+
+        class FakePipeline:
+            def __init__(self, processor, *args, **kwargs):
+                pass
+
+            def run(self):
+                result = results.pop(0)
+                if not results:
+                    close_event.set()
+                return result
+
+        def new_session(window):
+            sessions.append(FakeSession(window))
+            return sessions[-1]
+
+        window = framesource.ReplayWindow(30, 20)
+        with mock.patch.object(_utils.WindowUtils, 'find_tetris_window', return_value=window), \
+             mock.patch.object(_utils.WindowUtils, 'bring_to_front'), \
+             mock.patch.object(startup, 'take_session', return_value=None), \
+             mock.patch.object(startup, 'PlaySession', new_session), \
+             mock.patch.object(pipeline, 'Pipeline', FakePipeline):
+            player = threading.Thread(target=app.thread_play, args=(play_event, close_event))
+            play_event.set()
+            player.start()
+            deadline = time.monotonic() + 5
+            while len(results) == 3 or play_event.is_set():
+                self.assertLess(time.monotonic(), deadline)
+                time.sleep(0.01)
+            play_event.set() # after the failed session
+            player.join(5)
+        self.assertFalse(player.is_alive())
+        self.assertEqual(len(sessions), 2) # the failed session was closed and not reused
+        self.assertEqual(sessions[0].calls, ['begin', 'close'])
+        self.assertEqual(sessions[1].calls, ['begin', 'end', 'begin', 'end', 'close'])
+
+
+if __name__ == '__main__':
+    unittest.main()
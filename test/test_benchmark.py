@@ -0,0 +1,51 @@
+import unittest
+import numpy as np
+import benchmark
+
+
+class TestCorpus(unittest.TestCase):
+
+    def test_random_states(self):
+        states = benchmark.random_states(20, seed=1)
+        self.assertEqual(states, benchmark.random_states(20, seed=1))
+        self.assertNotEqual(states, benchmark.random_states(20, seed=2))
+        for state in states:
+            board = state.board_array()
+            self.assertFalse(board.all(axis=1).any())
+            self.assertFalse(board[:2].any())
+
+    def test_fixed_states(self):
+        states = benchmark.fixed_states()
+        self.assertEqual(len(states), 4)
+        self.assertTrue(all(state.current_block is not None for state in states))
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_engine_and_perception(self):
+        results = benchmark.bench_engine(benchmark.fixed_states()[:1], min_time=0)
+        results.update(benchmark.bench_perception(min_time=0, screenshots=['test2.png']))
+        self.assertEqual(set(results), set(benchmark.ENGINE_FUNCS) | {'cv.get_P_zone_new_state', 'cv.get_N_zone_new_state'})
+        for result in results.values():
+            self.assertGreater(result['ops_per_sec'], 0)
+            self.assertLessEqual(result['p50_us'], result['p99_us'])
+        self.assertEqual(results['cv.get_P_zone_new_state']['parsed'], 1.0)
+
+    def test_perception_times_parsed_frames(self):
+        # only test2.png has the current block at the spawn, the N zone parses on all four
+        results = benchmark.bench_perception(min_time=0)
+        self.assertEqual(results['cv.get_P_zone_new_state']['parsed'], 0.25)
+        self.assertEqual(results['cv.get_N_zone_new_state']['parsed'], 1.0)
+        with self.assertRaises(RuntimeError):
+            benchmark.bench_perception(min_time=0, screenshots=['test1.png'])
+
+    def test_compare(self):
+        baseline = {'results': {'a': {'ops_per_sec': 100.0}, 'b': {'ops_per_sec': 100.0}}}
+        report = {'results': {'a': {'ops_per_sec': 95.0}, 'b': {'ops_per_sec': 80.0}, 'new': {'ops_per_sec': 1.0}}}
+        regressions = benchmark.compare(report, baseline, threshold=0.1)
+        self.assertEqual([name for name, *_ in regressions], ['b'])
+        self.assertTrue(np.isclose(regressions[0][3], -0.2))
+
+
+if __name__ == '__main__':
+    unittest.main()
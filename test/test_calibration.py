@@ -0,0 +1,162 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+import numpy as np
+import config.settings
+import _utils
+import alg
+import inputbackend
+import inputplan
+import keyboardctrl
+import calibration
+import cv
+import framesource
+from support import ProfileDirTestCase
+
+ASSETS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'assets')
+
+class TestDasCalibration(unittest.TestCase):
+
+    def test_das_and_arr(self):
+        # 5 ms frames, moves at 10 ms (press), 160 ms (DAS) and every 30 ms after
+        move_at = [0.010, 0.160, 0.190, 0.220]
+        samples = [(i * 0.005, 3 + sum(t <= i * 0.005 for t in move_at)) for i in range(60)]
+        das, arr = calibration.das_from_samples(samples)
+        self.assertAlmostEqual(das, 0.150)
+        self.assertAlmostEqual(arr, 0.030)
+
+    def test_too_few_moves(self):
+        with self.assertRaises(ValueError):
+            calibration.das_from_samples([(0.0, 3), (0.01, 4)])
+
+
+class TestIntervalCalibration(unittest.TestCase):
+
+    def test_search_finds_threshold(self):
+        # keys closer than 23 ms get lost
+        trials = []
+        def trial(interval):
+            trials.append(interval)
+            return interval >= 0.023
+        interval = calibration.search_interval(trial, 0.0, 0.06, iterations=6, repeats=2)
+        self.assertGreaterEqual(interval, 0.023)
+        self.assertLess(interval, 0.023 + 0.06 / 2 ** 6)
+        self.assertTrue(all(t < 0.06 for t in trials))
+
+    def test_undecided_trials_are_retried(self):
+        verdicts = iter([None, True, None, True])
+        self.assertTrue(calibration.reliable(lambda interval: next(verdicts), 0.03, 2))
+        self.assertFalse(calibration.reliable(lambda interval: None, 0.03, 2))
+        verdicts = iter([None] * 8 + [True, True])
+        self.assertTrue(calibration.reliable(lambda interval: next(verdicts), 0.03, 2))
+        self.assertFalse(calibration.reliable(lambda interval: False, 0.03, 2))
+
+    def test_shape_matches(self):
+        cells = np.zeros((20, 10), dtype=bool)
+        cells[5, 4:7] = True
+        cells[4, 5] = True # T pointing up
+        spins = [spin for spin in range(4) if calibration.shape_matches(cells, _utils.TetrisBlockType.T, spin)]
+        self.assertEqual(len(spins), 1)
+        self.assertFalse(calibration.shape_matches(cells, _utils.TetrisBlockType.L, spins[0]))
+
+
+class TestTrialFrames(ProfileDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        alg.GameState().reset()
+
+    def tearDown(self):
+        alg.GameState().reset()
+
+    def _processor(self, loop):
+        sp = cv.ScreenshotProcessor(source=framesource.ReplayFrameSource(os.path.join(ASSETS, 'test2.png'), loop=loop))
+        self.assertTrue(sp.capture())
+        self.assertTrue(sp.get_P_zone_new_state())
+        return sp
+
+    def test_cells_after_settle(self):
+        sp = self._processor(loop=True)
+        board = alg.GameState().game_board.copy()
+        cells = calibration._cells_after(sp, board, time.time_ns(), settle=0.01)
+        self.assertTrue(cells[:2].any()) # the block in the spawn rows
+        self.assertFalse(cells[2:].any())
+
+    def test_source_ended(self):
+        sp = self._processor(loop=False) # the only frame was parsed above
+        started = time.monotonic()
+        with self.assertRaises(RuntimeError):
+            calibration._cells_after(sp, alg.GameState().game_board, time.time_ns(), settle=0.01, timeout=0.1)
+        self.assertLess(time.monotonic() - started, 2)
+
+    def test_spawn_after_drop(self):
+        sp = self._processor(loop=True)
+        board = alg.GameState().game_board.copy()
+        with self.assertRaises(RuntimeError): # the same board again, the dropped block never landed
+            calibration._spawned_block(sp, timeout=0.1, since_ns=time.time_ns(), board=board)
+        landed_board, block, _ = calibration._spawned_block(sp, timeout=1.0, since_ns=time.time_ns(),
+                                                            board=np.zeros_like(board))
+        np.testing.assert_array_equal(landed_board, board)
+        self.assertEqual(block, _utils.TetrisBlockType.Z)
+
+    def test_rotate_skips_two_spin_blocks(self):
+        backend = inputbackend.RecordingBackend()
+        keyboardctrl.KeyboardController.set_backend(backend)
+        self.addCleanup(keyboardctrl.KeyboardController.set_backend, None)
+        sp = self._processor(loop=True) # test2.png spawns a Z, two turns would look the same as none
+        self.assertIsNone(calibration.interval_trial(sp, 'ROTATE', 0.02))
+        self.assertNotIn('e', backend.keys()) # only slid to the wall and dropped
+
+
+class TestKeyIntervals(unittest.TestCase):
+
+    def setUp(self):
+        self._saved = config.settings.KBD_MININTERVAL_ROTATE
+
+    def tearDown(self):
+        config.settings.KBD_MININTERVAL_ROTATE = self._saved
+
+    def test_kind_interval_overrides_default(self):
+        config.settings.KBD_MININTERVAL_ROTATE = 0.02
+        self.assertEqual(inputplan.key_interval('rotate_ccw'), 0.02)
+        self.assertEqual(inputplan.key_interval('wall_left:3'),
+                         config.settings.KBD_MININTERVAL_SHIFT or config.settings.KBD_MININTERVAL)
+        plan = inputplan.InputCompiler.compile(_utils.TetrisBlockType.T, 2, 3)
+        self.assertEqual(plan.actions, ['rotate', 'rotate', 'drop'])
+        self.assertAlmostEqual(plan.expected_time, 0.04 + inputplan.key_interval('drop'))
+
+
+class TestMachineProfile(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._saved = (config.settings.KBD_DAS, config.settings.KBD_ARR)
+
+    def tearDown(self):
+        config.settings.KBD_DAS, config.settings.KBD_ARR = self._saved
+        self._dir.cleanup()
+
+    def test_save_and_load(self):
+        path = os.path.join(self._dir.name, 'machine.json')
+        calibration.save_machine_profile({'KBD_DAS': 0.1}, path)
+        calibration.save_machine_profile({'KBD_ARR': 0.02}, path)
+        self.assertEqual(config.settings.KBD_DAS, 0.1)
+        with open(path, encoding='utf-8') as f:
+            self.assertEqual(json.load(f), {'KBD_DAS': 0.1, 'KBD_ARR': 0.02})
+
+        config.settings.KBD_DAS = config.settings.KBD_ARR = None
+        applied = config.settings.load_machine_profile(path)
+        self.assertEqual(applied, {'KBD_DAS': 0.1, 'KBD_ARR': 0.02})
+        self.assertEqual((config.settings.KBD_DAS, config.settings.KBD_ARR), (0.1, 0.02))
+
+    def test_only_known_kbd_settings(self):
+        path = os.path.join(self._dir.name, 'machine.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'KBD_NOT_A_SETTING': 1, 'CV_WINDOW_TITLE': 'x'}, f)
+        self.assertEqual(config.settings.load_machine_profile(path), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
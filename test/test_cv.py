@@ -0,0 +1,295 @@
+import os
+import time
+import unittest
+from unittest import mock
+import numpy as np
+import config.settings
+import _utils
+from _utils import TetrisBlockType
+import alg
+import cv
+import framesource
+from support import ProfileDirTestCase
+
+ASSETS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'assets')
+
+class TestReplayPerception(ProfileDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        alg.GameState().reset()
+
+    def _processor(self, name):
+        sp = cv.ScreenshotProcessor(source=framesource.ReplayFrameSource(os.path.join(ASSETS, name)))
+        self.assertTrue(sp.capture())
+        return sp
+
+    def test_current_and_next_block(self):
+        sp = self._processor('test2.png')
+        self.assertTrue(sp.get_P_zone_new_state())
+        self.assertTrue(sp.get_N_zone_new_state())
+        state = alg.GameState()
+        self.assertEqual(state.current_block, TetrisBlockType.Z)
+        self.assertEqual(state.next_block, TetrisBlockType.T)
+        np.testing.assert_array_equal(state.game_board[19], [0, 0, 0, 1, 1, 1, 1, 0, 1, 1])
+        self.assertEqual(state.game_board[:17].sum(), 0)
+
+    def test_late_capture_fails(self):
+        # the current block already fell below the spawn rows
+        sp = self._processor('test1.png')
+        self.assertFalse(sp.get_P_zone_new_state())
+
+    def test_calibration_profile_reused(self):
+        sp = self._processor('test2.png')
+        self.assertTrue(sp.get_P_zone_new_state())
+        self.assertTrue(sp.get_N_zone_new_state())
+        self.assertEqual(len(os.listdir(self.profile_dir)), 1)
+
+        # a new processor loads the profile and only verifies it, the color mask search is not needed.
+        sp = self._processor('test2.png')
+        sp.get_P_zone = sp.get_N_zone = lambda: self.fail('zones should come from the profile')
+        self.assertEqual(sp.geometry.p_bbox, (889, 106, 432, 861))
+        self.assertTrue(sp.get_P_zone_new_state())
+        self.assertTrue(sp.get_N_zone_new_state())
+        self.assertEqual(alg.GameState().current_block, TetrisBlockType.Z)
+
+    def test_calibration_profile_replaced(self):
+        sp = self._processor('test2.png')
+        self.assertTrue(sp.get_P_zone_new_state())
+        path = os.path.join(self.profile_dir, os.listdir(self.profile_dir)[0])
+        sp.geometry.save(path)
+        self.assertEqual(os.listdir(self.profile_dir), [os.path.basename(path)]) # no temporary file left
+        self.assertEqual(cv.ZoneGeometry.load(path).p_bbox, sp.geometry.p_bbox)
+
+    def test_profile_per_dpi(self):
+        sp = self._processor('test2.png')
+        self.assertTrue(sp.get_P_zone_new_state())
+        self.assertTrue(sp.get_N_zone_new_state())
+        with mock.patch.object(_utils.WindowUtils, 'get_window_dpi', return_value=144):
+            self.assertTrue(sp.capture()) # same size on a monitor with another scale
+            self.assertFalse(sp.geometry.ready())
+            self.assertIn('144dpi', sp._profile_path)
+
+    def test_learned_color_anchored(self):
+        geometry = cv.ZoneGeometry()
+        anchor = np.array(config.settings.CV_BLOCK_Z_COLOR)
+        for _ in range(50): # rendering noise around the configured color is not worth a profile save
+            noise = [3, 0, 0] if _ % 2 else [0, 0, -3]
+            self.assertIs(geometry.match_block_color(anchor + noise), TetrisBlockType.Z)
+        self.assertFalse(geometry.dirty)
+        self.assertEqual(geometry.piece_colors[TetrisBlockType.Z], anchor.tolist())
+
+        rendered = anchor + [10, 5, 0]
+        saves = 0
+        for _ in range(50):
+            self.assertIs(geometry.match_block_color(rendered), TetrisBlockType.Z)
+            saves += geometry.dirty
+            geometry.dirty = False
+        self.assertEqual(saves, 2) # saved on the way to the rendered color, not on every match
+        learned = np.array(geometry.piece_colors[TetrisBlockType.Z])
+        self.assertLess(np.abs(learned - rendered).sum(), config.settings.CV_BLOCK_COLOR_SAVE_DELTA)
+        # matched against the configured color, not the learned one
+        self.assertIsNone(geometry.match_block_color(anchor + [30, 5, 0]))
+
+    def test_opponent_board(self):
+        sp = self._processor('competing_yellow.png')
+        self.assertTrue(sp.get_O_zone_new_state())
+        state = alg.GameState()
+        self.assertEqual(state.opponent_board.shape, (20, 10))
+        self.assertEqual(state.opponent_board[:2].sum(), 0)
+        np.testing.assert_array_equal(state.opponent_board[4], [1, 1, 1, 1, 1, 1, 0, 0, 0, 0])
+        np.testing.assert_array_equal(state.opponent_board[19], [1, 1, 1, 1, 1, 1, 1, 0, 1, 1])
+        self.assertEqual(state.opponent_stack_height(), 17)
+
+    def test_no_opponent_in_single_player(self):
+        sp = self._processor('test2.png')
+        self.assertFalse(sp.get_O_zone_new_state())
+        self.assertIsNone(alg.GameState().opponent_board)
+        self.assertEqual(alg.GameState().opponent_stack_height(), 0)
+
+    def test_opponent_search_backs_off(self):
+        sp = self._processor('test2.png')
+        searches = []
+        sp.get_O_zone = lambda: searches.append(sp._o_zone_retry_interval) or (None, None)
+        for _ in range(8):
+            sp._o_zone_last_search = -float('inf') # the interval elapsed
+            self.assertFalse(sp.get_O_zone_new_state())
+        interval = config.settings.CV_OZONE_RETRY_INTERVAL
+        self.assertEqual(searches[:3], [interval, 2 * interval, 4 * interval])
+        self.assertEqual(sp._o_zone_retry_interval, config.settings.CV_OZONE_RETRY_MAX_INTERVAL)
+        sp._o_zone_last_search = time.monotonic()
+        self.assertFalse(sp.get_O_zone_new_state())
+        self.assertEqual(len(searches), 8) # still waiting
+
+    def _predict_then_parse(self, before, spin, row, col):
+        sp = self._processor('test2.png')
+        state = alg.GameState()
+        state.update_board(before)
+        state.update_current_block(TetrisBlockType.I)
+        state.predict_placement(spin, row, col)
+        self.assertTrue(sp.get_P_zone_new_state())
+        self.assertIsNone(state.predicted_board) # only valid for one frame
+        return state
+
+    def test_prediction_verified(self):
+        sp = self._processor('test2.png')
+        self.assertTrue(sp.get_P_zone_new_state())
+        observed = alg.GameState().game_board.copy()
+
+        # the horizontal I at the bottom was the last drop
+        before = observed.copy()
+        before[19, 3:7] = 0
+        state = self._predict_then_parse(before, 0, 17, 3)
+        self.assertEqual(state.perception_events, {'verified': 1, 'misdrop': 0, 'garbage': 0})
+        np.testing.assert_array_equal(state.game_board, observed)
+
+    def test_prediction_misdrop(self):
+        sp = self._processor('test2.png')
+        self.assertTrue(sp.get_P_zone_new_state())
+        observed = alg.GameState().game_board.copy()
+
+        before = observed.copy()
+        before[19, 3:7] = 0
+        state = self._predict_then_parse(before, 0, 17, 0) # planned at the left wall
+        self.assertEqual(state.perception_events, {'verified': 0, 'misdrop': 1, 'garbage': 0})
+        np.testing.assert_array_equal(state.game_board, observed) # full read
+
+    def test_prediction_garbage(self):
+        sp = self._processor('test2.png')
+        self.assertTrue(sp.get_P_zone_new_state())
+        observed = alg.GameState().game_board.copy()
+
+        # the I clears the bottom line, so the prediction is the observed board one row lower.
+        # Seeing the observed board means one garbage line came in.
+        before = np.vstack([observed[:19], [[0, 0, 0, 0, 1, 1, 1, 1, 1, 1]]]).astype(observed.dtype)
+        state = self._predict_then_parse(before, 0, 17, 0)
+        self.assertEqual(state.perception_events, {'verified': 0, 'misdrop': 0, 'garbage': 1})
+        np.testing.assert_array_equal(state.game_board, observed)
+
+    def test_late_capture_uses_tracked_piece(self):
+        # Z already fell to rows 4-6, the stack below is the board predicted after the last I drop
+        stack = np.zeros((20, 10), dtype=np.int8)
+        stack[14, 5] = 1
+        stack[15, [0, 3, 4, 5]] = 1
+        stack[16, [0, 1, 2, 4, 5, 6, 7, 8]] = 1
+        stack[17:, :9] = 1
+        before = stack.copy()
+        before[16, 5:9] = 0
+
+        sp = self._processor('test1.png')
+        state = alg.GameState()
+        state.update_board(before)
+        state.update_current_block(TetrisBlockType.I)
+        state.update_next_block(TetrisBlockType.Z)
+        state.predict_placement(0, 14, 5)
+        state.advance_queue()
+        self.assertTrue(sp.get_P_zone_new_state())
+        self.assertEqual(state.current_block, TetrisBlockType.Z)
+        self.assertIsNone(state.next_block)
+        self.assertEqual(list(state.piece_history), [TetrisBlockType.I])
+        np.testing.assert_array_equal(state.game_board, stack)
+
+    def test_tracked_piece_corrected_by_probe(self):
+        sp = self._processor('test2.png')
+        state = alg.GameState()
+        state.update_next_block(TetrisBlockType.T)
+        state.advance_queue()
+        self.assertTrue(sp.get_P_zone_new_state())
+        self.assertEqual(state.current_block, TetrisBlockType.Z)
+        self.assertEqual(state.queue_mismatches, 1)
+
+    def _classify(self, name, paint=None):
+        source = framesource.ReplayFrameSource(os.path.join(ASSETS, name))
+        if paint is not None:
+            paint(source.frames[0])
+        sp = cv.ScreenshotProcessor(source=source)
+        self.assertTrue(sp.capture())
+        return cv.ScreenStateClassifier(sp).classify()
+
+    def test_screen_playing(self):
+        self.assertEqual(self._classify('test2.png'), cv.ScreenState.PLAYING)
+        self.assertEqual(self._classify('competing_yellow.png'), cv.ScreenState.PLAYING)
+
+    def test_screen_unknown(self):
+        self.assertEqual(self._classify('mask_by_edge.png'), cv.ScreenState.UNKNOWN)
+
+    def test_screen_countdown(self):
+        def clear_board(frame):
+            x, y, w, h = 889, 106, 432, 861 # P zone of test2.png
+            frame[y + 4:y + h - 4, x + 4:x + w - 4] = config.settings.CV_PZONE_BACKGROUND_COLOR
+        self.assertEqual(self._classify('test2.png', clear_board), cv.ScreenState.COUNTDOWN)
+
+    def test_screen_game_over(self):
+        def grey_out(frame):
+            board = frame[110:963, 893:1317]
+            grey = board.max(axis=-1, keepdims=True)
+            board[:] = np.where(grey >= config.settings.CV_BLOCKS_GHOST_HSV_V_THRESHOLD, grey, board)
+        self.assertEqual(self._classify('test2.png', grey_out), cv.ScreenState.GAME_OVER)
+
+    def test_replay_advances_frames(self):
+        source = framesource.ReplayFrameSource([os.path.join(ASSETS, 'test1.png'), os.path.join(ASSETS, 'test2.png')])
+        seqs = [source.grab()[0] for _ in range(3)]
+        self.assertEqual(seqs, [1, 2, 3])
+        self.assertIsNone(source.grab(min_seq=10))
+
+
+class TestSpawnDetector(ProfileDirTestCase):
+    '''
+    test2.png has the current block in the spawn area, the frames after arm() are painted copies of it.
+    '''
+
+    def setUp(self):
+        super().setUp()
+        alg.GameState().reset()
+        self.source = framesource.ReplayFrameSource(os.path.join(ASSETS, 'test2.png'))
+        self.sp = cv.ScreenshotProcessor(source=self.source)
+        self.assertTrue(self.sp.capture())
+        self.assertTrue(self.sp.get_P_zone_new_state())
+        self.assertTrue(self.sp.get_N_zone_new_state())
+        self.detector = cv.SpawnDetector(self.sp)
+
+    def tearDown(self):
+        alg.GameState().reset()
+
+    def _wait(self, *paints) -> bool:
+        '''
+        arm() on the parsed frame, then wait_for_spawn() over one frame per paint, no frame after the last one.
+        '''
+        original = self.source.frames[0]
+        self.source.frames = [original, original] # the first one was parsed in setUp
+        for paint in paints:
+            frame = original.copy()
+            paint(frame)
+            self.source.frames.append(frame)
+        self.source.loop = False
+        self.assertTrue(self.detector.arm())
+        return self.detector.wait_for_spawn(timeout=0.2)
+
+    def _repaint(self, bbox, color=None):
+        def paint(frame):
+            x, y, w, h = bbox
+            region = frame[y:y + h, x:x + w]
+            region[:] = 255 - region if color is None else color
+        return paint
+
+    def _empty_spawn(self, frame):
+        self._repaint(self.sp.geometry.spawn_rect, config.settings.CV_PZONE_BACKGROUND_COLOR)(frame)
+
+    def test_unchanged_frame(self):
+        self.assertFalse(self._wait(lambda frame: None))
+
+    def test_next_zone_changed(self):
+        self.assertTrue(self._wait(self._repaint(self.sp.geometry.n_bbox)))
+
+    def test_spawn_area_emptied_and_refilled(self):
+        self.assertTrue(self._wait(self._empty_spawn, lambda frame: None))
+
+    def test_spawn_area_still_empty(self):
+        self.assertFalse(self._wait(self._empty_spawn)) # the dropped block left, the new one has not appeared
+
+    def test_not_armed(self):
+        self.assertFalse(self.detector.wait_for_spawn(timeout=0.05))
+
+
+if __name__ == '__main__':
+    unittest.main()
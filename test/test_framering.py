@@ -0,0 +1,88 @@
+import time
+import unittest
+import numpy as np
+import framering
+from framering import FrameRing
+from framesource import ReplayWindow
+
+
+class FakeScreen:
+    '''
+    Grabber of a screen whose pixel at (x, y) is (x % 256, y % 256, 0), so a frame tells where it was grabbed.
+    '''
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def grab(self, monitor):
+        xs = np.arange(monitor['left'], monitor['left'] + monitor['width']) % 256
+        ys = np.arange(monitor['top'], monitor['top'] + monitor['height']) % 256
+        frame = np.zeros((monitor['height'], monitor['width'], 3), dtype=np.uint8)
+        frame[:, :, 0] = xs[None, :]
+        frame[:, :, 1] = ys[:, None]
+        return frame
+
+
+class TestFrameRing(unittest.TestCase):
+
+    def setUp(self):
+        self.ring = FrameRing.create(3, 20, 30)
+
+    def tearDown(self):
+        self.ring.close()
+
+    def test_empty_ring(self):
+        self.assertIsNone(self.ring.read_latest())
+
+    def test_read_latest_frame(self):
+        for value in range(5):
+            self.ring.write(np.full((20, 30, 3), value, dtype=np.uint8), value)
+        seq, timestamp_ns, (frame,) = self.ring.read_latest()
+        self.assertEqual(seq, 5)
+        self.assertEqual(timestamp_ns, 4)
+        self.assertTrue(np.all(frame == 4))
+
+    def test_min_seq(self):
+        self.ring.write(np.zeros((20, 30, 3), dtype=np.uint8), 0)
+        self.assertIsNone(self.ring.read_latest(min_seq=2))
+
+    def test_read_rects(self):
+        frame = np.arange(20 * 30 * 3, dtype=np.uint32).reshape(20, 30, 3).astype(np.uint8)
+        self.ring.write(frame, 0)
+        _, _, (roi,) = self.ring.read_latest(rects=[(5, 2, 4, 3)])
+        np.testing.assert_array_equal(roi, frame[2:5, 5:9])
+
+    def test_larger_frame_is_cropped(self):
+        self.ring.write(np.ones((40, 50, 3), dtype=np.uint8), 0)
+        _, _, (frame,) = self.ring.read_latest()
+        self.assertEqual(frame.shape, (20, 30, 3))
+
+
+class TestCaptureProcess(unittest.TestCase):
+
+    def test_each_process_captures_its_window(self):
+        windows = [ReplayWindow(30, 20), ReplayWindow(40, 10)]
+        windows[0].left, windows[0].top = 0, 0
+        windows[1].left, windows[1].top = 100, 50
+        processes = [framering.CaptureProcess(grabber=FakeScreen) for _ in windows]
+        try:
+            rings = [process.start(window) for process, window in zip(processes, windows)]
+            for ring, window in zip(rings, windows):
+                deadline = time.monotonic() + 10
+                latest = ring.read_latest()
+                while latest is None and time.monotonic() < deadline:
+                    time.sleep(0.01)
+                    latest = ring.read_latest()
+                self.assertIsNotNone(latest)
+                frame = latest[2][0]
+                self.assertEqual(frame.shape, (window.height, window.width, 3))
+                self.assertEqual((frame[0, 0, 0], frame[0, 0, 1]), (window.left, window.top))
+        finally:
+            for process in processes:
+                process.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -46,6 +46,10 @@ class TestGameConcept(unittest.TestCase):
         ])
         self.assertTrue(GameConcept.is_collide(board, block, 18, 3))  # 越界
 
+    def test_clear_type(self):
+        self.assertEqual([GameConcept.clear_type(n) for n in range(6)],
+                         [None, 'single', 'double', 'triple', 'tetris', 'tetris'])
+
     def test_no_lines_to_clear(self):
         board = np.zeros((20, 10), dtype=int)
         board[18][0] = 1
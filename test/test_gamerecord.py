@@ -0,0 +1,59 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import alg
+import gamerecord
+from _utils import TetrisBlockType
+
+
+class TestGameRecord(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._dir.name, 'game.btr')
+
+    def tearDown(self):
+        alg.GameState().reset()
+        self._dir.cleanup()
+
+    def test_pack_rows_round_trip(self):
+        board = np.zeros((20, 10), dtype=np.int8)
+        board[19] = [1, 1, 1, 1, 0, 1, 1, 1, 1, 1]
+        board[0, 9] = 1
+        rows = gamerecord.pack_rows(board)
+        self.assertEqual(rows.dtype, np.uint16)
+        self.assertEqual(rows[19], 0b1111101111)
+        self.assertEqual(rows[0], 1 << 9)
+        np.testing.assert_array_equal(gamerecord.unpack_rows(rows), board)
+
+    def test_write_and_read(self):
+        alg.test_alg_setUp1()
+        state = alg.GameState()
+        with gamerecord.GameRecordWriter(self.path) as writer:
+            writer.append(state.game_board, state.current_block, state.next_block, (1, 16, 8),
+                          score=12.5, lines=4, search=0.003, timestamp=1.0)
+            writer.append(state.game_board, TetrisBlockType.Z, None, (0, 18, 3), actuate=0.02, timestamp=2.0)
+        with open(self.path, 'ab') as f:
+            f.write(b'\x00' * 7) # a record cut off by a crash
+        records = gamerecord.read_records(self.path)
+        self.assertEqual(len(records), 2)
+        self.assertEqual(list(records['time']), [1.0, 2.0])
+        np.testing.assert_array_equal(gamerecord.unpack_rows(records['board'][0]), state.game_board)
+        self.assertEqual(gamerecord.piece_from_code(records['current'][0]), state.current_block)
+        self.assertIsNone(gamerecord.piece_from_code(records['next'][1]))
+        self.assertEqual((records['spin'][0], records['row'][0], records['col'][0]), (1, 16, 8))
+        self.assertEqual(records['lines'][0], 4)
+        self.assertTrue(np.isnan(records['actuate'][0]))
+        self.assertAlmostEqual(float(records['actuate'][1]), 0.02)
+        self.assertEqual(gamerecord.replay_decision(records[0]), (1, 16, 8))
+
+    def test_bad_header(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'not a record file')
+        with self.assertRaises(ValueError):
+            gamerecord.read_records(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
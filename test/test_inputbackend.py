@@ -0,0 +1,41 @@
+import unittest
+import inputbackend
+
+
+class TestRecordingBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = inputbackend.RecordingBackend()
+
+    def test_send_sequence_spacing(self):
+        sent = self.backend.send_sequence([('e', 0.0, 0.0), ('left', 0.02, 0.0), ('space', 0.02, 0.0)])
+        self.assertEqual(self.backend.keys(), ['e', 'left', 'space'])
+        self.assertEqual(len(sent), 3)
+        for a, b in zip(sent, sent[1:]):
+            self.assertGreaterEqual(b - a, 0.02)
+            self.assertLess(b - a, 0.03)
+
+    def test_hold_presses_and_releases(self):
+        sent = self.backend.send_sequence([('right', 0.0, 0.03), ('space', 0.01, 0.0)])
+        events = [(event, key) for event, key, _ in self.backend.events]
+        self.assertEqual(events, [('press', 'right'), ('release', 'right'), ('tap', 'space')])
+        press, release = self.backend.events[0][2], self.backend.events[1][2]
+        self.assertGreaterEqual(release - press, 0.03)
+        # the delay of the next key counts from the release
+        self.assertGreaterEqual(sent[1] - release, 0.01)
+
+    def test_start_in_the_past_sends_now(self):
+        self.backend.send_sequence([('e', 0.05, 0.0)], start=0.0)
+        self.assertEqual(self.backend.keys(), ['e'])
+
+
+class TestCreateBackend(unittest.TestCase):
+
+    def test_known_and_unknown(self):
+        self.assertIsInstance(inputbackend.create_backend('recording'), inputbackend.RecordingBackend)
+        with self.assertRaises(ValueError):
+            inputbackend.create_backend('nope')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+import config.settings
+from _utils import TetrisBlockType as B
+from inputplan import InputCompiler, parse_hold, hold_duration
+
+class TestInputCompiler(unittest.TestCase):
+
+    def test_counter_rotation_for_spin_3(self):
+        plan = InputCompiler.compile(B.J, 3, 3)
+        self.assertEqual(plan.actions, ['rotate_ccw', 'drop'])
+
+    def test_two_orientation_shapes_rotate_forward(self):
+        self.assertEqual(InputCompiler.compile(B.S, 1, 3).actions, ['rotate', 'drop'])
+        self.assertEqual(InputCompiler.compile(B.T, 2, 3).actions, ['rotate', 'rotate', 'drop'])
+
+    def test_rotate_before_shift(self):
+        plan = InputCompiler.compile(B.L, 1, 0)
+        self.assertEqual(plan.actions, ['rotate', 'left', 'left', 'left', 'drop'])
+
+    def test_wall(self):
+        self.assertEqual(InputCompiler.compile(B.I, 0, 0).to_wall, 'left')
+        self.assertEqual(InputCompiler.compile(B.I, 0, 6).to_wall, 'right')
+        self.assertIsNone(InputCompiler.compile(B.I, 0, 3).to_wall)
+
+    def test_expected_time(self):
+        plan = InputCompiler.compile(B.I, 0, 6)
+        self.assertEqual(plan.actions, ['right', 'right', 'right', 'drop'])
+        self.assertAlmostEqual(plan.expected_time, 4 * config.settings.KBD_MININTERVAL)
+
+
+class TestHeldShift(unittest.TestCase):
+
+    def setUp(self):
+        self._saved = (config.settings.KBD_DAS, config.settings.KBD_ARR, config.settings.KBD_DAS_EXACT)
+        # fast auto shift, holding beats tapping from two columns on
+        config.settings.KBD_DAS, config.settings.KBD_ARR = 0.05, 0.01
+
+    def tearDown(self):
+        config.settings.KBD_DAS, config.settings.KBD_ARR, config.settings.KBD_DAS_EXACT = self._saved
+
+    def test_slide_to_wall(self):
+        plan = InputCompiler.compile(B.I, 0, 6)
+        self.assertEqual(plan.actions, ['wall_right:3', 'drop'])
+        self.assertEqual(parse_hold('wall_right:3'), ('right', 3, True))
+        self.assertAlmostEqual(plan.expected_time, 2 * config.settings.KBD_MININTERVAL + 0.05 + 2 * 0.01)
+
+    def test_exact_column_only_when_enabled(self):
+        config.settings.KBD_DAS_EXACT = False
+        self.assertEqual(InputCompiler.compile(B.I, 0, 1).actions, ['left', 'left', 'drop'])
+        config.settings.KBD_DAS_EXACT = True
+        self.assertEqual(InputCompiler.compile(B.I, 0, 1).actions, ['hold_left:2', 'drop'])
+        # released in the middle of the interval after the second move
+        self.assertAlmostEqual(hold_duration(2), 0.05 + 0.5 * 0.01)
+
+    def test_slow_auto_shift_keeps_taps(self):
+        config.settings.KBD_DAS, config.settings.KBD_ARR = 0.3, 0.05
+        self.assertEqual(InputCompiler.compile(B.I, 0, 6).actions, ['right', 'right', 'right', 'drop'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import threading
+import time
+import unittest
+import config.settings
+from inputbackend import RecordingBackend
+from inputplan import InputPlan
+import keyboardctrl
+
+
+class BlockingBackend(RecordingBackend):
+    '''
+    Recording backend whose taps wait for release, to hold the worker inside a plan.
+    '''
+    def __init__(self):
+        super().__init__()
+        self.release_event = threading.Event()
+        self.release_event.set()
+
+    def tap(self, key):
+        self.release_event.wait(2)
+        super().tap(key)
+
+
+class TestActuationWorker(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = BlockingBackend()
+        self.worker = keyboardctrl.ActuationWorker(backend=self.backend)
+        self.worker.start()
+
+    def tearDown(self):
+        self.backend.release_event.set()
+        self.worker.stop(timeout=2)
+
+    def test_plan_sent_in_order_and_paced(self):
+        future = self.worker.submit(InputPlan(['rotate', 'left', 'drop']))
+        self.assertIsInstance(future.result(timeout=2), float)
+        self.assertEqual(self.backend.keys(), ['e', 'left', 'space'])
+        times = [t for _, _, t in self.backend.events]
+        gaps = [b - a for a, b in zip(times, times[1:])]
+        self.assertTrue(all(gap >= config.settings.KBD_MININTERVAL * 0.9 for gap in gaps))
+
+    def test_cancel_pending_plan(self):
+        self.backend.release_event.clear() # hold the worker inside the first plan
+        first = self.worker.submit(InputPlan(['drop']))
+        second = self.worker.submit(InputPlan(['left', 'drop']))
+        time.sleep(0.05 + config.settings.KBD_MININTERVAL)
+        self.assertTrue(second.cancel())
+        self.backend.release_event.set()
+        first.result(timeout=2)
+        third = self.worker.submit(InputPlan(['right', 'drop']))
+        third.result(timeout=2)
+        self.assertTrue(second.cancelled())
+        self.assertEqual(self.backend.keys(), ['space', 'right', 'space'])
+
+    def test_cancel_all_pending(self):
+        self.backend.release_event.clear()
+        self.worker.submit(InputPlan(['drop']))
+        time.sleep(0.05)
+        pending = [self.worker.submit(InputPlan(['drop'])) for _ in range(3)]
+        self.assertEqual(self.worker.cancel_pending(), 3)
+        self.assertTrue(all(future.cancelled() for future in pending))
+
+
+class TestKeyboardController(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = RecordingBackend()
+        keyboardctrl.KeyboardController.set_backend(self.backend)
+
+    def tearDown(self):
+        keyboardctrl.KeyboardController.set_backend(None)
+
+    def test_plan_steps(self):
+        steps = keyboardctrl.KeyboardController.plan_steps(InputPlan(['rotate_ccw', 'wall_left:3', 'drop'], to_wall='left'))
+        self.assertEqual([key for key, _, _ in steps], ['up', 'left', 'space'])
+        self.assertTrue(all(delay == config.settings.KBD_MININTERVAL for _, delay, _ in steps))
+        self.assertEqual(steps[0][2], 0.0)
+        self.assertGreater(steps[1][2], 0.0)
+
+    def test_press_methods_use_backend(self):
+        keyboardctrl.KeyboardController.press_rotate()
+        keyboardctrl.KeyboardController.multi_left(2)
+        self.assertEqual(self.backend.keys(), ['e', 'left', 'left'])
+
+
+if __name__ == '__main__':
+    unittest.main()
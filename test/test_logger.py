@@ -0,0 +1,51 @@
+import json
+import os
+import tempfile
+import unittest
+import numpy as np
+import config.settings
+import _logger
+import _utils
+
+
+class TestPackBoard(unittest.TestCase):
+
+    def test_round_trip(self):
+        board = np.zeros((20, 10), dtype=np.int8)
+        board[19] = [1, 1, 1, 0, 1, 1, 1, 1, 1, 1]
+        board[18, 4] = 2
+        data = _utils.pack_board(board)
+        self.assertEqual(len(data), 25)
+        np.testing.assert_array_equal(_utils.unpack_board(data), board != 0)
+
+
+class TestDecisionLog(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._saved = (config.settings.LOG_DECISIONS, config.settings.LOG_DECISION_DIR)
+        config.settings.LOG_DECISION_DIR = self._dir.name
+
+    def tearDown(self):
+        _logger.close_decision_log()
+        config.settings.LOG_DECISIONS, config.settings.LOG_DECISION_DIR = self._saved
+        self._dir.cleanup()
+
+    def test_disabled_writes_nothing(self):
+        config.settings.LOG_DECISIONS = False
+        _logger.log_decision({'move': [0, 18, 3]})
+        self.assertEqual(os.listdir(self._dir.name), [])
+
+    def test_json_lines(self):
+        config.settings.LOG_DECISIONS = True
+        _logger.log_decision({'move': [0, 18, 3], 'current': 'T'})
+        _logger.log_decision({'move': [1, 17, 0], 'current': 'I'})
+        _logger.close_decision_log()
+        (name,) = os.listdir(self._dir.name)
+        with open(os.path.join(self._dir.name, name), encoding='utf-8') as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(records, [{'move': [0, 18, 3], 'current': 'T'}, {'move': [1, 17, 0], 'current': 'I'}])
+
+
+if __name__ == '__main__':
+    unittest.main()
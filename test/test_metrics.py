@@ -0,0 +1,66 @@
+import unittest
+import urllib.request
+import alg
+import metrics
+from _utils import TetrisBlockType
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_counter_exposition(self):
+        counter = metrics.Counter('test_total', 'Test counter.', ('zone', 'reason'))
+        counter.inc(zone='P', reason='no_bbox')
+        counter.inc(2, zone='P', reason='no_bbox')
+        self.assertEqual(counter.value(zone='P', reason='no_bbox'), 3)
+        self.assertEqual(counter.expose().splitlines(),
+                         ['# HELP test_total Test counter.', '# TYPE test_total counter',
+                          'test_total{zone="P",reason="no_bbox"} 3'])
+        with self.assertRaises(ValueError):
+            counter.inc(zone='P')
+
+    def test_histogram_exposition(self):
+        histogram = metrics.Histogram('test_seconds', 'Test histogram.', (0.01, 0.1), ('stage',))
+        for value in (0.005, 0.05, 0.5):
+            histogram.observe(value, stage='search')
+        lines = histogram.expose().splitlines()[2:]
+        self.assertEqual(lines, ['test_seconds_bucket{stage="search",le="0.01"} 1',
+                                 'test_seconds_bucket{stage="search",le="0.1"} 2',
+                                 'test_seconds_bucket{stage="search",le="+Inf"} 3',
+                                 'test_seconds_sum{stage="search"} 0.555',
+                                 'test_seconds_count{stage="search"} 3'])
+        self.assertEqual(histogram.count(stage='search'), 3)
+
+    def test_search_counts_nodes_and_lines(self):
+        alg.test_alg_setUp1()
+        nodes = metrics.SEARCH_NODES.value()
+        spin, row, col = alg.SearchAlgorithm.search()
+        self.assertGreater(metrics.SEARCH_NODES.value(), nodes)
+        tetrises = metrics.LINES_CLEARED.value(type='tetris')
+        state = alg.GameState()
+        state.predict_placement(spin, row, col)
+        self.assertEqual(state.current_block, TetrisBlockType.I)
+        self.assertEqual(metrics.LINES_CLEARED.value(type='tetris'), tetrises) # not confirmed yet
+        state.resolve_prediction('misdrop')
+        self.assertEqual(metrics.LINES_CLEARED.value(type='tetris'), tetrises)
+        state.predict_placement(spin, row, col)
+        state.resolve_prediction('verified')
+        self.assertEqual(metrics.LINES_CLEARED.value(type='tetris'), tetrises + 4)
+        state.reset()
+
+    def test_server(self):
+        server = metrics.start_server(port=0)
+        self.assertIsNotNone(server)
+        try:
+            metrics.DECISIONS.inc()
+            url = f'http://127.0.0.1:{server.server_address[1]}/metrics'
+            with urllib.request.urlopen(url, timeout=2) as response:
+                body = response.read().decode('utf-8')
+            self.assertIn('# TYPE tetris_decisions_total counter', body)
+            self.assertIn('tetris_stage_latency_seconds', body)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()
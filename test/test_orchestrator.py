@@ -0,0 +1,111 @@
+import os
+import threading
+import time
+import types
+import unittest
+from unittest import mock
+import config.settings
+import _utils
+import alg
+import framesource
+import orchestrator
+from inputbackend import RecordingBackend
+from support import ProfileDirTestCase
+
+ASSETS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'assets')
+
+
+class TestGameContext(unittest.TestCase):
+
+    def test_state_per_context(self):
+        default = alg.GameState()
+        seen = []
+
+        def window():
+            _utils.bind_context('test-window')
+            seen.append(alg.GameState())
+            seen.append(alg.GameState())
+
+        thread = threading.Thread(target=window)
+        thread.start()
+        thread.join()
+        self.assertIs(seen[0], seen[1])
+        self.assertIsNot(seen[0], default)
+        self.assertIs(alg.GameState(), default)
+
+
+class TestFocusScheduler(unittest.TestCase):
+
+    def test_switches(self):
+        sources = [framesource.ReplayFrameSource(os.path.join(ASSETS, 'test2.png')) for _ in range(2)]
+        for source in sources:
+            source.open()
+        scheduler = orchestrator.FocusScheduler(settle=0)
+        backend = RecordingBackend()
+        first, second = (orchestrator.FocusedBackend(backend, scheduler, source) for source in sources)
+        first.tap('left')
+        first.send_sequence([('space', 0, 0)])
+        second.tap('right')
+        self.assertEqual(scheduler.switches, 2)
+        self.assertEqual([source.window.activations for source in sources], [2, 1])
+        self.assertEqual(backend.keys(), ['left', 'space', 'right'])
+
+
+class TestDesktopSources(unittest.TestCase):
+
+    @staticmethod
+    def _window(left, top, width=100, height=200):
+        return types.SimpleNamespace(left=left, top=top, width=width, height=height)
+
+    def test_overlapping_windows(self):
+        windows = [self._window(0, 0), self._window(100, 0), self._window(150, 100), self._window(0, 200)]
+        # touching edges do not overlap
+        self.assertEqual(orchestrator.overlapping_windows(windows), [(1, 2)])
+        self.assertEqual(orchestrator.overlapping_windows(windows[:2] + windows[3:]), [])
+
+    def test_overlap_refused(self):
+        windows = [self._window(0, 0), self._window(50, 50)]
+        with mock.patch.object(_utils.WindowUtils, 'find_tetris_windows', return_value=windows):
+            with self.assertRaises(RuntimeError):
+                orchestrator.desktop_sources(limit=2)
+
+
+class TestOrchestrator(ProfileDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._saved_timeout = config.settings.CV_SPAWN_TIMEOUT
+        config.settings.CV_SPAWN_TIMEOUT = 0.1 # a still frame never spawns
+        self.play_event = threading.Event()
+        self.close_event = threading.Event()
+        self.backend = RecordingBackend()
+        self.sources = [framesource.ReplayFrameSource(os.path.join(ASSETS, 'test2.png')) for _ in range(2)]
+        self.orchestrator = orchestrator.Orchestrator(self.sources, self.play_event, self.close_event,
+                                                      backend=self.backend, search_workers=2)
+
+    def tearDown(self):
+        self.close_event.set()
+        config.settings.CV_SPAWN_TIMEOUT = self._saved_timeout
+
+    def test_plays_every_window(self):
+        result = []
+        thread = threading.Thread(target=lambda: result.append(self.orchestrator.run()))
+        self.play_event.set()
+        thread.start()
+        deadline = time.monotonic() + 10
+        while (min(source.window.activations if source.window else 0 for source in self.sources) == 0
+               and time.monotonic() < deadline):
+            time.sleep(0.01)
+        self.play_event.clear()
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(result, [True])
+        self.assertGreaterEqual(self.backend.keys().count('space'), 2)
+        self.assertGreaterEqual(self.orchestrator.focus.switches, 2)
+        # the windows parsed the frame into their own GameState, the default one is untouched
+        self.assertIsNone(alg.GameState().current_block)
+        self.assertIsNotNone(self.orchestrator.telemetry.latency.percentiles('search'))
+
+
+if __name__ == '__main__':
+    unittest.main()
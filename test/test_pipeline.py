@@ -0,0 +1,142 @@
+import json
+import os
+import threading
+import time
+import unittest
+import config.settings
+import _logger
+import alg
+import cv
+import framesource
+import gamerecord
+import pipeline
+from inputbackend import RecordingBackend
+from support import ProfileDirTestCase
+
+ASSETS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'assets')
+
+
+class TestLatestQueue(unittest.TestCase):
+
+    def test_drops_oldest(self):
+        frames = pipeline.LatestQueue(2)
+        for i in range(5):
+            frames.put(i)
+        self.assertEqual(frames.dropped, 3)
+        self.assertEqual([frames.get(0), frames.get(0)], [3, 4])
+
+
+class TestPipeline(ProfileDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        alg.GameState().reset()
+        self._saved_timeout = config.settings.CV_SPAWN_TIMEOUT
+        config.settings.CV_SPAWN_TIMEOUT = 0.1 # a still frame never spawns
+        self.play_event = threading.Event()
+        self.close_event = threading.Event()
+        self.backend = RecordingBackend()
+        source = framesource.ReplayFrameSource(os.path.join(ASSETS, 'test2.png'))
+        self.sp = cv.ScreenshotProcessor(source=source)
+        self.pipeline = pipeline.Pipeline(self.sp, self.play_event, self.close_event, backend=self.backend)
+
+    def tearDown(self):
+        self.close_event.set()
+        self.sp.close()
+        config.settings.CV_SPAWN_TIMEOUT = self._saved_timeout
+        alg.GameState().reset()
+
+    def _run(self):
+        result = []
+        thread = threading.Thread(target=lambda: result.append(self.pipeline.run()))
+        self.play_event.set()
+        thread.start()
+        return thread, result
+
+    def test_plan_sent_and_stops_on_play_event(self):
+        thread, result = self._run()
+        deadline = time.monotonic() + 5
+        while 'space' not in self.backend.keys() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.play_event.clear()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(result, [True])
+        self.assertIn('space', self.backend.keys())
+        self.assertIsNotNone(self.pipeline.telemetry.latency.percentiles('search'))
+        self.assertIsNotNone(self.pipeline.telemetry.latency.percentiles('perceive'))
+
+    def test_stops_when_source_ended(self):
+        self.sp.source.loop = False # the one frame of test2.png, then the recording ends
+        thread, result = self._run()
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertTrue(self.play_event.is_set())
+        self.assertEqual(result, [True])
+        self.assertIn('space', self.backend.keys()) # the block of the last frame was played first
+
+    def test_round_ends_after_consecutive_frames(self):
+        self.assertTrue(self.sp.source.open())
+        latest = self.sp.source.grab()
+        screens = []
+        self.pipeline.screen_classifier.classify = lambda: screens.pop(0)
+        S = cv.ScreenState
+
+        def perceive(*states) -> bool:
+            screens.extend(states)
+            return [self.pipeline._perceive(latest) for _ in states][-1]
+
+        self.assertTrue(perceive(S.PLAYING))
+        self.assertFalse(perceive(S.UNKNOWN, S.GAME_OVER)) # shorter than CV_SCREEN_ROUND_END_FRAMES
+        self.assertIsNotNone(alg.GameState().next_block)
+        self.assertTrue(perceive(S.PLAYING))
+        self.assertFalse(perceive(*[S.UNKNOWN] * config.settings.CV_SCREEN_ROUND_END_FRAMES))
+        self.assertIsNone(alg.GameState().next_block)
+
+    def test_decision_record(self):
+        saved = (config.settings.LOG_DECISIONS, config.settings.LOG_DECISION_DIR)
+        config.settings.LOG_DECISIONS, config.settings.LOG_DECISION_DIR = True, self.profile_dir
+        try:
+            thread, _ = self._run()
+            deadline = time.monotonic() + 5
+            while 'space' not in self.backend.keys() and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.play_event.clear()
+            thread.join(5)
+            _logger.close_decision_log()
+        finally:
+            config.settings.LOG_DECISIONS, config.settings.LOG_DECISION_DIR = saved
+        (name,) = [n for n in os.listdir(self.profile_dir) if n.startswith('decisions.')]
+        with open(os.path.join(self.profile_dir, name), encoding='utf-8') as f:
+            record = json.loads(f.readline())
+        self.assertEqual(record['current'], 'Z')
+        self.assertEqual(record['next'], 'T')
+        self.assertEqual(len(bytes.fromhex(record['board'])), 25)
+        self.assertEqual(record['keys'][-1], 'drop')
+        self.assertIn('search', record)
+
+    def test_game_record(self):
+        path = os.path.join(self.profile_dir, 'game.btr')
+        self.pipeline.game_record = gamerecord.GameRecordWriter(path)
+        thread, _ = self._run()
+        deadline = time.monotonic() + 5
+        while 'space' not in self.backend.keys() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.play_event.clear()
+        thread.join(5)
+        records = gamerecord.read_records(path)
+        self.assertGreaterEqual(len(records), 1)
+        self.assertEqual(gamerecord.piece_from_code(records['current'][0]).value, 'Z')
+        self.assertGreater(records['search'][0], 0)
+
+    def test_stops_on_close_event(self):
+        thread, result = self._run()
+        time.sleep(0.2)
+        self.close_event.set()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertFalse(any(t.is_alive() for t in self.pipeline._threads))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import cProfile
+import json
+import os
+import pstats
+import tempfile
+import threading
+import unittest
+from unittest import mock
+import config.settings
+import profiling
+
+
+class TestSpans(unittest.TestCase):
+
+    def setUp(self):
+        profiling.clear_spans()
+        self._dir = tempfile.TemporaryDirectory()
+        self._saved_dir = config.settings.PROF_OUTPUT_DIR
+        config.settings.PROF_OUTPUT_DIR = self._dir.name
+
+    def tearDown(self):
+        config.settings.PROF_OUTPUT_DIR = self._saved_dir
+        self._dir.cleanup()
+        profiling.clear_spans()
+
+    def test_traced_and_sampled(self):
+        @profiling.traced('test.every')
+        def every():
+            return 1
+
+        @profiling.traced('test.sampled', sample=10)
+        def sampled():
+            return 2
+
+        for _ in range(30):
+            self.assertEqual(every(), 1)
+            self.assertEqual(sampled(), 2)
+        names = [name for name, _, _, _ in profiling.spans()]
+        self.assertEqual(names.count('test.every'), 30)
+        self.assertEqual(names.count('test.sampled'), 3)
+
+    def test_chrome_trace_export(self):
+        with profiling.span('test.outer'):
+            with profiling.span('test.inner'):
+                pass
+        with open(profiling.export_chrome_trace(), encoding='utf-8') as f:
+            events = json.load(f)['traceEvents']
+        self.assertEqual([e['name'] for e in events], ['test.inner', 'test.outer'])
+        inner, outer = events
+        self.assertEqual(outer['ph'], 'X')
+        self.assertLessEqual(outer['ts'], inner['ts'])
+        self.assertGreaterEqual(outer['ts'] + outer['dur'], inner['ts'] + inner['dur'])
+
+    def _capture(self, threads: int) -> list:
+        '''
+        Profile capture over worker threads calling thread_hook(). Return: errors raised in the workers.
+        '''
+        stop = threading.Event()
+        errors = []
+
+        def work():
+            try:
+                while not stop.is_set():
+                    profiling.ProfileCapture.thread_hook()
+                    sum(range(1000))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                profiling.ProfileCapture.thread_exit()
+
+        workers = [threading.Thread(target=work) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        profiling.ProfileCapture.start()
+        stop.wait(0.1)
+        self.path = profiling.ProfileCapture.stop(timeout=2)
+        stop.set()
+        for worker in workers:
+            worker.join(2)
+        self.assertFalse(profiling.ProfileCapture.active())
+        return errors
+
+    def test_profile_capture_merges_threads(self):
+        self.assertEqual(self._capture(threads=2), [])
+        self.assertTrue(self.path and os.path.exists(self.path))
+
+    def test_profile_capture_single_profiler(self):
+        # Python 3.12+ refuses a second enabled profiler
+        enabled = []
+
+        class SingleProfile(cProfile.Profile):
+            def enable(self, *args, **kwargs):
+                if enabled:
+                    raise ValueError('Another profiling tool is already active')
+                enabled.append(self)
+                super().enable(*args, **kwargs)
+
+        with mock.patch.object(profiling.cProfile, 'Profile', SingleProfile):
+            self.assertEqual(self._capture(threads=2), [])
+        self.assertEqual(len(enabled), 1)
+        self.assertIn('<built-in method builtins.sum>', {name for _, _, name in pstats.Stats(self.path).stats})
+
+
+if __name__ == '__main__':
+    unittest.main()
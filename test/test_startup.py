@@ -0,0 +1,84 @@
+import os
+import unittest
+import numpy as np
+import config.settings
+import _utils
+import alg
+import framesource
+import startup
+from _utils import TetrisBlockType as B
+from support import ProfileDirTestCase
+from test_framering import FakeScreen
+
+ASSETS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'assets')
+
+
+class TestPieceTables(unittest.TestCase):
+
+    def test_tables(self):
+        matrix = _utils.Tetrominoes.matrix(B.T, 1)
+        np.testing.assert_array_equal(matrix, np.array(_utils.Tetrominoes.shapes[B.T][1]))
+        self.assertFalse(matrix.flags.writeable)
+        self.assertEqual(_utils.Tetrominoes.col_bounds(B.I, 0), (0, 3))
+        self.assertEqual(_utils.Tetrominoes.col_bounds(B.O, 0), (1, 2))
+        self.assertEqual(_utils.Tetrominoes.Tetris_Col_H[B.T], [[3, 3, 3, 0], [0, 4, 3, 0], [3, 4, 3, 0], [3, 4, 0, 0]])
+
+
+class TestStartup(ProfileDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        alg.GameState().reset()
+
+    def tearDown(self):
+        startup._session = None
+        startup._thread = None
+
+    def _session(self):
+        source = framesource.ReplayFrameSource(os.path.join(ASSETS, 'test2.png'))
+        source.open()
+        return startup.PlaySession(source.window, source)
+
+    def test_warm_search_leaves_game_state(self):
+        startup.warm_search()
+        self.assertIsNone(alg.GameState().current_block)
+
+    def test_preload_picks_profile(self):
+        session = self._session()
+        self.assertTrue(session.preload())
+        self.assertIsNotNone(session.processor.geometry)
+        session.close()
+
+    def test_capture_process_only_while_playing(self):
+        saved = config.settings.CV_CAPTURE_PROCESS
+        config.settings.CV_CAPTURE_PROCESS = True
+        try:
+            session = startup.PlaySession(framesource.ReplayWindow(30, 20))
+        finally:
+            config.settings.CV_CAPTURE_PROCESS = saved
+        session.capture_process.grabber = FakeScreen
+        try:
+            self.assertIsNone(session.capture_process.ring) # not started by the prewarm
+            self.assertIsNone(session.processor.source.grab())
+            for _ in range(2): # started again by the next play session
+                session.begin()
+                self.assertIsNotNone(session.capture_process.ring)
+                session.end()
+                self.assertIsNone(session.capture_process.ring)
+                self.assertIsNone(session.processor.source.grab())
+        finally:
+            session.close()
+
+    def test_take_session(self):
+        self.assertIsNone(startup.take_session(object())) # no prewarm
+        startup.prewarm(find_window=False).join(30)
+        session = self._session()
+        startup._session = session
+        self.assertIsNone(startup.take_session(object())) # another window, closed
+        startup._session = session
+        self.assertIs(startup.take_session(session.window), session)
+        self.assertIsNone(startup._session)
+
+
+if __name__ == '__main__':
+    unittest.main()
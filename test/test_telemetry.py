@@ -0,0 +1,55 @@
+import queue
+import unittest
+import config.settings
+import telemetry
+
+
+class TestLatencyRecorder(unittest.TestCase):
+
+    def test_percentiles(self):
+        recorder = telemetry.LatencyRecorder(samples=100)
+        self.assertIsNone(recorder.percentiles('search'))
+        for i in range(1, 101):
+            recorder.record('search', i / 1000)
+        p50, p99 = recorder.percentiles('search')
+        self.assertAlmostEqual(p50, 0.0505)
+        self.assertAlmostEqual(p99, 0.09901)
+        recorder.reset()
+        self.assertIsNone(recorder.percentiles('search'))
+
+
+class TestTelemetry(unittest.TestCase):
+
+    def test_publish_is_rate_limited_and_never_blocks(self):
+        channel = queue.Queue(maxsize=1)
+        sender = telemetry.Telemetry(channel)
+        sender.record('capture', 0.002)
+        sender.decision()
+        self.assertTrue(sender.publish(autoplay=True))
+        self.assertFalse(sender.publish(autoplay=True)) # within CP_TELEMETRY_INTERVAL
+        self.assertFalse(sender.publish(autoplay=True, force=True)) # channel full, dropped
+        snapshot = telemetry.latest_snapshot(channel)
+        self.assertTrue(snapshot['autoplay'])
+        self.assertGreater(snapshot['decision_rate'], 0)
+        self.assertEqual(snapshot['latency']['capture'], (0.002, 0.002))
+        self.assertIsNone(snapshot['latency']['search'])
+        self.assertIsNone(telemetry.latest_snapshot(channel))
+
+    def test_latest_snapshot_drains(self):
+        channel = queue.Queue()
+        for rate in (1.0, 2.0, 3.0):
+            channel.put({'decision_rate': rate})
+        self.assertEqual(telemetry.latest_snapshot(channel), {'decision_rate': 3.0})
+        self.assertTrue(channel.empty())
+
+    def test_decision_rate_window(self):
+        sender = telemetry.Telemetry()
+        sender._start -= config.settings.CP_TELEMETRY_WINDOW
+        for _ in range(20):
+            sender.decision()
+        sender._decisions[0] -= 2 * config.settings.CP_TELEMETRY_WINDOW # out of the window
+        self.assertAlmostEqual(sender.decision_rate(), 19 / config.settings.CP_TELEMETRY_WINDOW, places=3)
+
+
+if __name__ == '__main__':
+    unittest.main()
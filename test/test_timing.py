@@ -0,0 +1,54 @@
+import unittest
+import numpy as np
+import config.settings
+import timing
+
+class TestGravityEstimator(unittest.TestCase):
+
+    def test_unknown_gravity_uses_max_budget(self):
+        estimator = timing.GravityEstimator()
+        self.assertIsNone(estimator.rows_per_second())
+        self.assertEqual(estimator.decision_budget(np.zeros((20, 10))), config.settings.ALG_SEARCH_BUDGET_MAX)
+
+    def test_rate_over_window(self):
+        estimator = timing.GravityEstimator()
+        estimator.observe_descent(0, 0.1) # short sample without a whole row still counts
+        estimator.observe_descent(2, 0.3)
+        self.assertAlmostEqual(estimator.rows_per_second(), 5.0)
+
+    def test_budget_shrinks_with_speed(self):
+        estimator = timing.GravityEstimator()
+        board = np.zeros((20, 10), dtype=np.int8)
+        board[12:, :9] = 1 # 10 free rows above the stack
+        estimator.observe_descent(1, 0.5)
+        slow = estimator.decision_budget(board, actuation_time=0.2)
+        estimator.reset()
+        estimator.observe_descent(20, 1.0)
+        fast = estimator.decision_budget(board, actuation_time=0.2)
+        self.assertEqual(slow, config.settings.ALG_SEARCH_BUDGET_MAX)
+        self.assertAlmostEqual(fast, max(config.settings.ALG_SEARCH_BUDGET_MIN,
+                                         10 / 20 - 0.2 - config.settings.ALG_BUDGET_SAFETY_MARGIN))
+        self.assertLess(fast, slow)
+
+    def test_budget_subtracts_response_and_plans(self):
+        estimator = timing.GravityEstimator()
+        board = np.zeros((20, 10), dtype=np.int8) # 18 free rows
+        estimator.observe_descent(40, 1.0)
+        self.assertAlmostEqual(estimator.actuation_time(), (config.settings.ALG_ACTUATION_KEYS - 1)
+                               * timing.inputplan.key_interval('left') + timing.inputplan.key_interval('drop'))
+        for seconds in (0.1, 0.3, 0.2):
+            estimator.observe_plan(seconds)
+        estimator.observe_spawn_latency(0.15)
+        self.assertAlmostEqual(estimator.actuation_time(), 0.2)
+        self.assertAlmostEqual(estimator.decision_budget(board), max(config.settings.ALG_SEARCH_BUDGET_MIN,
+                               18 / 40 - 0.15 - 0.2 - config.settings.ALG_BUDGET_SAFETY_MARGIN))
+
+    def test_spawn_latency_median(self):
+        estimator = timing.GravityEstimator()
+        for seconds in (0.2, 0.25, 1.0):
+            estimator.observe_spawn_latency(seconds)
+        self.assertAlmostEqual(estimator.spawn_latency(), 0.25)
+
+
+if __name__ == '__main__':
+    unittest.main()
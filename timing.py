@@ -0,0 +1,103 @@
+"""
+File: timing.py
+Author: KuRRe8
+Created: 2026-10-19
+Description:
+    估计当前方块的下落速度，以及从按下落键到下一个方块出现的延迟(包含锁定和消行动画，作为游戏对输入的响应时间)，
+    据此给出每次决策可以使用的时间预算：方块落到堆叠前的时间，减去游戏的响应时间、按键计划的预计执行时间和安全余量。
+    对局加速后缩短搜索时间，避免方块在决策完成前落到堆叠上。
+"""
+
+import config.settings
+from _logger import logger
+
+from collections import deque
+from typing import Optional
+import numpy as np
+import inputplan
+
+
+class GravityEstimator:
+    '''
+    Sliding window estimates from consecutive frames:
+        descent     rows the falling block moved between the parse frame and the frame before actuation
+        spawn       seconds from the drop key to the next block detected in the spawn area
+        plan        expected_time of the key plans sent (inputplan.InputPlan)
+    '''
+    def __init__(self, window: Optional[int] = None):
+        if window is None:
+            window = config.settings.ALG_GRAVITY_WINDOW
+        self._descent = deque(maxlen=window) # (rows, seconds)
+        self._spawn_latency = deque(maxlen=window)
+        self._plan_time = deque(maxlen=window)
+
+    def reset(self):
+        self._descent.clear()
+        self._spawn_latency.clear()
+        self._plan_time.clear()
+
+    def observe_descent(self, rows: int, seconds: float):
+        if seconds <= 0 or rows < 0:
+            return
+        self._descent.append((rows, seconds))
+
+    def observe_spawn_latency(self, seconds: float):
+        if seconds > 0:
+            self._spawn_latency.append(seconds)
+
+    def observe_plan(self, seconds: float):
+        if seconds >= 0:
+            self._plan_time.append(seconds)
+
+    def rows_per_second(self) -> Optional[float]:
+        '''
+        Total rows over total time of the window, so short samples without a whole row of descent still count.
+        None before the first sample.
+        '''
+        if not self._descent:
+            return None
+        rows = sum(r for r, _ in self._descent)
+        seconds = sum(s for _, s in self._descent)
+        return rows / seconds
+
+    def spawn_latency(self) -> Optional[float]:
+        '''
+        Median drop to spawn latency in seconds, None before the first sample.
+        '''
+        if not self._spawn_latency:
+            return None
+        return float(np.median(self._spawn_latency))
+
+    def actuation_time(self) -> float:
+        '''
+        Median expected time of the recent key plans, before the first plan
+        ALG_ACTUATION_KEYS keys at the calibrated intervals (shifts, then the drop).
+        '''
+        if self._plan_time:
+            return float(np.median(self._plan_time))
+        keys = config.settings.ALG_ACTUATION_KEYS
+        return (keys - 1) * inputplan.key_interval('left') + inputplan.key_interval('drop')
+
+    def decision_budget(self, board: np.ndarray, actuation_time: Optional[float] = None) -> float:
+        '''
+        Seconds search may take for the block that just spawned: time until it falls onto the highest column,
+        minus the game's response to input (spawn_latency(), 0 before the first sample), the time the keys need
+        and a safety margin, clamped to [ALG_SEARCH_BUDGET_MIN, ALG_SEARCH_BUDGET_MAX].
+        :param actuation_time: expected time of the key sequence, defaults to actuation_time().
+        '''
+        budget_max = config.settings.ALG_SEARCH_BUDGET_MAX
+        rate = self.rows_per_second()
+        if not rate:
+            return budget_max
+        rows = board.shape[0]
+        filled = board != 0
+        tops = np.where(filled.any(axis=0), filled.argmax(axis=0), rows)
+        free_rows = max(0, int(tops.min()) - 2) # the block spawns in rows 0-1
+        if actuation_time is None:
+            actuation_time = self.actuation_time()
+        response = self.spawn_latency() or 0.0
+        budget = free_rows / rate - response - actuation_time - config.settings.ALG_BUDGET_SAFETY_MARGIN
+        budget = min(budget_max, max(config.settings.ALG_SEARCH_BUDGET_MIN, budget))
+        logger.debug(f'gravity {rate:.2f} rows/s, {free_rows} free rows, response {response * 1000:.0f} ms, '
+                     f'keys {actuation_time * 1000:.0f} ms, decision budget {budget * 1000:.0f} ms')
+        return budget